@@ -0,0 +1,216 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Checks of the systemd unit lookup against a fake cgroup tree: unit
+states, the cpu and io rates across reads, restarts and the process scan
+fallback without cgroup v2. Everything runs in a throwaway directory on
+a fake clock. Results are printed as JSON, exit code 1 if a check failed.
+
+	python3 benchmarks/cgroups.py
+"""
+
+import tempfile
+import shutil
+import json
+import sys
+import os
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from modules.config.ConfigLoader import ConfigLoader
+from modules.storage.Storage import Storage
+from modules.metrics.UnitTracker import UnitTracker
+from modules.utils.CgroupScanner import CgroupScanner
+from modules.utils.ProcScanner import ProcScanner
+from modules.utils.Stats import ServiceStats
+from modules.utils.Exec import Exec
+import modules.metrics.UnitTracker
+
+class FakeClock:
+	"""Stands in for the `time` module of `UnitTracker`"""
+
+	now = 1000000.0
+
+	@staticmethod
+	def time():
+		return FakeClock.now
+
+def fake_unit(unit, pids, usage_usec, memory, rbytes, wbytes, populated=None, cgroup_slice=CgroupScanner.SLICE):
+	"""Write (or rewrite) the cgroup of a unit under `CgroupScanner.ROOT`"""
+	unit_dir = os.path.join(CgroupScanner.ROOT, cgroup_slice, unit)
+	os.makedirs(unit_dir, exist_ok=True)
+	populated = len(pids) > 0 if populated is None else populated
+	for file_name, content in [
+		("cgroup.procs", "".join("%d\n" % each for each in pids)),
+		("cgroup.events", "populated %d\nfrozen 0\n" % (1 if populated else 0)),
+		("cpu.stat", "usage_usec %d\nuser_usec 0\nsystem_usec 0\n" % usage_usec),
+		("memory.current", "%d\n" % memory),
+		# Two devices, summed
+		("io.stat", "179:0 rbytes=%d wbytes=%d rios=1 wios=1 dbytes=0 dios=0\n"
+			"8:0 rbytes=%d wbytes=%d rios=1 wios=1 dbytes=0 dios=0\n" % (rbytes, wbytes, rbytes, wbytes))
+	]:
+		with open(os.path.join(unit_dir, file_name), "w") as unit_file:
+			unit_file.write(content)
+
+def install_fakes(workdir):
+	"""Point the store and the cgroup root at `workdir`"""
+	ConfigLoader.Telemetry["base_dir"] = os.path.join(workdir, "storage")
+	ConfigLoader.Telemetry["base_path"] = os.path.join(workdir, "storage", "telemetry.bin")
+	ConfigLoader.Telemetry["legacy_path"] = os.path.join(workdir, "storage", "telemetry.json")
+	CgroupScanner.ROOT = os.path.join(workdir, "cgroup")
+	os.makedirs(CgroupScanner.ROOT)
+	with open(os.path.join(CgroupScanner.ROOT, "cgroup.controllers"), "w") as controllers_file:
+		controllers_file.write("cpuset cpu io memory pids\n")
+	modules.metrics.UnitTracker.time = FakeClock
+	Storage.autoflush = False
+	Storage.refresh()
+
+def read(units):
+	usage = {}
+	return ServiceStats.unit_get(units, usage=usage), usage
+
+def metric(unit, stat):
+	return UnitTracker.metric(unit, stat)
+
+def check_states():
+	fake_unit("web.service", [300, 301], 0, 8 * 1024 * 1024, 0, 0)
+	# A unit whose processes all live in child cgroups
+	fake_unit("delegated.service", [], 0, 1024, 0, 0, populated=True)
+	fake_unit("stopped.service", [], 0, 0, 0, 0)
+	fake_unit("app.service", [900], 0, 2048, 0, 0, cgroup_slice="user.slice")
+	states, usage = read(["web.service", "delegated.service", "stopped.service", "missing.service"])
+	slices = ServiceStats.unit_get(["app.service"], slices={"app.service": "user.slice"})
+	return [
+		("populated unit is up", states["web.service"] == "up"),
+		("populated unit without direct processes is up", states["delegated.service"] == "up"),
+		("unpopulated unit is down", states["stopped.service"] == "down"),
+		("missing unit is down", states["missing.service"] == "down"),
+		("unit in another slice is found", slices["app.service"] == "up"),
+		("instances count the cgroup's processes", usage.get(metric("web.service", UnitTracker.INSTANCES)) == 2.0),
+		("memory is reported in KB", usage.get(metric("web.service", UnitTracker.MEMORY)) == 8192.0),
+		("first read has no rates", metric("web.service", UnitTracker.CPU) not in usage),
+		("first read is no restart", usage.get(metric("web.service", UnitTracker.RESTARTS)) == 0.0),
+		("down units report no usage", not any(
+			each.startswith(UnitTracker.PREFIX + ".stopped.service.") or each.startswith(UnitTracker.PREFIX + ".missing.service.")
+			for each in usage
+		))
+	]
+
+def check_rates():
+	FakeClock.now += 10
+	# 2.5s of CPU, 40KB read and 80KB written per device over 10s
+	fake_unit("web.service", [300, 301], 2500000, 8 * 1024 * 1024, 40960, 81920)
+	_, usage = read(["web.service"])
+	return [
+		("cpu is the usage delta in % of one core", usage.get(metric("web.service", UnitTracker.CPU)) == 25.0),
+		("read rate sums the devices", usage.get(metric("web.service", UnitTracker.READ)) == 8192.0),
+		("write rate sums the devices", usage.get(metric("web.service", UnitTracker.WRITE)) == 16384.0),
+		("same main pid is no restart", usage.get(metric("web.service", UnitTracker.RESTARTS)) == 0.0)
+	]
+
+def check_restarts():
+	results = []
+	FakeClock.now += 10
+	# The main pid is gone, a worker stayed
+	fake_unit("web.service", [301, 450], 3000000, 8 * 1024 * 1024, 40960, 81920)
+	_, usage = read(["web.service"])
+	results.append(("main pid gone is a restart", usage.get(metric("web.service", UnitTracker.RESTARTS)) == 1.0))
+
+	FakeClock.now += 10
+	fake_unit("web.service", [301, 450], 3500000, 8 * 1024 * 1024, 40960, 81920)
+	_, usage = read(["web.service"])
+	results.append(("restart is reported once", usage.get(metric("web.service", UnitTracker.RESTARTS)) == 0.0))
+
+	FakeClock.now += 10
+	# Recreated cgroup, the lowest pid happens to survive
+	fake_unit("web.service", [301], 1000, 8 * 1024 * 1024, 0, 0)
+	_, usage = read(["web.service"])
+	results += [
+		("counter going back is a restart", usage.get(metric("web.service", UnitTracker.RESTARTS)) == 1.0),
+		("no cpu across a counter going back", metric("web.service", UnitTracker.CPU) not in usage),
+		("no io across a counter going back", metric("web.service", UnitTracker.READ) not in usage)
+	]
+
+	FakeClock.now += 10
+	fake_unit("web.service", [301], 1001000, 8 * 1024 * 1024, 0, 0)
+	_, usage = read(["web.service"])
+	results.append(("cpu resumes after a counter going back", usage.get(metric("web.service", UnitTracker.CPU)) == 10.0))
+
+	# Down in between, then up again: the counters were kept
+	FakeClock.now += 10
+	fake_unit("web.service", [], 0, 0, 0, 0)
+	read(["web.service"])
+	FakeClock.now += 10
+	fake_unit("web.service", [700], 0, 1024, 0, 0)
+	states, usage = read(["web.service"])
+	results.append(("coming back up is a restart",
+		states["web.service"] == "up" and usage.get(metric("web.service", UnitTracker.RESTARTS)) == 1.0))
+
+	# A new cron run reads the counters back from the store
+	FakeClock.now += 10
+	UnitTracker.previous = None
+	fake_unit("web.service", [700], 500000, 1024, 0, 0)
+	_, usage = read(["web.service"])
+	results.append(("counters survive a new run", usage.get(metric("web.service", UnitTracker.CPU)) == 5.0))
+	return results
+
+def check_fallback():
+	os.remove(os.path.join(CgroupScanner.ROOT, "cgroup.controllers"))
+	output = (
+		"USER         PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND\n"
+		"root         500  1.5  0.1  12345  2048 ?        Ss   Oct17   0:01 /usr/sbin/nginx -g daemon on;\n"
+		"www          501  0.5  0.1  12345  1024 ?        S    Oct17   0:00 /usr/sbin/nginx -g daemon on;\n"
+		"pi           600  0.0  0.0   6000   500 pts/0    S+   Oct17   0:00 grep nginx\n"
+		"root         700  0.0  0.1  12345  4096 ?        Ss   Oct17   0:00 /usr/bin/python3 /opt/app/main.py\n"
+	).encode("utf-8")
+	Exec.shell = staticmethod(lambda command, get_output=False: (output, 0, b""))
+	ProcScanner.available = staticmethod(lambda: False)
+	usage = {}
+	states = ServiceStats.unit_get(
+		["nginx.service", "sbin.service", "app.service", "missing.service"],
+		fallbacks={"app.service": ("/opt/app/main.py", "substring")},
+		usage=usage
+	)
+	return [
+		("without cgroups a unit is looked up by its stem", states["nginx.service"] == "up"),
+		# `sbin` is in nginx's command line, but not its executable's name
+		("the stem is matched by basename", states["sbin.service"] == "down" and states["missing.service"] == "down"),
+		("a configured process and match are used", states["app.service"] == "up"),
+		("fallback usage is reported as unit metrics",
+			usage.get(metric("nginx.service", UnitTracker.INSTANCES)) == 2.0 and
+			usage.get(metric("nginx.service", UnitTracker.MEMORY)) == 3072.0),
+		("fallback reports no io", metric("nginx.service", UnitTracker.READ) not in usage)
+	]
+
+CHECKS = [check_states, check_rates, check_restarts, check_fallback]
+
+def main():
+	workdir = tempfile.mkdtemp(prefix="raspimon-cgroups-")
+	results = []
+	try:
+		install_fakes(workdir)
+		for each_check in CHECKS:
+			results += [{"check": name, "ok": bool(ok)} for name, ok in each_check()]
+	finally:
+		Storage.close()
+		shutil.rmtree(workdir, ignore_errors=True)
+
+	failed = [each["check"] for each in results if not each["ok"]]
+	print(json.dumps({"results": results, "failed": failed}, indent=4))
+	sys.exit(1 if len(failed) > 0 else 0)
+
+if __name__ == "__main__":
+	main()
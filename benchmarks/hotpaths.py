@@ -0,0 +1,323 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Benchmarks of the check cycle hot paths. Everything runs in a throwaway
+directory against local fakes: host metrics come from a fake collector,
+`ps aux` output is synthetic, units are read from a fake cgroup tree and
+notifications never leave the process. Results are printed as JSON; pass
+an earlier result with `--compare` to flag regressions (exit code 1).
+
+	python3 benchmarks/hotpaths.py > before.json
+	python3 benchmarks/hotpaths.py --compare before.json --tolerance 0.25
+"""
+
+import subprocess
+import statistics
+import platform
+import argparse
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from modules.config.ConfigLoader import ConfigLoader
+from modules.metrics.Collectors import Collectors, MetricCollector
+from modules.comms.TelegramRelay import PiMonBot
+from modules.comms.Outbox import Outbox
+from modules.storage.Storage import Storage
+from modules.alarms.AlertState import AlertState
+from modules.alarms.StreakState import StreakState
+from modules.alarms.Alarms import Alarms
+from modules.utils.ProcScanner import ProcScanner
+from modules.utils.CgroupScanner import CgroupScanner
+from modules.utils.Stats import ServiceStats
+from modules.utils.Exec import Exec
+
+class BenchCollector(MetricCollector):
+	"""`bench.<n>`: deterministic values in [0, 100)"""
+
+	name = "bench"
+	cost = 0
+
+	def collect(self, metrics):
+		return {each: float(sum(each.encode("utf-8")) % 100) for each in metrics}
+
+def fake_ps(processes):
+	"""Synthetic `ps aux` output with `processes` rows"""
+	lines = ["USER         PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND"]
+	for i_p in range(processes):
+		lines.append(
+			"root     %7d  0.%d  0.1  12345  6789 ?        Ss   Oct17   0:0%d /usr/sbin/svc-%d --flag value-%d"
+			% (1000 + i_p, i_p % 10, i_p % 10, i_p, i_p)
+		)
+	return ("\n".join(lines) + "\n").encode("utf-8")
+
+def fake_cgroups(root, units):
+	"""A cgroup v2 tree with `units` running units under `system.slice`"""
+	with open(os.path.join(root, "cgroup.controllers"), "w") as controllers_file:
+		controllers_file.write("cpuset cpu io memory pids\n")
+	for i_u in range(units):
+		unit_dir = os.path.join(root, "system.slice", "svc-%d.service" % i_u)
+		os.makedirs(unit_dir)
+		for file_name, content in [
+			("cgroup.procs", "%d\n%d\n" % (1000 + i_u, 50000 + i_u)),
+			("cgroup.events", "populated 1\nfrozen 0\n"),
+			("cpu.stat", "usage_usec %d\nuser_usec 0\nsystem_usec 0\n" % (i_u * 1000)),
+			("memory.current", "%d\n" % (i_u * 4096)),
+			("io.stat", "179:0 rbytes=%d wbytes=%d rios=1 wios=1 dbytes=0 dios=0\n" % (i_u, i_u))
+		]:
+			with open(os.path.join(unit_dir, file_name), "w") as unit_file:
+				unit_file.write(content)
+
+def install_fakes(workdir, processes):
+	"""Point every path at `workdir` and replace the outside world"""
+	ConfigLoader.Alarms["base_path"] = os.path.join(workdir, "alarms.yaml")
+	ConfigLoader.Alarms["cache_path"] = os.path.join(workdir, "alarms.cache")
+	ConfigLoader.Alerts["state_path"] = os.path.join(workdir, "alert_state.json")
+	ConfigLoader.Alerts["streak_path"] = os.path.join(workdir, "streaks.json")
+	ConfigLoader.Outbox["spool_dir"] = os.path.join(workdir, "outbox")
+	ConfigLoader.Telemetry["base_dir"] = os.path.join(workdir, "storage")
+	ConfigLoader.Telemetry["base_path"] = os.path.join(workdir, "storage", "telemetry.bin")
+	ConfigLoader.Telemetry["legacy_path"] = os.path.join(workdir, "storage", "telemetry.json")
+
+	Collectors.register(BenchCollector())
+	output = fake_ps(processes)
+	Exec.shell = staticmethod(lambda command, get_output=False: (output, 0, b""))
+	ProcScanner.available = staticmethod(lambda: False)
+	CgroupScanner.ROOT = os.path.join(workdir, "cgroup")
+	os.makedirs(CgroupScanner.ROOT)
+	fake_cgroups(CgroupScanner.ROOT, 20)
+	PiMonBot.send = staticmethod(lambda msg="": None)
+	Outbox.kick = staticmethod(lambda: None)
+
+def measure(func, number, repeat):
+	"""Per call timings of `func` in microseconds over `repeat` rounds of
+	`number` calls"""
+	rounds = []
+	for _ in range(repeat):
+		started = time.perf_counter_ns()
+		for _ in range(number):
+			func()
+		rounds.append((time.perf_counter_ns() - started) / number / 1000.0)
+	return {
+		"median_us": round(statistics.median(rounds), 3),
+		"min_us": round(min(rounds), 3),
+		"max_us": round(max(rounds), 3)
+	}
+
+def reset_storage(history):
+	"""Start over with an empty store keeping `history` raw samples"""
+	Storage.close()
+	shutil.rmtree(ConfigLoader.Telemetry["base_dir"], ignore_errors=True)
+	Storage.CONST_VALUE_MAXVALUES = history
+	Storage.autoflush = False
+	Storage.refresh()
+
+def bench_storage(scale, repeat):
+	results = []
+	metrics = ["bench." + str(i_m) for i_m in range(20)]
+	for history in [20, 200, 2000]:
+		reset_storage(history)
+		for _ in range(history):
+			for each_metric in metrics:
+				Storage.add_telemetry(each_metric, 42.0)
+
+		def add():
+			Storage.add_telemetry("bench.0", 42.0)
+
+		def flush():
+			for each_metric in metrics:
+				Storage.add_telemetry(each_metric, 42.0)
+			Storage.flush()
+
+		params = {"history": history, "metrics": len(metrics)}
+		results.append(dict(name="storage.add_telemetry", params=params, **measure(add, 200 * scale, repeat)))
+		results.append(dict(name="storage.flush", params=params, **measure(flush, 5 * scale, repeat)))
+		results.append(dict(name="storage.refresh", params=params, **measure(Storage.refresh, 5 * scale, repeat)))
+	reset_storage(20)
+	return results
+
+def alarm_config(alarms):
+	"""YAML config with `alarms` alarms, a fifth of them on (running)
+	processes and half of the host ones consecutive. Nothing breaches."""
+	lines = ["host:"]
+	processes = alarms // 5
+	for i_a in range(alarms - processes):
+		lines += [
+			"  bench.%d:" % i_a,
+			"    name: \"Bench %d\"" % i_a,
+			"    thresholds:",
+			"      -",
+			"        description: \"Never breaches\"",
+			"        threshold: 1000",
+			"        trend: \"geq\""
+		]
+		if i_a % 2 == 0:
+			lines += ["        consecutive: 3", "        interval: 600"]
+	if processes > 0:
+		lines.append("processes:")
+	for i_a in range(processes):
+		lines += [
+			"  svc%d:" % i_a,
+			"    name: \"Service %d\"" % i_a,
+			"    process: \"svc-%d\"" % i_a,
+			"    match: \"basename\"",
+			"    thresholds:",
+			"      -",
+			"        description: \"Never breaches\"",
+			"        state: \"down\""
+		]
+	return "\n".join(lines) + "\n"
+
+def bench_alarms(scale, repeat):
+	results = []
+	for alarms in [10, 100, 1000]:
+		with open(ConfigLoader.Alarms["base_path"], "w") as config_file:
+			config_file.write(alarm_config(alarms))
+		reset_storage(20)
+		Storage.autoflush = True
+		AlertState.index = None
+		StreakState.index = None
+		# Warm up: validates and caches the config, creates the series
+		Alarms.check()
+		results.append(dict(
+			name="alarms.check", params={"alarms": alarms},
+			**measure(Alarms.check, max(1, scale * (10 if alarms < 1000 else 2)), repeat)
+		))
+	Storage.autoflush = False
+	return results
+
+def bench_processes(scale, repeat, processes):
+	results = []
+	watched = ["svc-" + str(i_p) for i_p in range(0, processes, max(1, processes // 20))]
+	results.append(dict(
+		name="service_stats.psaux", params={"processes": processes},
+		**measure(ServiceStats.psaux, 5 * scale, repeat)
+	))
+	results.append(dict(
+		name="service_stats.process_get", params={"processes": processes, "watched": len(watched)},
+		**measure(lambda: ServiceStats.process_get(watched), 5 * scale, repeat)
+	))
+	# Watching a process that isn't running forces a full sweep
+	results.append(dict(
+		name="service_stats.process_get", params={"processes": processes, "watched": len(watched) + 1, "missing": 1},
+		**measure(lambda: ServiceStats.process_get(watched + ["not-running"]), 5 * scale, repeat)
+	))
+	return results
+
+def bench_units(scale, repeat):
+	results = []
+	reset_storage(20)
+	units = ["svc-" + str(i_u) + ".service" for i_u in range(20)]
+	results.append(dict(
+		name="service_stats.unit_get", params={"watched": len(units)},
+		**measure(lambda: ServiceStats.unit_get(units, usage={}), 5 * scale, repeat)
+	))
+	return results
+
+def bench_summarize(scale, repeat):
+	results = []
+	for alarms in [10, 100, 1000, 10000]:
+		objects = [{
+			"telemetry_name": "Bench " + str(i_a),
+			"threshold_desc": "Above threshold",
+			"threshold_val": 70,
+			"found": 99.5,
+			"status": "firing"
+		} for i_a in range(alarms)]
+		results.append(dict(
+			name="alarms.summarize", params={"alarms": alarms},
+			**measure(lambda: Alarms.summarize(objects, host="bench"), max(1, 100 * scale // alarms), repeat)
+		))
+	return results
+
+SUITES = {
+	"storage": lambda args: bench_storage(args.scale, args.repeat),
+	"alarms": lambda args: bench_alarms(args.scale, args.repeat),
+	"processes": lambda args: bench_processes(args.scale, args.repeat, args.processes),
+	"units": lambda args: bench_units(args.scale, args.repeat),
+	"summarize": lambda args: bench_summarize(args.scale, args.repeat)
+}
+
+def key(result):
+	return result["name"] + json.dumps(result["params"], sort_keys=True)
+
+def compare(results, baseline_path, tolerance):
+	"""Regressions of `results` against an earlier run"""
+	with open(baseline_path) as baseline_file:
+		baseline = {key(each): each for each in json.load(baseline_file)["results"]}
+	regressions = []
+	for each_result in results:
+		before = baseline.get(key(each_result))
+		if before is None or before["median_us"] <= 0:
+			continue
+		ratio = each_result["median_us"] / before["median_us"]
+		each_result["baseline_median_us"] = before["median_us"]
+		each_result["ratio"] = round(ratio, 3)
+		if ratio > 1.0 + tolerance:
+			regressions.append(key(each_result))
+	return regressions
+
+def revision():
+	try:
+		return subprocess.run(
+			["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+			stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+		).stdout.decode("utf-8").strip() or None
+	except OSError:
+		return None
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmarks of the check cycle hot paths")
+	parser.add_argument("--only", default=",".join(SUITES.keys()),
+		help="comma separated suites: " + ", ".join(SUITES.keys()))
+	parser.add_argument("--repeat", type=int, default=5, help="timed rounds per case")
+	parser.add_argument("--scale", type=int, default=1, help="multiplies the calls per round")
+	parser.add_argument("--processes", type=int, default=5000, help="rows of the synthetic ps output")
+	parser.add_argument("--compare", metavar="JSON", help="earlier result to compare against")
+	parser.add_argument("--tolerance", type=float, default=0.25,
+		help="allowed slowdown over the baseline median, as a fraction")
+	args = parser.parse_args()
+
+	workdir = tempfile.mkdtemp(prefix="raspimon-bench-")
+	try:
+		install_fakes(workdir, args.processes)
+		results = []
+		for each_suite in args.only.split(","):
+			results += SUITES[each_suite.strip()](args)
+	finally:
+		Storage.close()
+		shutil.rmtree(workdir, ignore_errors=True)
+
+	report = {
+		"revision": revision(),
+		"python": platform.python_version(),
+		"machine": platform.machine(),
+		"results": results
+	}
+	regressions = []
+	if args.compare:
+		regressions = compare(results, args.compare, args.tolerance)
+		report["regressions"] = regressions
+	print(json.dumps(report, indent=4))
+	sys.exit(1 if len(regressions) > 0 else 0)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,153 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Cold start benchmark for a no-alarm run. Each run is a fresh interpreter
+started with `-X importtime` that imports the entry point and runs one
+check cycle against a throwaway config which can't breach. Fails (exit
+code 1) if the median overhead over a bare interpreter exceeds the budget
+or if a deferred dependency gets imported.
+
+	python3 benchmarks/startup.py --runs 10 --budget-ms 150
+"""
+
+import subprocess
+import statistics
+import argparse
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must not be imported by a run that has nothing to send. `yaml` is
+# only needed when the config cache is cold.
+DEFERRED = ["telegram", "yaml"]
+
+CONFIG = """
+host:
+  cpu:
+    name: "Never breaching CPU alarm"
+    thresholds:
+      -
+        description: "Benchmark threshold"
+        threshold: 1000
+        trend: "geq"
+  mem:
+    name: "Never breaching memory alarm"
+    thresholds:
+      -
+        description: "Benchmark threshold"
+        threshold: 1000
+        trend: "geq"
+
+processes:
+  ghost:
+    name: "Never running process alarm"
+    process: "raspimon-benchmark-ghost"
+    match: "basename"
+    thresholds:
+      -
+        description: "Benchmark threshold"
+        state: "up"
+"""
+
+DRIVER = """
+import sys
+sys.path.insert(0, {repo!r})
+import raspimon
+from modules.alarms.Alarms import Alarms
+if len(Alarms.check()) > 0:
+	sys.exit("benchmark config raised an alarm")
+"""
+
+def timed(args, cwd):
+	started = time.perf_counter()
+	result = subprocess.run(args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	elapsed = (time.perf_counter() - started) * 1000.0
+	if result.returncode != 0:
+		sys.exit(result.stderr.decode("utf-8", "replace"))
+	return elapsed, result.stderr.decode("utf-8", "replace")
+
+def parse_importtime(stderr):
+	"""module -> (self us, cumulative us) from `-X importtime` output"""
+	imports = {}
+	for line in stderr.splitlines():
+		if not line.startswith("import time:") or "[us]" in line:
+			continue
+		self_us, cumulative_us, module = line[len("import time:"):].split("|")
+		imports[module.strip()] = (int(self_us), int(cumulative_us))
+	return imports
+
+def main():
+	parser = argparse.ArgumentParser(description="Cold start benchmark for a no-alarm run")
+	parser.add_argument("--runs", type=int, default=10)
+	parser.add_argument("--budget-ms", type=float, default=150.0,
+		help="allowed median overhead over a bare interpreter")
+	parser.add_argument("--top", type=int, default=15, help="slowest imports to report")
+	args = parser.parse_args()
+
+	workdir = tempfile.mkdtemp(prefix="raspimon-startup-")
+	os.mkdir(os.path.join(workdir, "configs"))
+	with open(os.path.join(workdir, "configs", "alarms.yaml"), "w") as config_file:
+		config_file.write(CONFIG)
+
+	command = [sys.executable, "-X", "importtime", "-c", DRIVER.format(repo=REPO)]
+	bare = [sys.executable, "-c", "pass"]
+
+	# Warm up: fills the config cache and creates the storage
+	timed(command, workdir)
+
+	bare_ms = []
+	run_ms = []
+	imports = {}
+	try:
+		for _ in range(args.runs):
+			bare_ms.append(timed(bare, workdir)[0])
+			elapsed, stderr = timed(command, workdir)
+			run_ms.append(elapsed)
+			imports = parse_importtime(stderr)
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+	violations = sorted(set(
+		module for module in imports.keys()
+		for deferred in DEFERRED
+		if module == deferred or module.startswith(deferred + ".")
+	))
+	overhead_ms = statistics.median(run_ms) - statistics.median(bare_ms)
+	slowest = sorted(imports.items(), key=lambda each: each[1][0], reverse=True)[:args.top]
+
+	report = {
+		"runs": args.runs,
+		"bare_ms": round(statistics.median(bare_ms), 2),
+		"run_ms": round(statistics.median(run_ms), 2),
+		"overhead_ms": round(overhead_ms, 2),
+		"budget_ms": args.budget_ms,
+		"modules_imported": len(imports),
+		"slowest_imports": [
+			{"module": module, "self_us": times[0], "cumulative_us": times[1]}
+			for module, times in slowest
+		],
+		"deferred_violations": violations,
+		"ok": overhead_ms <= args.budget_ms and len(violations) == 0
+	}
+	print(json.dumps(report, indent=4))
+	sys.exit(0 if report["ok"] else 1)
+
+if __name__ == "__main__":
+	main()
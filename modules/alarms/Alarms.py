@@ -17,13 +17,24 @@ limitations under the License.
 
 from modules.comparators.Comparators import NumericComparator, ServiceComparator
 from modules.utils.Stats import HostStats, ServiceStats
+from modules.utils.ProcessMatcher import ProcessMatcher
+from modules.metrics.Collectors import Collectors
+from modules.metrics.Instrument import Instrument
+from modules.metrics.ProcessTracker import ProcessTracker
+from modules.metrics.UnitTracker import UnitTracker
+from modules.alarms.Rules import Rule, RuleBook
+from modules.alarms.AlertState import AlertState
+from modules.alarms.StreakState import StreakState
 from modules.config.ConfigLoader import ConfigLoader
+from modules.query.Query import Query
 from modules.comms.TelegramRelay import PiMonBot
 from modules.storage.Storage import Storage
+from modules.storage.RingFile import RingFile
 from modules.errors.Errors import Errors
 import json
 import time
 import sys
+import re
 
 
 class Alarms:
@@ -34,6 +45,7 @@ class Alarms:
 	"""
 
 	config = {}
+	rules = None
 
 	KEY_HOST = "host"
 	KEY_PROCESSESES = "processes"
@@ -47,9 +59,20 @@ class Alarms:
 	KEY_TREND = "trend"
 	KEY_PROCESS = "process"
 	KEY_STATE = "state"
+	KEY_SAMPLE_INTERVAL = "sample_interval"
+	KEY_MATCH = "match"
+	KEY_UNIT = "unit"
+	KEY_SLICE = "slice"
+	KEY_CLEAR = "clear_threshold"
+	KEY_RENOTIFY = "renotify"
+	KEY_AGGREGATE = "aggregate"
+	KEY_WINDOW = "window"
+	KEY_FULL = "full"
+	KEY_PUSH = "push"
+	KEY_LOCAL_ALERTS = "local_alerts"
 
 	@staticmethod
-	def validate_config(debug=False):
+	def validate_config(debug=False, collector=False):
 		"""Configuration validator. Certain rules need to be maintained
 		in your alarm configuration JSON to ensure that the program loads
 		and works correctly as per expectation. Errors are replayed to
@@ -57,6 +80,8 @@ class Alarms:
 
 		Args:
 				debug (bool, optional): Set True to dry run and print. Defaults to False.
+				collector (bool, optional): Set True when running as a collector,
+				see `collector_errors`. Defaults to False.
 		"""
 
 		errors = []
@@ -78,6 +103,28 @@ class Alarms:
 					errors.append(
 						Errors(Alarms.KEY_NAME + " for alarm " + alarm_name))
 
+				# Host alarms should watch a metric some collector provides
+				if not HostStats.supported(alarm_name):
+					errors.append(Errors(
+						"Host metric " + alarm_name,
+						error_type=Errors.Types.UNRECOGNIZED
+					))
+
+				# The metric is stored under its name, which has to fit the store
+				if not Storage.fits(alarm_name):
+					errors.append(Errors(
+						"Host metric name longer than " + str(RingFile.NAME_SIZE) + " bytes " + alarm_name,
+						error_type=Errors.Types.UNRECOGNIZED
+					))
+
+				# Daemon mode sampling interval, if set, should be a positive number
+				if Alarms.KEY_SAMPLE_INTERVAL in each_alarm and \
+					not Alarms.positive(each_alarm[Alarms.KEY_SAMPLE_INTERVAL]):
+					errors.append(Errors(
+						Alarms.KEY_SAMPLE_INTERVAL + " for alarm " + alarm_name,
+						error_type=Errors.Types.UNRECOGNIZED
+					))
+
 				# Host alarms should contain `thresholds` to work
 				if Alarms.KEY_THRESHOLDS not in each_alarm:
 					errors.append(
@@ -107,6 +154,62 @@ class Alarms:
 									alarm_name,
 									error_type=Errors.Types.UNRECOGNIZED
 								))
+							# Anomaly trends take the deviation in standard deviations
+							elif NumericComparator.is_anomaly(each_threshold[Alarms.KEY_TREND]) and \
+								not Alarms.positive(each_threshold[Alarms.KEY_THRESHOLD]):
+								errors.append(Errors(
+									Alarms.KEY_THRESHOLD + " (standard deviations) in thresholds for alarm " + alarm_name,
+									error_type=Errors.Types.UNRECOGNIZED
+								))
+
+						# Hysteresis clear threshold, if set, should be a number
+						if Alarms.KEY_CLEAR in each_threshold and \
+							not Alarms.numeric(each_threshold[Alarms.KEY_CLEAR]):
+							errors.append(Errors(
+								Alarms.KEY_CLEAR + " in thresholds for alarm " + alarm_name,
+								error_type=Errors.Types.UNRECOGNIZED
+							))
+
+						# Thresholds on an aggregate need a known one and a window (for
+						# percentiles, one the sketches reach back), and judge no
+						# single samples
+						if Alarms.KEY_AGGREGATE in each_threshold or Alarms.KEY_WINDOW in each_threshold:
+							width, buckets = ConfigLoader.Telemetry["sketch"]
+							aggregate = each_threshold.get(Alarms.KEY_AGGREGATE)
+							percentile = isinstance(aggregate, str) and Query.PERCENTILE.match(aggregate) is not None
+							if not percentile and aggregate not in Rule.DERIVATIVES:
+								errors.append(Errors(
+									Alarms.KEY_AGGREGATE + " (eg. p95, " + ", ".join(Rule.DERIVATIVES) +
+									") in thresholds for alarm " + alarm_name,
+									error_type=Errors.Types.UNRECOGNIZED
+								))
+							if not Alarms.positive(each_threshold.get(Alarms.KEY_WINDOW)) or \
+								(percentile and each_threshold[Alarms.KEY_WINDOW] > width * buckets):
+								errors.append(Errors(
+									Alarms.KEY_WINDOW + " (seconds, up to " + str(width * buckets) + " for percentiles) in thresholds for alarm " +
+									alarm_name,
+									error_type=Errors.Types.UNRECOGNIZED
+								))
+							if Alarms.KEY_FULL in each_threshold and not Alarms.numeric(each_threshold[Alarms.KEY_FULL]):
+								errors.append(Errors(
+									Alarms.KEY_FULL + " in thresholds for alarm " + alarm_name,
+									error_type=Errors.Types.UNRECOGNIZED
+								))
+							if Alarms.KEY_CONSEC in each_threshold or \
+								NumericComparator.is_anomaly(each_threshold.get(Alarms.KEY_TREND)):
+								errors.append(Errors(
+									Alarms.KEY_AGGREGATE + " with " + Alarms.KEY_CONSEC + " or an anomaly trend for alarm " +
+									alarm_name,
+									error_type=Errors.Types.UNRECOGNIZED
+								))
+
+						# Reminder interval, if set, should be a non negative number
+						if Alarms.KEY_RENOTIFY in each_threshold and \
+							not (Alarms.numeric(each_threshold[Alarms.KEY_RENOTIFY]) and each_threshold[Alarms.KEY_RENOTIFY] >= 0):
+							errors.append(Errors(
+								Alarms.KEY_RENOTIFY + " in thresholds for alarm " + alarm_name,
+								error_type=Errors.Types.UNRECOGNIZED
+							))
 
 		"""Validate: Process alarms"""
 		if Alarms.config is not None and Alarms.KEY_PROCESSESES in Alarms.config:
@@ -117,11 +220,51 @@ class Alarms:
 					errors.append(
 						Errors(Alarms.KEY_NAME + " for service alarm " + alarm_name))
 
-				# Service alarms should name a process
-				if Alarms.KEY_PROCESS not in each_alarm:
-					errors.append(Errors(Alarms.KEY_PROCESS +
+				# Daemon mode sampling interval, if set, should be a positive number
+				if Alarms.KEY_SAMPLE_INTERVAL in each_alarm and \
+					not Alarms.positive(each_alarm[Alarms.KEY_SAMPLE_INTERVAL]):
+					errors.append(Errors(
+						Alarms.KEY_SAMPLE_INTERVAL + " for service alarm " + alarm_name,
+						error_type=Errors.Types.UNRECOGNIZED
+					))
+
+				# Service alarms should name a process or a systemd unit
+				if Alarms.KEY_PROCESS not in each_alarm and Alarms.KEY_UNIT not in each_alarm:
+					errors.append(Errors(Alarms.KEY_PROCESS + " or " + Alarms.KEY_UNIT +
 								  " for service alarm " + alarm_name))
 
+				# Units and slices are cgroup directories, they can't climb out of the tree
+				for each_key in [Alarms.KEY_UNIT, Alarms.KEY_SLICE]:
+					if each_key in each_alarm and not Alarms.cgroup_name(each_alarm[each_key]):
+						errors.append(Errors(
+							each_key + " " + str(each_alarm[each_key]) + " for service alarm " + alarm_name,
+							error_type=Errors.Types.UNRECOGNIZED
+						))
+
+				# The state is stored under the process or unit name, which has to fit the store
+				for each_key in [Alarms.KEY_PROCESS, Alarms.KEY_UNIT]:
+					if each_key in each_alarm and not Storage.fits(each_alarm[each_key]):
+						errors.append(Errors(
+							each_key + " name longer than " + str(RingFile.NAME_SIZE) + " bytes for service alarm " + alarm_name,
+							error_type=Errors.Types.UNRECOGNIZED
+						))
+
+				# Match mode, if set, should be a known one
+				if Alarms.KEY_MATCH in each_alarm:
+					if each_alarm[Alarms.KEY_MATCH] not in ProcessMatcher.MODES:
+						errors.append(Errors("Match mode " + str(each_alarm[Alarms.KEY_MATCH]) +
+											 " for service alarm " + alarm_name,
+											 error_type=Errors.Types.UNRECOGNIZED
+											 ))
+					elif each_alarm[Alarms.KEY_MATCH] == ProcessMatcher.REGEX and Alarms.KEY_PROCESS in each_alarm:
+						try:
+							re.compile(str(each_alarm[Alarms.KEY_PROCESS]))
+						except re.error:
+							errors.append(Errors("Process regex " + str(each_alarm[Alarms.KEY_PROCESS]) +
+												 " for service alarm " + alarm_name,
+												 error_type=Errors.Types.UNRECOGNIZED
+												 ))
+
 				# Service alarms should contain `thresholds` to work
 				if Alarms.KEY_THRESHOLDS not in each_alarm:
 					errors.append(Errors(Alarms.KEY_THRESHOLDS +
@@ -144,6 +287,31 @@ class Alarms:
 												 error_type=Errors.Types.UNRECOGNIZED
 												 ))
 
+						# Reminder interval, if set, should be a non negative number
+						if Alarms.KEY_RENOTIFY in each_threshold and \
+							not (Alarms.numeric(each_threshold[Alarms.KEY_RENOTIFY]) and each_threshold[Alarms.KEY_RENOTIFY] >= 0):
+							errors.append(Errors(
+								Alarms.KEY_RENOTIFY + " in thresholds for service alarm " + alarm_name,
+								error_type=Errors.Types.UNRECOGNIZED
+							))
+
+		"""Validate: Push to a collector"""
+		if Alarms.config is not None and Alarms.config.get(Alarms.KEY_PUSH):
+			push = Alarms.config[Alarms.KEY_PUSH]
+			if not isinstance(push, dict) or not isinstance(push.get("url"), str):
+				errors.append(Errors("url for push"))
+			else:
+				for each_key in ["batch", "max_age"]:
+					if each_key in push and not Alarms.positive(push[each_key]):
+						errors.append(Errors(
+							each_key + " for push",
+							error_type=Errors.Types.UNRECOGNIZED
+						))
+
+		"""Validate: Thresholds a collector can evaluate"""
+		if collector and Alarms.config is not None:
+			errors += Alarms.collector_errors()
+
 		# Non empty error list means we did encounter one
 		# Report if we can and abort.
 		if len(errors) > 0:
@@ -156,6 +324,57 @@ class Alarms:
 				PiMonBot.send(message)
 			Errors.die("Illegal config. Abort.")
 
+	@staticmethod
+	def collector_errors():
+		"""Thresholds a collector can't evaluate. A host's ring file there
+		only keeps the latest raw samples, none of the rollup tiers, anomaly
+		statistics, sketches or running sums of the local store, so these
+		would never fire.
+
+		Returns:
+			list: `Errors` of the offending thresholds
+		"""
+		errors = []
+		for family, label in [(Alarms.KEY_HOST, "alarm"), (Alarms.KEY_PROCESSESES, "service alarm")]:
+			for alarm_name, each_alarm in (Alarms.config.get(family) or {}).items():
+				for each_threshold in each_alarm.get(Alarms.KEY_THRESHOLDS) or []:
+					if NumericComparator.is_anomaly(each_threshold.get(Alarms.KEY_TREND)):
+						errors.append(Errors(
+							"Anomaly trend on a collector for " + label + " " + alarm_name,
+							error_type=Errors.Types.UNRECOGNIZED
+						))
+					if Alarms.KEY_AGGREGATE in each_threshold:
+						errors.append(Errors(
+							Alarms.KEY_AGGREGATE + " on a collector for " + label + " " + alarm_name,
+							error_type=Errors.Types.UNRECOGNIZED
+						))
+					# Counting more samples than the raw ones in an interval needs the tiers
+					consecutive = each_threshold.get(Alarms.KEY_CONSEC)
+					if Alarms.KEY_INTERVAL in each_threshold and Alarms.numeric(consecutive) and \
+						consecutive > Storage.CONST_VALUE_MAXVALUES:
+						errors.append(Errors(
+							Alarms.KEY_CONSEC + " over " + str(Storage.CONST_VALUE_MAXVALUES) + " with an " +
+							Alarms.KEY_INTERVAL + " on a collector for " + label + " " + alarm_name,
+							error_type=Errors.Types.UNRECOGNIZED
+						))
+		return errors
+
+	@staticmethod
+	def numeric(value):
+		"""Whether a config value is a number"""
+		return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+	@staticmethod
+	def positive(value):
+		"""Whether a config value is a usable positive number"""
+		return Alarms.numeric(value) and value > 0
+
+	@staticmethod
+	def cgroup_name(value):
+		"""Whether a config value is a usable unit or slice name"""
+		return isinstance(value, str) and len(value) > 0 and ".." not in value.split("/") and \
+			not value.startswith("/")
+
 	@staticmethod
 	def skim_configured_host_alarms():
 		configured_alarms = []
@@ -169,17 +388,57 @@ class Alarms:
 		if Alarms.config is not None and Alarms.KEY_PROCESSESES in Alarms.config:
 			for alarm_name in Alarms.config[Alarms.KEY_PROCESSESES].keys():
 				each_alarm = Alarms.config[Alarms.KEY_PROCESSESES][alarm_name]
-				configured_services.append(each_alarm[Alarms.KEY_PROCESS])
+				if Alarms.KEY_UNIT not in each_alarm:
+					configured_services.append(each_alarm[Alarms.KEY_PROCESS])
 		return configured_services
 
 	@staticmethod
-	def init():
+	def skim_configured_units():
+		configured_units = {}
+		if Alarms.config is not None and Alarms.KEY_PROCESSESES in Alarms.config:
+			for alarm_name in Alarms.config[Alarms.KEY_PROCESSESES].keys():
+				each_alarm = Alarms.config[Alarms.KEY_PROCESSESES][alarm_name]
+				if Alarms.KEY_UNIT in each_alarm:
+					configured_units[each_alarm[Alarms.KEY_UNIT]] = each_alarm
+		return configured_units
+
+	@staticmethod
+	def skim_configured_match_modes():
+		configured_modes = {}
+		if Alarms.config is not None and Alarms.KEY_PROCESSESES in Alarms.config:
+			for alarm_name in Alarms.config[Alarms.KEY_PROCESSESES].keys():
+				each_alarm = Alarms.config[Alarms.KEY_PROCESSESES][alarm_name]
+				if Alarms.KEY_MATCH in each_alarm and Alarms.KEY_UNIT not in each_alarm:
+					configured_modes[each_alarm[Alarms.KEY_PROCESS]] = each_alarm[Alarms.KEY_MATCH]
+		return configured_modes
+
+	@staticmethod
+	def init(collector=False):
 		"""Initialize the alarming system. Additionally run some
 		diagnostics to ensure the config is correctly set. Report
-		if this manages to screw up.
+		if this manages to screw up. A configuration which passed
+		validation is cached until the file changes.
+
+		Args:
+			collector (bool, optional): Set True when running as a collector,
+			the configuration is then validated for it even if cached.
+			Defaults to False.
 		"""
-		Alarms.config = ConfigLoader.load_alarms()
-		Alarms.validate_config()
+		with Instrument.phase("config"):
+			Alarms.config = ConfigLoader.load_cached_alarms()
+			cached = Alarms.config is not None
+			if not cached:
+				Alarms.config = ConfigLoader.load_alarms()
+			Collectors.load_plugins(Alarms.config)
+		if not cached or collector:
+			with Instrument.phase("validate"):
+				Alarms.validate_config(collector=collector)
+				ConfigLoader.cache_alarms(Alarms.config)
+		Alarms.rules = Alarms.compile()
+		AlertState.prune(Alarms.rules.keys())
+		StreakState.prune(Alarms.rules.keys())
+		for attribute in [Rule.DERIVED_SKETCH, Rule.DERIVED_DERIVATIVE]:
+			Storage.keep(attribute, Alarms.rules.derived_from(attribute))
 
 	@staticmethod
 	def check():
@@ -195,157 +454,230 @@ class Alarms:
 		Alarms.init()
 		Storage.refresh()
 
-		# Fetch stats as per alarm configuration
-		host_stats = HostStats.get(
-			metrics=Alarms.skim_configured_host_alarms()
-		)
-		process_stats = ServiceStats.process_get(
-			processes=Alarms.skim_configured_service_alarms()
-		)
+		Alarms.collect()
+		touched = Storage.drain_touched()
+		if not Alarms.local_alerts():
+			return []
+		return Alarms.evaluate(touched)
 
-		alarms = []
+	@staticmethod
+	def local_alerts():
+		"""Whether this host evaluates its own alarms. An agent pushing
+		to a collector may leave alerting to it (`push.local_alerts`)."""
+		push = Alarms.config.get(Alarms.KEY_PUSH) or {}
+		return push.get(Alarms.KEY_LOCAL_ALERTS, True) is not False
+
+	@staticmethod
+	def collect(metrics=None, processes=None, units=None):
+		"""Fetch stats as per alarm configuration and dump them
+		to the storage.
 
-		# Dump the current metrics to storage
-		for each_stat_type in host_stats.keys():
-			stat_value = host_stats[each_stat_type]
-			Storage.add_telemetry(each_stat_type, stat_value)
-		for each_stat_type in process_stats.keys():
-			stat_value = process_stats[each_stat_type]
-			Storage.add_process_telemetry(each_stat_type, stat_value)
-
-		"""Scan the storage telemetry and see if a breach has occurred.
-		If yes, then append an alarm object to the list which can be 
-		used further.
+		Args:
+				metrics (list, optional): Host metrics to sample. Defaults to
+				all the configured host alarms.
+				processes (list, optional): Processes to look up. Defaults to
+				all the configured service alarms on a process.
+				units (list, optional): Systemd units to look up. Defaults to
+				all the configured service alarms on a unit.
 		"""
-		for each_telemetry_type in Storage.live[Storage.KEY_TELEMETRY]:
-			# Skip if this telemetry is not being tracked anymore
-			if each_telemetry_type not in Alarms.config[Alarms.KEY_HOST]:
-				continue
-
-			telemetry_name = Alarms.config[Alarms.KEY_HOST][each_telemetry_type][Alarms.KEY_NAME]
-			thresholds = Alarms.config[Alarms.KEY_HOST][each_telemetry_type][Alarms.KEY_THRESHOLDS]
-			telemetry_values = Storage.live[Storage.KEY_TELEMETRY][each_telemetry_type][Storage.KEY_VALUES]
-
-			for each_threshold in thresholds:
-				threshold_desc = each_threshold[Alarms.KEY_DESC]
-				comparator = NumericComparator.get(
-					each_threshold[Alarms.KEY_TREND])
+
+		configured_units = Alarms.skim_configured_units()
+		if metrics is None:
+			metrics = Alarms.skim_configured_host_alarms()
+		if processes is None:
+			processes = Alarms.skim_configured_service_alarms()
+		if units is None:
+			units = list(configured_units.keys())
+		# Host alarms on a process' or unit's resource usage need it looked up too
+		processes = processes + [each for each in ProcessTracker.named(metrics) if each not in processes]
+		units = units + [each for each in UnitTracker.named(metrics) if each not in units]
+
+		# Dump the current metrics (and collector counters) to storage in one go
+		with Storage.session():
+			host_stats = HostStats.get(metrics=metrics)
+			process_stats = {}
+			process_usage = {}
+			if len(processes) > 0:
+				with Instrument.phase("ps"):
+					process_stats = ServiceStats.process_get(
+						processes=processes,
+						modes=Alarms.skim_configured_match_modes(),
+						usage=process_usage
+					)
+			if len(units) > 0:
+				with Instrument.phase("units"):
+					process_stats.update(ServiceStats.unit_get(
+						units=units,
+						slices={each: configured_units[each].get(Alarms.KEY_SLICE) for each in configured_units},
+						fallbacks={
+							each: (configured_units[each].get(Alarms.KEY_PROCESS), configured_units[each].get(Alarms.KEY_MATCH))
+							for each in configured_units
+						},
+						usage=process_usage
+					))
+			host_stats.update(process_usage)
+
+			for each_stat_type in host_stats.keys():
+				stat_value = host_stats[each_stat_type]
+				Storage.add_telemetry(each_stat_type, stat_value)
+			for each_stat_type in process_stats.keys():
+				stat_value = process_stats[each_stat_type]
+				Storage.add_process_telemetry(each_stat_type, stat_value)
+
+		# Hand the fresh samples to the collector, if pushing to one
+		push = Alarms.config.get(Alarms.KEY_PUSH)
+		if push:
+			from modules.comms.Pusher import Pusher
+			samples = []
+			for kind, name in Storage.touched.keys():
+				buffer = Storage.series(kind, name)
+				samples.append([kind, name, buffer.last_ts(), buffer.last()])
+			Pusher.record(push, samples)
+
+	@staticmethod
+	def compile():
+		"""Compile the loaded alarm configuration into a `RuleBook`. The
+		comparators are bound and the windows resolved once, so that a
+		check cycle doesn't walk the raw configuration again.
+
+		Returns:
+				RuleBook: The rules indexed by the series they watch
+		"""
+		rules = RuleBook()
+		host_alarms = Alarms.config.get(Alarms.KEY_HOST) or {}
+		process_alarms = Alarms.config.get(Alarms.KEY_PROCESSESES) or {}
+
+		for alarm_name in host_alarms.keys():
+			each_alarm = host_alarms[alarm_name]
+			for i_t, each_threshold in enumerate(each_alarm[Alarms.KEY_THRESHOLDS]):
+				comparator = NumericComparator.get(each_threshold[Alarms.KEY_TREND])
 				threshold_val = each_threshold[Alarms.KEY_THRESHOLD]
+				clear_test = None
+				if Alarms.KEY_CLEAR in each_threshold:
+					clear_val = each_threshold[Alarms.KEY_CLEAR]
+					clear_test = lambda value, comparator=comparator, clear_val=clear_val: \
+						not comparator(value, clear_val)
+				rules.add(Rule(
+					key=Alarms.KEY_HOST + "/" + alarm_name + "/" + str(i_t),
+					kind=Storage.KEY_TELEMETRY,
+					series=alarm_name,
+					name=each_alarm[Alarms.KEY_NAME],
+					description=each_threshold[Alarms.KEY_DESC],
+					test=lambda value, comparator=comparator, threshold_val=threshold_val:
+						comparator(value, threshold_val),
+					threshold=threshold_val,
+					consecutive=each_threshold.get(Alarms.KEY_CONSEC) or 0,
+					interval=each_threshold.get(Alarms.KEY_INTERVAL) or 0,
+					clear_test=clear_test,
+					renotify=each_threshold.get(Alarms.KEY_RENOTIFY, ConfigLoader.Alerts["renotify"]),
+					derived=Rule.DERIVED_ANOMALY if NumericComparator.is_anomaly(each_threshold[Alarms.KEY_TREND]) else
+						Rule.derived_for(each_threshold[Alarms.KEY_AGGREGATE]) if Alarms.KEY_AGGREGATE in each_threshold else None,
+					aggregate=each_threshold.get(Alarms.KEY_AGGREGATE),
+					window=each_threshold.get(Alarms.KEY_WINDOW) or 0,
+					full=each_threshold.get(Alarms.KEY_FULL, 100),
+					trend=each_threshold[Alarms.KEY_TREND]
+				))
+
+		for alarm_name in process_alarms.keys():
+			each_alarm = process_alarms[alarm_name]
+			for i_t, each_threshold in enumerate(each_alarm[Alarms.KEY_THRESHOLDS]):
+				# Process states are held numerically, compare against the
+				# encoded state instead of decoding every sample
+				state = Storage.encode_state(each_threshold[Alarms.KEY_STATE])
+				rules.add(Rule(
+					key=Alarms.KEY_PROCESSESES + "/" + alarm_name + "/" + str(i_t),
+					kind=Storage.KEY_PROCESSESES,
+					series=each_alarm.get(Alarms.KEY_UNIT) or each_alarm[Alarms.KEY_PROCESS],
+					name=each_alarm[Alarms.KEY_NAME],
+					description=each_threshold[Alarms.KEY_DESC],
+					test=lambda value, state=state: value == state,
+					threshold=each_threshold[Alarms.KEY_STATE],
+					consecutive=each_threshold.get(Alarms.KEY_CONSEC) or 0,
+					interval=each_threshold.get(Alarms.KEY_INTERVAL) or 0,
+					rule_type=Rule.TYPE_PROCESS,
+					renotify=each_threshold.get(Alarms.KEY_RENOTIFY, ConfigLoader.Alerts["renotify"])
+				))
+
+		return rules
 
-				# If in consecutive mode, then generate an alarm object IFF
-				# the breach occurred in the specified interval and all recent
-				# N data points were violations
-				if Alarms.KEY_CONSEC in each_threshold and each_threshold[Alarms.KEY_CONSEC] > 0:
-					# Confirm if interval data is present to treat it as not-missing, else skip
-					last_time = int(time.time()) - \
-						each_threshold[Alarms.KEY_INTERVAL]
-					present = 0
-					breaches = 0
-
-					i_l = len(telemetry_values) - 1
-					while i_l >= 0:
-						if present == each_threshold[Alarms.KEY_CONSEC]:
-							i_l = 0
-						elif telemetry_values[i_l][Storage.KEY_TS] < last_time:
-							i_l = 0
-						else:
-							present += 1
-							breaches = (breaches + 1) if comparator(
-								telemetry_values[i_l][Storage.KEY_VALUE], threshold_val) else breaches
-						i_l -= 1
-
-					if present >= each_threshold[Alarms.KEY_CONSEC] and breaches >= each_threshold[Alarms.KEY_CONSEC]:
-						# We have an alarm
-						alarms.append({
-							"telemetry_name": telemetry_name,
-							"threshold_desc": threshold_desc,
-							"threshold_val": threshold_val,
-							"found": telemetry_values[-1][Storage.KEY_VALUE]
-						})
-
-				# Else assume that only the most recent stat metric should be used
-				# to see if a violation occurred.
-				else:
-					if comparator(telemetry_values[-1][Storage.KEY_VALUE], threshold_val):
-						# We have an alarm
-						alarms.append({
-							"telemetry_name": telemetry_name,
-							"threshold_desc": threshold_desc,
-							"threshold_val": threshold_val,
-							"found": telemetry_values[-1][Storage.KEY_VALUE]
-						})
-
-		"""Scan the storage process telemetry and see if a breach has occurred.
-		If yes, then append an alarm object to the list which can be 
-		used further.
+	@staticmethod
+	def evaluate(series=None, lookup=None, scope=None):
+		"""Scan the stored telemetry against the compiled alarm rules and
+		advance the alert lifecycle of each judged rule. Only changes are
+		reported: a rule which started firing, a reminder for one which
+		keeps firing past its `renotify` interval, and a resolved one.
+
+		Args:
+				series (iterable, optional): Only evaluate the rules watching
+				these (kind, name) storage series, eg. the ones which just
+				received samples. Defaults to None - all of them.
+				lookup (func, optional): (kind, name) -> buffer. Defaults to
+				the local storage.
+				scope (str, optional): Alert state scope, eg. the agent host
+				on the collector. Defaults to None - this host.
+
+		Returns:
+				list: A list containing alarm objects (with their `status`)
+				worth a notification
 		"""
-		for each_process_alarm in Alarms.config[Alarms.KEY_PROCESSESES].keys():
-			process_name = Alarms.config[Alarms.KEY_PROCESSESES][each_process_alarm][Alarms.KEY_PROCESS]
-			# Skip if this telemetry is not being tracked anymore
-			if process_name not in Storage.live[Storage.KEY_PROCESSESES]:
-				continue
-			process_alarm = Alarms.config[Alarms.KEY_PROCESSESES][each_process_alarm]
-
-			telemetry_name = process_alarm[Alarms.KEY_NAME]
-			thresholds = process_alarm[Alarms.KEY_THRESHOLDS]
-			telemetry_values = Storage.live[Storage.KEY_PROCESSESES][process_name][Storage.KEY_VALUES]
-
-			for each_threshold in thresholds:
-				threshold_desc = each_threshold[Alarms.KEY_DESC]
-				comparator = ServiceComparator.get(
-					code=each_threshold[Alarms.KEY_STATE]
-				)
-
-				# If in consecutive mode, then generate an alarm object IFF
-				# the breach occurred in the specified interval and all recent
-				# N data points were violations
-				if Alarms.KEY_CONSEC in each_threshold and each_threshold[Alarms.KEY_CONSEC] > 0:
-					# Confirm if interval data is present to treat it as not-missing, else skip
-					last_time = int(time.time()) - \
-						each_threshold[Alarms.KEY_INTERVAL]
-					present = 0
-					breaches = 0
-
-					i_l = len(telemetry_values) - 1
-					while i_l >= 0:
-						if present == each_threshold[Alarms.KEY_CONSEC]:
-							i_l = 0
-						elif telemetry_values[i_l][Storage.KEY_TS] < last_time:
-							i_l = 0
-						else:
-							present += 1
-							breaches = (breaches + 1) if comparator(
-								telemetry_values[i_l][Storage.KEY_VALUE]) else breaches
-						i_l -= 1
-
-					if present >= each_threshold[Alarms.KEY_CONSEC] and breaches >= each_threshold[Alarms.KEY_CONSEC]:
-						# We have an alarm
-						alarms.append({
-							"telemetry_name": telemetry_name,
-							"threshold_desc": threshold_desc,
-							"threshold_val": each_threshold[Alarms.KEY_CONSEC],
-							"found": breaches,
-							"type": Alarms.KEY_PROCESS
-						})
-
-				# Else assume that only the most recent stat metric should be used
-				# to see if a violation occurred.
-				else:
-					if comparator(telemetry_values[-1][Storage.KEY_VALUE]):
-						# We have an alarm
-						alarms.append({
-							"telemetry_name": telemetry_name,
-							"threshold_desc": threshold_desc,
-							"threshold_val": 0,
-							"found": 1,
-							"type": Alarms.KEY_PROCESS
-						})
-
-		# Return the alarms for further processing
+
+		if Alarms.rules is None:
+			Alarms.rules = Alarms.compile()
+
+		now = int(time.time())
+		alarms = []
+		with Instrument.phase("evaluate"):
+			for rule, alarm, buffer in Alarms.rules.judge(lookup or Storage.series, now, series=series, scope=scope):
+				latest = rule.current(buffer, now)
+				if latest is None:
+					# Eg. no samples left in a percentile's window
+					continue
+				event = AlertState.update(rule, alarm, latest, now, scope=scope)
+				if event is None:
+					continue
+				if event == AlertState.EVENT_RESOLVED:
+					alarm = rule.resolution(
+						buffer, Storage.decode_state if rule.rule_type == Rule.TYPE_PROCESS else None, now
+					)
+				alarm["status"] = event
+				alarms.append(alarm)
+
+			AlertState.save()
+			StreakState.save()
 		return alarms
 
 	@staticmethod
-	def summarize(alarms):
+	def check_self():
+		"""Store the `raspimon.*` metrics of the cycle which just ended
+		(see `Instrument`) and evaluate the alarms set on them.
+
+		Returns:
+				list: A list containing alarm objects worth a notification
+		"""
+		with Storage.session():
+			for each_metric, value in Instrument.finish().items():
+				Storage.add_telemetry(each_metric, value)
+		touched = Storage.drain_touched()
+		if not Alarms.local_alerts():
+			return []
+		return Alarms.evaluate(touched)
+
+	@staticmethod
+	def notify(alarms):
+		"""Summarize and relay alarms, if any
+
+		Args:
+				alarms (list): Alarm objects as issued by `check`
+		"""
+		if alarms is None or len(alarms) == 0:
+			return
+		with Instrument.phase("summarize"):
+			message = Alarms.summarize(alarms=alarms)
+		with Instrument.phase("send"):
+			PiMonBot.send(msg=message)
+
+	@staticmethod
+	def summarize(alarms, host=None):
 		"""Generates an alarm summary from a list of alarm
 		objects in HTML parse format glued in a string for
 		easy transport.
@@ -353,6 +685,8 @@ class Alarms:
 		Args:
 				alarms (list): A list of alarm objects as issued
 				by the `check` method
+				host (str, optional): The host the alarms are about.
+				Defaults to None - this host.
 
 		Returns:
 				(String|None): An HTML encoded String if alarms found | None otherwise
@@ -361,13 +695,21 @@ class Alarms:
 		if len(alarms) == 0:
 			return None
 
-		message = "⚠️ ALARM: <code>" + HostStats.platform() + "</code>\n"
-		message += "<i>Threshold limits breached</i>\n\n"
+		host = host if host is not None else HostStats.platform()
+		resolved = [i for i in alarms if i.get("status") == AlertState.EVENT_RESOLVED]
+		if len(resolved) == len(alarms):
+			message = "✅ RESOLVED: <code>" + host + "</code>\n"
+			message += "<i>Back within threshold limits</i>\n\n"
+		else:
+			message = "⚠️ ALARM: <code>" + host + "</code>\n"
+			message += "<i>Threshold limits breached</i>\n\n"
 		message += "Details:\n------------------\n"
 		_c = 1
 		for i in alarms:
 			message += str(_c) + ") <code>"
 			message += "! Service Alert !\n" if "type" in i and i["type"] == Alarms.KEY_PROCESS else ""
+			message += "Resolved\n" if i.get("status") == AlertState.EVENT_RESOLVED else ""
+			message += "Still firing\n" if i.get("status") == AlertState.EVENT_RENOTIFY else ""
 			message += "Name: " + i["telemetry_name"] + "\n"
 			message += "Desc: " + i["threshold_desc"] + "\n"
 			message += "Threshold: " + str(i["threshold_val"]) + "\n"
@@ -376,5 +718,6 @@ class Alarms:
 			message += " -- \n"
 			_c += 1
 
-		message += "Please look at the affected host(s)"
+		if len(resolved) < len(alarms):
+			message += "Please look at the affected host(s)"
 		return message
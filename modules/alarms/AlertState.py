@@ -0,0 +1,154 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from modules.config.ConfigLoader import ConfigLoader
+import json
+import os
+
+class AlertState:
+	"""Persisted lifecycle of every alarm threshold (rule), so that an
+	incident is notified once when it starts, optionally re-notified
+	while it lasts, and once more when it is resolved.
+
+	States:
+		pending:  the latest sample breaches, but the rule isn't met yet
+		firing:   the rule is met, notified
+		resolved: was firing and the latest sample is back on the clear
+				  side of the (possibly different) clear threshold, until
+				  the next evaluation which finds the rule ok
+
+	The index maps a rule key to its entry and only holds rules which
+	left the ok state; it is updated in place and written to disk only
+	when an entry changed.
+	"""
+
+	PENDING = "pending"
+	FIRING = "firing"
+	RESOLVED = "resolved"
+
+	# Events handed back to the caller, worth a notification
+	EVENT_FIRING = "firing"
+	EVENT_RENOTIFY = "renotify"
+	EVENT_RESOLVED = "resolved"
+
+	SCOPE_SEPARATOR = "|"
+
+	index = None
+	dirty = False
+
+	@staticmethod
+	def load():
+		"""Load the state index from disk, once"""
+		if AlertState.index is not None:
+			return
+		AlertState.index = {}
+		try:
+			with open(ConfigLoader.Alerts["state_path"]) as state_file:
+				AlertState.index = json.loads(state_file.read())
+		except (OSError, ValueError):
+			AlertState.index = {}
+		AlertState.dirty = False
+
+	@staticmethod
+	def save():
+		"""Atomically write the state index back if it changed"""
+		if not AlertState.dirty or AlertState.index is None:
+			return
+		state_dir = os.path.dirname(ConfigLoader.Alerts["state_path"])
+		if len(state_dir) > 0 and not os.path.isdir(state_dir):
+			os.makedirs(state_dir)
+		temp_path = ConfigLoader.Alerts["state_path"] + ".tmp"
+		with open(temp_path, "w+") as state_file:
+			state_file.write(json.dumps(AlertState.index, separators=(",", ":")))
+			state_file.flush()
+			os.fsync(state_file.fileno())
+		os.replace(temp_path, ConfigLoader.Alerts["state_path"])
+		AlertState.dirty = False
+
+	@staticmethod
+	def key(rule, scope=None):
+		"""Index key of a rule, optionally scoped (eg. to an agent host)"""
+		return rule.key if scope is None else scope + AlertState.SCOPE_SEPARATOR + rule.key
+
+	@staticmethod
+	def prune(keys):
+		"""Forget the state of rules which are not configured anymore, in
+		every scope
+
+		Args:
+			keys (iterable): Keys of the configured rules
+		"""
+		AlertState.load()
+		keys = set(keys)
+		for each_key in list(AlertState.index.keys()):
+			if each_key.split(AlertState.SCOPE_SEPARATOR)[-1] not in keys:
+				del AlertState.index[each_key]
+				AlertState.dirty = True
+
+	@staticmethod
+	def set(key, state, now, notified=None):
+		entry = {"state": state, "since": now}
+		if notified is not None:
+			entry["notified"] = notified
+		AlertState.index[key] = entry
+		AlertState.dirty = True
+
+	@staticmethod
+	def update(rule, alarm, latest, now, scope=None):
+		"""Advance the lifecycle of a rule after it was judged
+
+		Args:
+			rule (Rule): The judged rule
+			alarm (dict|None): The rule's alarm object if it is met
+			latest (float): The most recent sample of the watched series
+			now (int): Current epoch time
+			scope (str, optional): Keeps the state apart per scope, eg. per
+			agent host on the collector. Defaults to None.
+
+		Returns:
+			(str|None): An `EVENT_*` if this is worth a notification
+		"""
+		AlertState.load()
+		key = AlertState.key(rule, scope)
+		entry = AlertState.index.get(key)
+		state = entry["state"] if entry is not None else None
+
+		if alarm is not None:
+			if state != AlertState.FIRING:
+				AlertState.set(key, AlertState.FIRING, now, notified=now)
+				return AlertState.EVENT_FIRING
+			if rule.renotify > 0 and now - entry.get("notified", 0) >= rule.renotify:
+				entry["notified"] = now
+				AlertState.dirty = True
+				return AlertState.EVENT_RENOTIFY
+			return None
+
+		if state == AlertState.FIRING:
+			# Hysteresis: stay firing until the clear threshold is crossed
+			if rule.cleared(latest):
+				AlertState.set(key, AlertState.RESOLVED, now)
+				return AlertState.EVENT_RESOLVED
+			return None
+
+		if rule.test(latest):
+			if state != AlertState.PENDING:
+				AlertState.set(key, AlertState.PENDING, now)
+		elif state in [AlertState.PENDING, AlertState.RESOLVED]:
+			# Never made it to firing, or already announced resolved: back to ok
+			del AlertState.index[key]
+			AlertState.dirty = True
+		return None
@@ -0,0 +1,326 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from modules.alarms.StreakState import StreakState
+import json
+
+class Rule:
+	"""A single compiled threshold of an alarm. Everything needed to
+	judge a metric's buffer is resolved up front: the comparator is
+	bound to the threshold value and the window is in plain numbers.
+	"""
+
+	TYPE_HOST = "host"
+	TYPE_PROCESS = "process"
+
+	# Buffer attribute judged by the `anomaly*` trends
+	DERIVED_ANOMALY = "anomaly"
+	# Buffer attribute holding the quantile sketches of percentile thresholds
+	DERIVED_SKETCH = "sketch"
+	# Buffer attribute holding the running sums of derivative thresholds
+	DERIVED_DERIVATIVE = "derivative"
+
+	# Aggregates read from the running sums, the others are percentiles
+	AGGREGATE_RATE = "rate"
+	AGGREGATE_SLOPE = "slope"
+	AGGREGATE_FULL = "time_to_full"
+	DERIVATIVES = [AGGREGATE_RATE, AGGREGATE_SLOPE, AGGREGATE_FULL]
+
+	# A rollup tier must split the interval into at least this many buckets
+	MIN_BUCKETS = 4
+
+	def __init__(self, key, kind, series, name, description, test, threshold,
+				 consecutive=0, interval=0, rule_type=TYPE_HOST, clear_test=None, renotify=0, derived=None,
+				 aggregate=None, window=0, full=100, trend=None):
+		"""
+		Args:
+			key (str): Stable identity of the rule, eg. `host/cpu/0`
+			kind (str): Storage family of the watched metric
+			series (str): Storage name of the watched metric
+			name (str): Alarm name, as reported
+			description (str): Threshold description, as reported
+			test (func): value -> bool, True when the value breaches
+			threshold (any): Threshold value, as reported
+			consecutive (int, optional): Breaching samples required in a row.
+			Defaults to 0 - only the latest sample is judged.
+			interval (int, optional): Seconds the consecutive samples must fall
+			in. Defaults to 0 - unbounded.
+			rule_type (str, optional): `TYPE_HOST` or `TYPE_PROCESS`
+			clear_test (func, optional): value -> bool, True when a firing
+			rule may resolve. Defaults to the value not breaching.
+			renotify (int, optional): Seconds between reminders while
+			firing. Defaults to 0 - never.
+			derived (str, optional): Attribute of the metric's buffer holding
+			what is judged instead of its samples, eg. `anomaly` for the
+			deviations of an `anomaly*` trend. Defaults to None - the samples.
+			aggregate (str, optional): Judged instead of the latest sample: a
+			percentile (eg. `p95`) read from the `sketch`, or one of
+			`DERIVATIVES` read from the `derivative`. Defaults to None.
+			window (int, optional): Seconds the aggregate is taken over.
+			full (float, optional): Level `time_to_full` predicts reaching.
+			Defaults to 100 (eg. a disk 100% used).
+			trend (str, optional): Comparator of `test`, as configured. Only
+			part of the `fingerprint`.
+		"""
+		self.key = key
+		self.kind = kind
+		self.series = series
+		self.name = name
+		self.description = description
+		self.test = test
+		self.threshold = threshold
+		self.consecutive = consecutive
+		self.interval = interval
+		self.rule_type = rule_type
+		self.clear_test = clear_test
+		self.renotify = renotify
+		self.derived = derived
+		self.aggregate = aggregate
+		self.quantile = None
+		if aggregate is not None and aggregate not in Rule.DERIVATIVES:
+			self.quantile = float(aggregate[1:]) / 100.0
+		self.window = window
+		self.full = full
+		# Everything `test` and the judged values depend on: state kept
+		# for the rule (eg. a breach streak) is only valid for the same one
+		self.fingerprint = json.dumps(
+			[threshold, trend, consecutive, derived, aggregate, window, full], default=str
+		)
+
+	@staticmethod
+	def derived_for(aggregate):
+		"""Buffer attribute an aggregate is read from"""
+		return Rule.DERIVED_DERIVATIVE if aggregate in Rule.DERIVATIVES else Rule.DERIVED_SKETCH
+
+	def source(self, buffer):
+		"""The buffer this rule judges: the metric's samples or what is
+		derived from them, None if the metric has no such thing"""
+		if self.derived is None:
+			return buffer
+		return getattr(buffer, self.derived, None)
+
+	def current(self, buffer, now):
+		"""The value this rule judges now: the aggregate of the window if
+		there is one, else the newest sample (or deviation)
+
+		Returns:
+			(float|None): None without samples to judge
+		"""
+		judged = self.source(buffer)
+		if judged is None or len(judged) == 0:
+			return None
+		if self.aggregate is not None:
+			return self.aggregated(judged, now)
+		return judged.last()
+
+	def aggregated(self, judged, now):
+		"""The aggregate of the window ending now, None if the window holds
+		too few samples"""
+		since = now - self.window
+		if self.aggregate == Rule.AGGREGATE_RATE:
+			return judged.rate(since)
+		if self.aggregate == Rule.AGGREGATE_SLOPE:
+			return judged.slope(since)
+		if self.aggregate == Rule.AGGREGATE_FULL:
+			return judged.time_to_full(since, now, self.full)
+		return judged.quantile(self.quantile, since)
+
+	def cleared(self, value):
+		"""Whether a firing rule may resolve with this value"""
+		if self.clear_test is not None:
+			return self.clear_test(value)
+		return not self.test(value)
+
+	def tier(self, buffer):
+		"""Pick the rollup tier to count the samples of a window the raw
+		samples can't hold: the coarsest one which keeps the whole interval and still
+		splits it into `MIN_BUCKETS` buckets.
+
+		Returns:
+			(RollupBuffer|None): The tier, None if the metric has none
+		"""
+		rollups = getattr(buffer, "rollups", None) or []
+		if len(rollups) == 0:
+			return None
+		if self.interval <= 0:
+			return rollups[0]
+		spanning = [each for each in rollups if each.width * each.capacity >= self.interval] or [rollups[-1]]
+		fine = [each for each in spanning if each.width * Rule.MIN_BUCKETS <= self.interval]
+		return fine[-1] if len(fine) > 0 else spanning[0]
+
+	def present(self, buffer, since, needed):
+		"""Whether the newest `needed` samples all fall at or after
+		`since`. Past the raw history, the samples are counted on the
+		rollup tier (at bucket granularity).
+		"""
+		if len(buffer) >= needed:
+			return buffer.ts(len(buffer) - needed) >= since
+		tier = self.tier(buffer)
+		if tier is None:
+			return False
+		present = 0
+		i_b = len(tier) - 1
+		while i_b >= 0 and present < needed:
+			start, _, _, _, count, _ = tier.bucket(i_b)
+			if start + tier.width <= since:
+				break
+			present += count
+			i_b -= 1
+		return present >= needed
+
+	def evaluate(self, buffer, now, streak=None):
+		"""Judge a metric's buffer against this rule
+
+		Args:
+			buffer (RingBuffer): The samples of the watched metric
+			now (int): Current epoch time
+			streak (tuple, optional): (breaching samples in a row, time of
+			the first) up to the newest sample, see `StreakState`. Defaults
+			to None - counted from the buffer.
+
+		Returns:
+			(dict|None): An alarm object if breached, None otherwise
+		"""
+		judged = self.source(buffer)
+		if judged is None or len(judged) == 0:
+			return None
+		if self.aggregate is not None:
+			value = self.aggregated(judged, now)
+			if value is None or not self.test(value):
+				return None
+			return self.alarm(self.reported_threshold(judged), value)
+		if self.consecutive > 0:
+			run, first = streak if streak is not None else StreakState.walk(self, judged)[:2]
+			if run < self.consecutive:
+				return None
+			# The newest `consecutive` samples must fall in the interval
+			if self.interval > 0 and first < now - self.interval and \
+				not self.present(judged, now - self.interval, self.consecutive):
+				return None
+			if self.rule_type == Rule.TYPE_PROCESS:
+				return self.alarm(self.consecutive, self.consecutive)
+			return self.alarm(self.reported_threshold(judged), buffer.last())
+
+		if not self.test(judged.last()):
+			return None
+		if self.rule_type == Rule.TYPE_PROCESS:
+			return self.alarm(0, 1)
+		return self.alarm(self.reported_threshold(judged), buffer.last())
+
+	def reported_threshold(self, judged):
+		"""The threshold as reported. Anomaly trends report the band the
+		newest sample was judged on, eg. `3σ around 41.2 (σ 5.1)`, and
+		aggregates what they are taken over, eg. `80 (p95 of 3600s)`."""
+		if self.aggregate is not None:
+			return str(self.threshold) + " (" + self.aggregate + " of " + str(self.window) + "s)"
+		baseline = judged.baseline() if self.derived is not None and hasattr(judged, "baseline") else None
+		if baseline is None:
+			return self.threshold
+		return str(self.threshold) + "σ around " + str(round(baseline[0], 2)) + " (σ " + str(round(baseline[1], 2)) + ")"
+
+	def resolution(self, buffer, decode=None, now=None):
+		"""Alarm object announcing that this rule resolved
+
+		Args:
+			buffer (RingBuffer): The samples of the watched metric
+			decode (func, optional): Turns the latest value into what is
+			reported. Defaults to reporting it as is.
+			now (int, optional): Current epoch time, thresholds on an
+			aggregate report the aggregate of the window ending then
+		"""
+		latest = self.current(buffer, now) if self.aggregate is not None else buffer.last()
+		return self.alarm(
+			self.reported_threshold(self.source(buffer)), decode(latest) if decode is not None else latest
+		)
+
+	def alarm(self, threshold_val, found):
+		alarm = {
+			"telemetry_name": self.name,
+			"threshold_desc": self.description,
+			"threshold_val": threshold_val,
+			"found": found
+		}
+		if self.rule_type == Rule.TYPE_PROCESS:
+			alarm["type"] = Rule.TYPE_PROCESS
+		return alarm
+
+class RuleBook:
+	"""Compiled alarm configuration: every rule indexed by the storage
+	series (kind, name) it watches, so that evaluating a cycle only
+	touches the rules of the metrics that received new samples.
+	"""
+
+	def __init__(self):
+		self.index = {}
+		self.order = []
+
+	def add(self, rule):
+		key = (rule.kind, rule.series)
+		if key not in self.index:
+			self.index[key] = []
+			self.order.append(key)
+		self.index[key].append(rule)
+
+	def __len__(self):
+		return sum(len(rules) for rules in self.index.values())
+
+	def judge(self, lookup, now, series=None, scope=None, streaks=True):
+		"""Run the rules of the passed series
+
+		Args:
+			lookup (func): (kind, name) -> buffer or None
+			now (int): Current epoch time
+			series (iterable, optional): (kind, name) keys which got new
+			samples. Defaults to None - every indexed series.
+			scope (str, optional): Streak scope, see `StreakState`
+			streaks (bool, optional): Advance the kept streaks of the
+			`consecutive` rules. Defaults to True, False counts them from
+			the buffers without keeping anything.
+
+		Returns:
+			generator: (rule, alarm object or None, buffer) per judged rule
+		"""
+		keys = self.order if series is None else [key for key in series if key in self.index]
+		for key in keys:
+			buffer = lookup(key[0], key[1])
+			if buffer is None or len(buffer) == 0:
+				continue
+			for each_rule in self.index[key]:
+				judged = each_rule.source(buffer)
+				if judged is None or len(judged) == 0:
+					continue
+				streak = None
+				if streaks and each_rule.consecutive > 0:
+					streak = StreakState.advance(each_rule, judged, scope)
+				yield each_rule, each_rule.evaluate(buffer, now, streak), buffer
+
+	def keys(self):
+		"""Keys of every compiled rule"""
+		return [rule.key for rules in self.index.values() for rule in rules]
+
+	def derived_from(self, attribute):
+		"""Names of the metrics with a rule judging a buffer attribute, eg.
+		`Rule.DERIVED_SKETCH`"""
+		return [key[1] for key, rules in self.index.items() if any(rule.derived == attribute for rule in rules)]
+
+	def evaluate(self, lookup, now, series=None):
+		"""Stateless evaluation, see `judge`
+
+		Returns:
+			list: Alarm objects of the breached rules
+		"""
+		return [alarm for _, alarm, __ in self.judge(lookup, now, series, streaks=False) if alarm is not None]
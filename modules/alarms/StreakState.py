@@ -0,0 +1,150 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from modules.config.ConfigLoader import ConfigLoader
+from modules.alarms.AlertState import AlertState
+import json
+import os
+
+class StreakState:
+	"""Persisted breach streak of every `consecutive` threshold (rule):
+	how many samples in a row breach, the time of the first of them and
+	the time of the latest sample folded in. A cycle only judges the
+	samples which arrived since, so a window costs the same whether it
+	spans 3 samples or 3000, and can reach back past the raw history.
+
+	An entry also holds the `fingerprint` of the rule it was counted
+	for. A threshold, trend or window edited under the same rule key
+	judges the samples differently, so its streak is rebuilt rather than
+	carried over.
+
+	Only rules on a breaching streak are kept; a missing one is rebuilt
+	by walking back from the newest sample while it breaches, which
+	stops right away in the usual case of the previous sample being ok.
+	The index is written to disk only when an entry changed, ie. while
+	some metric is breaching.
+	"""
+
+	RUN = 0
+	FIRST = 1
+	LAST = 2
+	FINGERPRINT = 3
+
+	index = None
+	dirty = False
+
+	@staticmethod
+	def load():
+		"""Load the streak index from disk, once"""
+		if StreakState.index is not None:
+			return
+		StreakState.index = {}
+		try:
+			with open(ConfigLoader.Alerts["streak_path"]) as streak_file:
+				StreakState.index = json.loads(streak_file.read())
+		except (OSError, ValueError):
+			StreakState.index = {}
+		StreakState.dirty = False
+
+	@staticmethod
+	def save():
+		"""Atomically write the streak index back if it changed"""
+		if not StreakState.dirty or StreakState.index is None:
+			return
+		streak_dir = os.path.dirname(ConfigLoader.Alerts["streak_path"])
+		if len(streak_dir) > 0 and not os.path.isdir(streak_dir):
+			os.makedirs(streak_dir)
+		temp_path = ConfigLoader.Alerts["streak_path"] + ".tmp"
+		with open(temp_path, "w+") as streak_file:
+			streak_file.write(json.dumps(StreakState.index, separators=(",", ":")))
+			streak_file.flush()
+			os.fsync(streak_file.fileno())
+		os.replace(temp_path, ConfigLoader.Alerts["streak_path"])
+		StreakState.dirty = False
+
+	@staticmethod
+	def prune(keys):
+		"""Forget the streaks of rules which are not configured anymore
+
+		Args:
+			keys (iterable): Keys of the configured rules
+		"""
+		StreakState.load()
+		keys = set(keys)
+		for each_key in list(StreakState.index.keys()):
+			if each_key.split(AlertState.SCOPE_SEPARATOR)[-1] not in keys:
+				del StreakState.index[each_key]
+				StreakState.dirty = True
+
+	@staticmethod
+	def walk(rule, buffer):
+		"""Rebuild a streak from the samples at hand
+
+		Returns:
+			list: [run length, first breach time, latest sample time, rule fingerprint]
+		"""
+		run = 0
+		first = None
+		i_l = len(buffer) - 1
+		while i_l >= 0 and rule.test(buffer.value(i_l)):
+			run += 1
+			first = buffer.ts(i_l)
+			i_l -= 1
+		return [run, first, buffer.last_ts(), rule.fingerprint]
+
+	@staticmethod
+	def advance(rule, buffer, scope=None):
+		"""Fold the samples which arrived since the last call into the
+		streak of a rule
+
+		Args:
+			rule (Rule): A rule with a `consecutive` window
+			buffer (RingBuffer): The samples of the watched metric
+			scope (str, optional): See `AlertState.update`
+
+		Returns:
+			(int, int|None): Breaching samples in a row up to the newest one,
+			time of the first of them
+		"""
+		StreakState.load()
+		key = AlertState.key(rule, scope)
+		streak = StreakState.index.get(key)
+		if streak is not None and (len(streak) <= StreakState.FINGERPRINT or
+			streak[StreakState.FINGERPRINT] != rule.fingerprint):
+			streak = None
+		if streak is None:
+			streak = StreakState.walk(rule, buffer)
+		elif streak[StreakState.LAST] < buffer.last_ts():
+			for i_l in range(buffer.bisect(streak[StreakState.LAST] + 1), len(buffer)):
+				if rule.test(buffer.value(i_l)):
+					if streak[StreakState.RUN] == 0:
+						streak[StreakState.FIRST] = buffer.ts(i_l)
+					streak[StreakState.RUN] += 1
+				else:
+					streak[StreakState.RUN] = 0
+					streak[StreakState.FIRST] = None
+			streak[StreakState.LAST] = buffer.last_ts()
+		else:
+			return streak[StreakState.RUN], streak[StreakState.FIRST]
+
+		if streak[StreakState.RUN] > 0:
+			StreakState.index[key] = streak
+			StreakState.dirty = True
+		elif key in StreakState.index:
+			del StreakState.index[key]
+			StreakState.dirty = True
+		return streak[StreakState.RUN], streak[StreakState.FIRST]
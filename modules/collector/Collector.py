@@ -0,0 +1,203 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from modules.scheduler.Scheduler import Scheduler
+from modules.config.ConfigLoader import ConfigLoader
+from modules.comms.TelegramRelay import PiMonBot
+from modules.comms.Outbox import Outbox
+from modules.storage.RingFile import RingFile
+from modules.storage.Storage import Storage
+from modules.alarms.Alarms import Alarms
+from modules.logger.Logger import Logger
+import threading
+import signal
+import hmac
+import json
+import zlib
+import os
+import re
+
+class Collector:
+	"""Central ingest for a fleet of agents. Agents push batches of
+	samples (see `Pusher`) over HTTP; every host gets its own ring file
+	under `hosts_dir` and the collector's alarm configuration is
+	evaluated against the series each batch touched, with the alert
+	lifecycle kept apart per host. Only the collector needs the bot
+	credentials.
+	"""
+
+	HOST_NAME = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+	KINDS = [Storage.KEY_TELEMETRY, Storage.KEY_PROCESSESES]
+
+	# host -> RingFile, one lock guards the rings and the alert state
+	rings = {}
+	lock = threading.Lock()
+
+	scheduler = None
+	server = None
+
+	@staticmethod
+	def ring(host):
+		"""The ring file of a host, opened on first use"""
+		if host not in Collector.rings:
+			hosts_dir = ConfigLoader.Collector["hosts_dir"]
+			if not os.path.isdir(hosts_dir):
+				os.makedirs(hosts_dir)
+			Collector.rings[host] = RingFile.open(
+				os.path.join(hosts_dir, host + ".bin"), Storage.CONST_VALUE_MAXVALUES
+			)
+		return Collector.rings[host]
+
+	@staticmethod
+	def valid(sample):
+		"""Whether a pushed sample is a [kind, name, ts, value] we can store"""
+		return isinstance(sample, list) and len(sample) == 4 and \
+			sample[0] in Collector.KINDS and isinstance(sample[1], str) and \
+			len(sample[1]) > 0 and Storage.fits(sample[1]) and isinstance(sample[2], int) and Alarms.numeric(sample[3])
+
+	@staticmethod
+	def ingest(batch):
+		"""Store a pushed batch and evaluate the alarms of what it touched
+
+		Args:
+			batch (dict): {"host": name, "samples": [[kind, name, ts, value], ...]}
+
+		Returns:
+			int: Samples stored. Samples older than their series' latest
+			one are dropped so that every series stays in time order.
+
+		Raises:
+			ValueError: If the batch is malformed
+		"""
+		if not isinstance(batch, dict) or not isinstance(batch.get("host"), str) or \
+			Collector.HOST_NAME.match(batch["host"]) is None or not isinstance(batch.get("samples"), list):
+			raise ValueError("Malformed batch")
+		host = batch["host"]
+		samples = batch["samples"]
+		if not all(Collector.valid(each_sample) for each_sample in samples):
+			raise ValueError("Malformed sample in batch from " + host)
+
+		with Collector.lock:
+			ring = Collector.ring(host)
+			touched = {}
+			stored = 0
+			for kind, name, ts, value in samples:
+				buffer = ring.get(kind, name, create=True)
+				if len(buffer) > 0 and ts < buffer.last_ts():
+					continue
+				buffer.append(value, ts)
+				touched[(kind, name)] = True
+				stored += 1
+
+			alarms = Alarms.evaluate(
+				series=list(touched.keys()),
+				lookup=lambda kind, name: ring.get(kind, name),
+				scope=host
+			)
+		if len(alarms) > 0:
+			PiMonBot.send(msg=Alarms.summarize(alarms=alarms, host=host))
+		return stored
+
+	@staticmethod
+	def flush():
+		"""Write every host's dirty pages back to disk"""
+		with Collector.lock:
+			for each_ring in Collector.rings.values():
+				each_ring.flush()
+
+	@staticmethod
+	def stop(signum=None, frame=None):
+		"""Signal handler to leave the run loop gracefully"""
+		if Collector.scheduler is not None:
+			Collector.scheduler.stop()
+
+	@staticmethod
+	def serve(listen=None):
+		"""Run the collector in the foreground until SIGTERM/SIGINT
+
+		Args:
+			listen (str, optional): host:port to listen on. Defaults to the
+			loader's `listen`.
+		"""
+		Logger.execution_log()
+		Alarms.init(collector=True)
+		address, port = (listen or ConfigLoader.Collector["listen"]).rsplit(":", 1)
+
+		Collector.server = ThreadingHTTPServer((address, int(port)), IngestHandler)
+		Collector.server.daemon_threads = True
+		threading.Thread(target=Collector.server.serve_forever, name="ingest", daemon=True).start()
+
+		Collector.scheduler = Scheduler()
+		Collector.scheduler.every(
+			ConfigLoader.Collector["flush_interval"], Collector.flush, name="flush", run_now=False
+		)
+		signal.signal(signal.SIGTERM, Collector.stop)
+		signal.signal(signal.SIGINT, Collector.stop)
+
+		Outbox.start_worker()
+		Outbox.kick()
+		try:
+			Collector.scheduler.run()
+		finally:
+			Collector.server.shutdown()
+			Outbox.stop_worker(timeout=PiMonBot.TIMEOUT)
+			with Collector.lock:
+				for each_ring in Collector.rings.values():
+					each_ring.close()
+				Collector.rings = {}
+			Logger.execution_log(False)
+
+class IngestHandler(BaseHTTPRequestHandler):
+	"""POST /ingest with a (gzipped) JSON batch from `Pusher`"""
+
+	def do_POST(self):
+		if self.path != "/ingest":
+			return self.reply(404)
+		token = ConfigLoader.Collector["token"]
+		if token is not None and not hmac.compare_digest(
+			(self.headers.get("X-Raspimon-Token") or "").encode("utf-8"), token.encode("utf-8")
+		):
+			return self.reply(401)
+		try:
+			length = int(self.headers.get("Content-Length", ""))
+		except ValueError:
+			return self.reply(411)
+		if length > ConfigLoader.Collector["max_body"]:
+			return self.reply(413)
+
+		try:
+			body = self.rfile.read(length)
+			if self.headers.get("Content-Encoding") == "gzip":
+				# Bound the inflated size too
+				inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+				body = inflater.decompress(body, ConfigLoader.Collector["max_body"])
+				if len(inflater.unconsumed_tail) > 0:
+					return self.reply(413)
+			Collector.ingest(json.loads(body))
+		except (OSError, ValueError, zlib.error):
+			return self.reply(400)
+		self.reply(204)
+
+	def reply(self, status):
+		self.send_response(status)
+		self.send_header("Content-Length", "0")
+		self.end_headers()
+
+	def log_message(self, format, *args):
+		# Agents push constantly, keep stderr for errors
+		pass
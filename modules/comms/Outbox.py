@@ -0,0 +1,387 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from modules.config.ConfigLoader import ConfigLoader
+from modules.logger.Logger import Logger
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+import threading
+import random
+import fcntl
+import json
+import time
+import sys
+import os
+
+class Outbox:
+	"""Durable outbound notification queue. Messages are spooled to disk
+	(one file each) and delivered by a worker, so that a check never
+	waits on the network and a failed send is never lost.
+
+	The worker sends to a few destinations concurrently, spaces out the
+	messages of a destination, retries with exponential backoff and,
+	when several messages queued up for a destination (eg. during an
+	outage), delivers them as one digest.
+
+	In cron mode the worker is a short lived detached process
+	(`raspimon.py --outbox`), started once per run by `kick_spooled`;
+	the daemon runs it as a thread.
+	"""
+
+	# Delivery callable (msg, destination) -> None, raises on failure.
+	# Defaults to the Telegram bot.
+	sender = None
+
+	worker = None
+	wakeup = threading.Event()
+	stopping = False
+	# Messages were spooled with no worker thread to wake, see `kick_spooled`
+	spooled = False
+
+	# Last delivery time (monotonic) per destination
+	last_sent = {}
+	_seq = 0
+
+	# Exceptions blaming the message itself, retrying it won't help
+	PERMANENT = ["BadRequest"]
+
+	@staticmethod
+	def spool_dir():
+		spool_dir = ConfigLoader.Outbox["spool_dir"]
+		if not os.path.isdir(spool_dir):
+			os.makedirs(spool_dir)
+		return spool_dir
+
+	@staticmethod
+	def write(path, entry):
+		"""Atomically (re)write a spooled message"""
+		with open(path + ".tmp", "w+") as entry_file:
+			entry_file.write(json.dumps(entry))
+			entry_file.flush()
+			os.fsync(entry_file.fileno())
+		os.replace(path + ".tmp", path)
+
+	@staticmethod
+	def enqueue(msg, destination):
+		"""Spool a message for delivery and poke the worker thread, if
+		any. Without one, the caller starts a worker once it is done, see
+		`kick_spooled`. Never touches the network.
+
+		Args:
+			msg (str): The message, plain text or supported HTML
+			destination (str): The chat/channel id to deliver to
+		"""
+		now = time.time()
+		Outbox._seq += 1
+		name = "%d-%d-%d.msg" % (int(now * 1000000), os.getpid(), Outbox._seq)
+		Outbox.write(os.path.join(Outbox.spool_dir(), name), {
+			"destination": destination,
+			"msg": msg,
+			"created": now,
+			"attempts": 0,
+			"next_attempt": now,
+			"solo": False
+		})
+		if Outbox.worker is not None:
+			Outbox.kick()
+		else:
+			Outbox.spooled = True
+
+	@staticmethod
+	def pending():
+		"""Load the spooled messages, oldest first
+
+		Returns:
+			list: (path, entry) tuples
+		"""
+		spool_dir = ConfigLoader.Outbox["spool_dir"]
+		if not os.path.isdir(spool_dir):
+			return []
+		entries = []
+		for name in sorted(os.listdir(spool_dir)):
+			if not name.endswith(".msg"):
+				continue
+			path = os.path.join(spool_dir, name)
+			try:
+				with open(path) as entry_file:
+					entries.append((path, json.loads(entry_file.read())))
+			except (OSError, ValueError):
+				continue
+		return entries
+
+	@staticmethod
+	def due_by_destination(entries, now):
+		"""The due messages of every destination. Messages go out in the
+		order they were spooled: while the oldest message of a destination
+		is backing off, the newer ones wait behind it.
+
+		Args:
+			entries (list): (path, entry) tuples, oldest first
+			now (float): Epoch time
+
+		Returns:
+			dict: destination -> (path, entry) tuples, oldest first
+		"""
+		by_destination = {}
+		blocked = set()
+		for path, entry in entries:
+			destination = entry["destination"]
+			if destination in blocked:
+				continue
+			if entry["next_attempt"] > now:
+				blocked.add(destination)
+				continue
+			by_destination.setdefault(destination, []).append((path, entry))
+		return by_destination
+
+	@staticmethod
+	def next_due():
+		"""Epoch time the next spooled message may be attempted, None if
+		the spool is empty. Only the oldest message of each destination
+		counts, see `due_by_destination`."""
+		heads = {}
+		for _, entry in Outbox.pending():
+			heads.setdefault(entry["destination"], entry["next_attempt"])
+		return min(heads.values()) if len(heads) > 0 else None
+
+	@staticmethod
+	def kick():
+		"""Make sure a worker will look at the spool: wake the daemon's
+		thread, or start a detached drain process in cron mode."""
+		if Outbox.worker is not None:
+			Outbox.wakeup.set()
+			return
+		entry_point = os.path.join(
+			os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+			"raspimon.py"
+		)
+		subprocess.Popen(
+			[sys.executable, entry_point, "--outbox"],
+			stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+			start_new_session=True
+		)
+
+	@staticmethod
+	def kick_if_due():
+		"""Kick the worker if a spooled message is due, eg. a retry"""
+		due = Outbox.next_due()
+		if due is not None and due <= time.time():
+			Outbox.kick()
+
+	@staticmethod
+	def kick_spooled():
+		"""Start a single worker for every message this process spooled,
+		or for a due retry. Cron runs call it once on their way out, so
+		that a run raising many alarms doesn't start a drain process for
+		each of them."""
+		if Outbox.spooled:
+			Outbox.spooled = False
+			Outbox.kick()
+		else:
+			Outbox.kick_if_due()
+
+	@staticmethod
+	def lock():
+		"""Take the spool lock, only one worker may drain at a time
+
+		Returns:
+			(file|None): The held lock file, None if another worker has it
+		"""
+		lock_file = open(os.path.join(Outbox.spool_dir(), ".lock"), "a+")
+		try:
+			fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except OSError:
+			lock_file.close()
+			return None
+		return lock_file
+
+	@staticmethod
+	def batches(entries):
+		"""Coalesce the due messages of one destination into digests
+		which fit in a single message. Messages flagged `solo` (their
+		digest was rejected) are always sent on their own.
+
+		Args:
+			entries (list): (path, entry) tuples, oldest first
+
+		Returns:
+			list: (text, [paths]) tuples
+		"""
+		limit = ConfigLoader.Outbox["digest_limit"]
+		batches = []
+		current = []
+		for path, entry in entries:
+			if entry.get("solo") or len(entry["msg"]) >= limit:
+				batches.append((entry["msg"], [path]))
+				continue
+			size = sum(len(each[1]["msg"]) + 2 for each in current) + len(entry["msg"]) + 64
+			if len(current) > 0 and size > limit:
+				batches.append(Outbox.digest(current))
+				current = []
+			current.append((path, entry))
+		if len(current) > 0:
+			batches.append(Outbox.digest(current))
+		return batches
+
+	@staticmethod
+	def digest(entries):
+		if len(entries) == 1:
+			return entries[0][1]["msg"], [entries[0][0]]
+		text = "📬 <i>" + str(len(entries)) + " notifications queued up</i>\n\n"
+		text += "\n\n".join(entry["msg"] for _, entry in entries)
+		return text, [path for path, _ in entries]
+
+	@staticmethod
+	def backoff(attempts):
+		"""Seconds to wait before attempt number `attempts + 1`"""
+		delay = ConfigLoader.Outbox["backoff_base"] * (2 ** (attempts - 1))
+		delay = min(delay, ConfigLoader.Outbox["backoff_max"])
+		return delay * random.uniform(0.5, 1.0)
+
+	@staticmethod
+	def retry_after(send_error):
+		"""Seconds the destination asked us to wait (eg. Telegram's
+		`RetryAfter` when flood limited), None if it didn't say"""
+		retry_after = getattr(send_error, "retry_after", None)
+		if hasattr(retry_after, "total_seconds"):
+			retry_after = retry_after.total_seconds()
+		if isinstance(retry_after, (int, float)) and not isinstance(retry_after, bool) and retry_after >= 0:
+			return float(retry_after)
+		return None
+
+	@staticmethod
+	def deliver(destination, entries):
+		"""Send the due messages of one destination, in order
+
+		Args:
+			destination (str): The chat/channel id
+			entries (list): (path, entry) tuples, oldest first
+		"""
+		by_path = dict(entries)
+		for text, paths in Outbox.batches(entries):
+			# Per destination rate limit
+			wait = Outbox.last_sent.get(destination, -1e9) + ConfigLoader.Outbox["min_interval"] - time.monotonic()
+			if wait > 0:
+				time.sleep(wait)
+			try:
+				if Outbox.sender is None:
+					from modules.comms.TelegramRelay import PiMonBot
+					Outbox.sender = PiMonBot.deliver
+				Outbox.sender(text, destination)
+			except Exception as send_error:
+				permanent = type(send_error).__name__ in Outbox.PERMANENT
+				retry_after = Outbox.retry_after(send_error)
+				for path in paths:
+					entry = by_path[path]
+					if permanent and len(paths) == 1:
+						# Nothing left to try, keep it aside rather than lose it
+						failed_dir = os.path.join(Outbox.spool_dir(), "failed")
+						if not os.path.isdir(failed_dir):
+							os.makedirs(failed_dir)
+						os.replace(path, os.path.join(failed_dir, os.path.basename(path)))
+						continue
+					entry["solo"] = entry.get("solo") or permanent
+					entry["attempts"] += 1
+					if permanent:
+						entry["next_attempt"] = time.time()
+					elif retry_after is not None:
+						entry["next_attempt"] = time.time() + retry_after
+					else:
+						entry["next_attempt"] = time.time() + Outbox.backoff(entry["attempts"])
+					Outbox.write(path, entry)
+				if not permanent:
+					# The destination is unreachable, keep the order intact
+					return
+				continue
+			finally:
+				Outbox.last_sent[destination] = time.monotonic()
+
+			for path in paths:
+				os.remove(path)
+
+	@staticmethod
+	def drain():
+		"""Deliver every due message once
+
+		Returns:
+			bool: False if another worker holds the spool
+		"""
+		lock_file = Outbox.lock()
+		if lock_file is None:
+			return False
+		try:
+			by_destination = Outbox.due_by_destination(Outbox.pending(), time.time())
+			if len(by_destination) == 0:
+				return True
+
+			with ThreadPoolExecutor(max_workers=ConfigLoader.Outbox["concurrency"]) as pool:
+				for future in [pool.submit(Outbox.deliver, destination, by_destination[destination])
+							   for destination in by_destination.keys()]:
+					future.result()
+		finally:
+			lock_file.close()
+		return True
+
+	@staticmethod
+	def drain_due():
+		"""Cron mode worker: keep draining while messages are due and
+		leave the rest (backing off) for a later run"""
+		while Outbox.drain():
+			due = Outbox.next_due()
+			if due is None or due > time.time():
+				break
+
+	@staticmethod
+	def run_worker():
+		"""Daemon mode worker loop. An error (eg. a full SD card while
+		rewriting a spooled message) is logged and retried after a short
+		wait, it never ends the thread. So is a spool held by another
+		worker (a cron `--outbox` process), rather than polling it."""
+		while not Outbox.stopping:
+			Outbox.wakeup.clear()
+			try:
+				if Outbox.drain():
+					due = Outbox.next_due()
+					wait = 60 if due is None else min(60, max(0.0, due - time.time()))
+				else:
+					wait = ConfigLoader.Outbox["backoff_base"]
+			except Exception as worker_error:
+				try:
+					Logger.error("outbox worker", worker_error)
+				except OSError:
+					pass
+				wait = ConfigLoader.Outbox["backoff_base"]
+			Outbox.wakeup.wait(wait)
+
+	@staticmethod
+	def start_worker():
+		"""Deliver from a background thread (daemon mode)"""
+		if Outbox.worker is not None:
+			return
+		Outbox.stopping = False
+		Outbox.worker = threading.Thread(target=Outbox.run_worker, name="outbox", daemon=True)
+		Outbox.worker.start()
+
+	@staticmethod
+	def stop_worker(timeout=None):
+		"""Stop the background thread. Undelivered messages stay spooled"""
+		if Outbox.worker is None:
+			return
+		Outbox.stopping = True
+		Outbox.wakeup.set()
+		Outbox.worker.join(timeout)
+		Outbox.worker = None
@@ -0,0 +1,212 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from modules.config.ConfigLoader import ConfigLoader
+from modules.logger.Logger import Logger
+import urllib.request
+import urllib.error
+import subprocess
+import platform
+import fcntl
+import json
+import gzip
+import time
+import sys
+import os
+
+class Pusher:
+	"""Agent side of the central collector. Samples are appended to a
+	small spool file and pushed as one gzipped JSON batch once enough of
+	them piled up or the oldest one got too old. A failed push keeps the
+	spool for the next attempt, unless the collector rejected the batch
+	(a 4xx reply): retrying it won't help, it is kept aside in
+	`failed_dir` instead. Spool lines which don't decode (eg. torn by a
+	power cut) are dropped.
+
+	Configured with the `push` section of the alarm configuration:
+
+		push:
+		  url: "http://collector.lan:9321/ingest"
+		  batch: 50
+		  max_age: 120
+
+	The shared secret, if the collector wants one, is read from the
+	RASPIMON_PUSH_TOKEN environment variable.
+	"""
+
+	KEY_URL = "url"
+	KEY_BATCH = "batch"
+	KEY_MAX_AGE = "max_age"
+
+	TOKEN = os.getenv("RASPIMON_PUSH_TOKEN")
+
+	# Long running callers (the daemon) turn this off and push on a schedule
+	autopush = True
+
+	@staticmethod
+	def setting(settings, key):
+		if key in settings:
+			return settings[key]
+		return ConfigLoader.Push[key]
+
+	@staticmethod
+	def locked(mode):
+		"""Open the spool file holding its lock"""
+		spool_path = ConfigLoader.Push["spool_path"]
+		spool_dir = os.path.dirname(spool_path)
+		if len(spool_dir) > 0 and not os.path.isdir(spool_dir):
+			os.makedirs(spool_dir)
+		spool_file = open(spool_path, mode)
+		fcntl.flock(spool_file.fileno(), fcntl.LOCK_EX)
+		return spool_file
+
+	@staticmethod
+	def record(settings, samples):
+		"""Spool samples for the collector and push if a batch is due
+
+		Args:
+			settings (dict): The `push` configuration section
+			samples (list): [kind, name, ts, value] samples
+		"""
+		if len(samples) == 0:
+			return
+		with Pusher.locked("a") as spool_file:
+			for each_sample in samples:
+				spool_file.write(json.dumps(each_sample, separators=(",", ":")) + "\n")
+		if Pusher.autopush and Pusher.due(settings):
+			Pusher.kick()
+
+	@staticmethod
+	def decode(line):
+		"""A spooled [kind, name, ts, value] sample, None if the line is
+		blank or damaged"""
+		try:
+			sample = json.loads(line)
+		except ValueError:
+			return None
+		if not isinstance(sample, list) or len(sample) != 4 or not isinstance(sample[2], (int, float)):
+			return None
+		return sample
+
+	@staticmethod
+	def due(settings):
+		"""Whether the spool holds a full batch or a sample too old to wait.
+		Only the head of the spool is read: the oldest sample and at most
+		a batch of lines, however much piled up during an outage."""
+		if not os.path.isfile(ConfigLoader.Push["spool_path"]):
+			return False
+		batch = Pusher.setting(settings, Pusher.KEY_BATCH)
+		oldest_allowed = time.time() - Pusher.setting(settings, Pusher.KEY_MAX_AGE)
+		count = 0
+		with Pusher.locked("r") as spool_file:
+			for line in spool_file:
+				sample = Pusher.decode(line)
+				if sample is None:
+					continue
+				if count == 0 and sample[2] <= oldest_allowed:
+					return True
+				count += 1
+				if count >= batch:
+					return True
+		return False
+
+	@staticmethod
+	def kick():
+		"""Push from a detached process (`raspimon.py --push`) so that the
+		check never waits on the network."""
+		entry_point = os.path.join(
+			os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+			"raspimon.py"
+		)
+		subprocess.Popen(
+			[sys.executable, entry_point, "--push"],
+			stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+			start_new_session=True
+		)
+
+	@staticmethod
+	def push(settings):
+		"""Send every spooled sample to the collector as one batch
+
+		Args:
+			settings (dict): The `push` configuration section
+
+		Returns:
+			bool: True if the spool was delivered (or empty)
+		"""
+		if Pusher.KEY_URL not in settings:
+			return False
+
+		# Take the batch out of the spool, writers must not wait on the network
+		with Pusher.locked("a+") as spool_file:
+			spool_file.seek(0)
+			lines = [line for line in spool_file if len(line.strip()) > 0]
+			spool_file.seek(0)
+			spool_file.truncate()
+		samples = [each for each in (Pusher.decode(line) for line in lines) if each is not None]
+		if len(samples) < len(lines):
+			Logger.error("push", ValueError(str(len(lines) - len(samples)) + " damaged spool lines dropped"))
+		if len(samples) == 0:
+			return True
+
+		# Bound the spool during long outages, the oldest samples go first
+		samples = samples[-ConfigLoader.Push["max_spool"]:]
+
+		body = gzip.compress(json.dumps({
+			"host": platform.node(),
+			"samples": samples
+		}, separators=(",", ":")).encode("utf-8"))
+		request = urllib.request.Request(settings[Pusher.KEY_URL], data=body, method="POST", headers={
+			"Content-Type": "application/json",
+			"Content-Encoding": "gzip"
+		})
+		if Pusher.TOKEN is not None:
+			request.add_header("X-Raspimon-Token", Pusher.TOKEN)
+		rejected = False
+		try:
+			with urllib.request.urlopen(request, timeout=ConfigLoader.Push["timeout"]) as response:
+				delivered = 200 <= response.status < 300
+		except urllib.error.HTTPError as push_error:
+			delivered = False
+			rejected = 400 <= push_error.code < 500
+			if rejected:
+				Pusher.reject(body, push_error)
+		except (OSError, ValueError):
+			delivered = False
+
+		if not delivered and not rejected:
+			# Put the batch back in front of whatever was spooled meanwhile
+			with Pusher.locked("a+") as spool_file:
+				spool_file.seek(0)
+				newer = spool_file.read()
+				spool_file.seek(0)
+				spool_file.truncate()
+				for each_sample in samples:
+					spool_file.write(json.dumps(each_sample, separators=(",", ":")) + "\n")
+				spool_file.write(newer)
+		return delivered
+
+	@staticmethod
+	def reject(body, push_error):
+		"""Keep a batch the collector refused (eg. a host name it doesn't
+		accept, a wrong token) aside and log why"""
+		Logger.error("push", push_error)
+		failed_dir = ConfigLoader.Push["failed_dir"]
+		if not os.path.isdir(failed_dir):
+			os.makedirs(failed_dir)
+		with open(os.path.join(failed_dir, "%d-%d.json.gz" % (int(time.time() * 1000000), os.getpid())), "wb") as failed_file:
+			failed_file.write(body)
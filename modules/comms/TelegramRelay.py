@@ -15,7 +15,6 @@ limitations under the License.
 
 """
 
-import telegram
 import os
 
 class PiMonBot:
@@ -34,6 +33,7 @@ class PiMonBot:
 	"""
 	
 	bot = None
+	TIMEOUT = 10
 	BOT_TOKEN=os.getenv('PI_BOT_TOKEN')
 	CHANNEL_ID=os.getenv('PI_CHANNEL_ID')
 
@@ -48,11 +48,16 @@ class PiMonBot:
 		"""
 		if not reinit and PiMonBot.bot is not None:
 			return
+		# Deferred, most runs never send anything and the telegram
+		# package pulls in a whole HTTP stack
+		import telegram
 		PiMonBot.bot = telegram.Bot(token=PiMonBot.BOT_TOKEN)
 
 	@staticmethod
 	def send(msg=''):
-		"""Send a message string to a channel using HTML parse mode
+		"""Queue a message for the channel using HTML parse mode. Delivery
+		happens in the background through the `Outbox`, this never waits
+		on the network.
 
 		Args:
 			msg (str, optional): The message to post in plain text or
@@ -60,7 +65,18 @@ class PiMonBot:
 		"""
 		if msg is None or len(str(msg)) == 0:
 			return
-		msg = str(msg)
+		from modules.comms.Outbox import Outbox
+		Outbox.enqueue(str(msg), PiMonBot.CHANNEL_ID)
+
+	@staticmethod
+	def deliver(msg, chat_id):
+		"""Post a message right away, blocking up to `TIMEOUT` seconds.
+		Raises on failure, used by the `Outbox` worker.
+
+		Args:
+			msg (str): The message to post
+			chat_id (str): The channel to post to
+		"""
 		if PiMonBot.bot is None:
 			PiMonBot.init()
-		PiMonBot.bot.sendMessage(parse_mode='html', chat_id=PiMonBot.CHANNEL_ID, text=msg)
+		PiMonBot.bot.sendMessage(parse_mode='html', chat_id=chat_id, text=msg, timeout=PiMonBot.TIMEOUT)
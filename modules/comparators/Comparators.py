@@ -16,9 +16,16 @@ limitations under the License.
 """
 
 class NumericComparator:
-	"""Provides common numeric comparators for easy reference via codes
+	"""Provides common numeric comparators for easy reference via codes.
+	The `anomaly*` ones compare how many standard deviations a sample is
+	away from the metric's running mean against `k`, see `AnomalyBuffer`.
 	"""
 
+	ANOMALY = "anomaly"
+
+	# code -> comparator, built on first use
+	comparators = None
+
 	@staticmethod
 	def lt(a, b):
 		return a < b
@@ -38,16 +45,33 @@ class NumericComparator:
 	@staticmethod
 	def geq(a, b):
 		return a >= b
+
+	@staticmethod
+	def anomaly(score, k):
+		return abs(score) >= k
+
+	@staticmethod
+	def anomaly_above(score, k):
+		return score >= k
+
+	@staticmethod
+	def anomaly_below(score, k):
+		return score <= -k
 	
 	@staticmethod
 	def __get_map():
-		return {
-			"lt": NumericComparator.lt,
-			"gt": NumericComparator.gt,
-			"eq": NumericComparator.eq,
-			"leq": NumericComparator.leq,
-			"geq": NumericComparator.geq
-		}
+		if NumericComparator.comparators is None:
+			NumericComparator.comparators = {
+				"lt": NumericComparator.lt,
+				"gt": NumericComparator.gt,
+				"eq": NumericComparator.eq,
+				"leq": NumericComparator.leq,
+				"geq": NumericComparator.geq,
+				"anomaly": NumericComparator.anomaly,
+				"anomaly_above": NumericComparator.anomaly_above,
+				"anomaly_below": NumericComparator.anomaly_below
+			}
+		return NumericComparator.comparators
 
 	@staticmethod
 	def get(code):
@@ -75,10 +99,18 @@ class NumericComparator:
 		"""
 		return str(code) in NumericComparator.__get_map()
 
+	@staticmethod
+	def is_anomaly(code):
+		"""Whether the code compares deviations rather than values"""
+		return str(code).startswith(NumericComparator.ANOMALY)
+
 class ServiceComparator:
 	"""Provides compartors for a service's status via codes
 	"""
 
+	# code -> comparator, built on first use
+	comparators = None
+
 	@staticmethod
 	def up(state):
 		return str(state) == "up"
@@ -89,10 +121,12 @@ class ServiceComparator:
 
 	@staticmethod
 	def __get_map():
-		return {
-			"down": ServiceComparator.down,
-			"up": ServiceComparator.up
-		}
+		if ServiceComparator.comparators is None:
+			ServiceComparator.comparators = {
+				"down": ServiceComparator.down,
+				"up": ServiceComparator.up
+			}
+		return ServiceComparator.comparators
 	
 	@staticmethod
 	def get(code):
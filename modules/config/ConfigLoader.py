@@ -17,7 +17,10 @@ limitations under the License.
 
 from modules.errors.Errors import Errors
 from modules.utils.Tools import YamlToJSON
+import hashlib
+import marshal
 import json
+import sys
 import os
 
 class ConfigLoader:
@@ -26,6 +29,7 @@ class ConfigLoader:
 
 	Alarms = {
 		"base_path": "configs/alarms.yaml",
+		"cache_path": "storage/alarms.cache",
 		"config": {}
 	}
 
@@ -34,9 +38,71 @@ class ConfigLoader:
 		"execution_log": "execution.log"
 	}
 
+	Alerts = {
+		"state_path": "storage/alert_state.json",
+		"streak_path": "storage/streaks.json",
+		"renotify": 3600
+	}
+
+	Daemon = {
+		"sample_interval": 60,
+		"flush_interval": 300,
+		# host:port of the OpenMetrics endpoint, None to not serve one
+		"exporter": None
+	}
+
+	Metrics = {
+		"workers": 4,
+		"inline_cost": 1,
+		# Seconds the resolved instances of a watched process are trusted
+		# before the processes are swept again for new ones
+		"process_rescan": 300
+	}
+
+	Outbox = {
+		"spool_dir": "storage/outbox",
+		"concurrency": 2,
+		"min_interval": 3,
+		"backoff_base": 5,
+		"backoff_max": 900,
+		"digest_limit": 4096
+	}
+
+	Push = {
+		"spool_path": "storage/push.spool",
+		"failed_dir": "storage/push.failed",
+		"batch": 50,
+		"max_age": 300,
+		"timeout": 10,
+		"max_spool": 100000
+	}
+
+	Collector = {
+		"listen": "0.0.0.0:9321",
+		"hosts_dir": "storage/hosts",
+		"flush_interval": 30,
+		"max_body": 8 * 1024 * 1024,
+		"token": os.getenv("RASPIMON_PUSH_TOKEN")
+	}
+
 	Telemetry = {
 		"base_dir": "storage",
-		"base_path": "storage/monitoring_telemetry.json",
+		"base_path": "storage/monitoring_telemetry.bin",
+		"legacy_path": "storage/monitoring_telemetry.json",
+		# Rollup tiers: [bucket width in seconds, buckets kept]. One day of
+		# minutes, a week of 5 minutes and 8 weeks of hours.
+		"tiers": [[60, 1440], [300, 2016], [3600, 1344]],
+		# Anomaly trends: weight of a new sample in the running mean and
+		# variance, and samples seen before deviations are reported
+		"anomaly_alpha": 0.05,
+		"anomaly_warmup": 30,
+		# Percentile thresholds: [bucket width in seconds, buckets kept] of
+		# the quantile sketches (a day of 5 minutes), and centroids kept per
+		# bucket
+		"sketch": [300, 288],
+		"sketch_centroids": 16,
+		# Rate and slope thresholds: samples kept with their running sums
+		"derivative_history": 1440,
 		"config": {}
 	}
 
@@ -61,9 +127,73 @@ class ConfigLoader:
 		ConfigLoader.Alarms["config"] = alarms
 		return alarms
 	
+	@staticmethod
+	def alarms_fingerprint():
+		"""Fingerprint of the alarms configuration file: its mtime, size
+		and content hash, along with the interpreter version since the
+		cache format depends on it.
+
+		Returns:
+			(list|None): The fingerprint, None if the file is missing
+		"""
+		try:
+			stat = os.stat(ConfigLoader.Alarms["base_path"])
+			with open(ConfigLoader.Alarms["base_path"], "rb") as alarms_file:
+				digest = hashlib.sha1(alarms_file.read()).hexdigest()
+		except OSError:
+			return None
+		return [stat.st_mtime_ns, stat.st_size, digest, list(sys.version_info[:2])]
+
+	@staticmethod
+	def load_cached_alarms():
+		"""Load the already validated alarms configuration from the cache,
+		as long as the configuration file did not change since.
+
+		Returns:
+			(dict|None): The cached configuration, None on a cache miss
+		"""
+		fingerprint = ConfigLoader.alarms_fingerprint()
+		if fingerprint is None:
+			return None
+		try:
+			with open(ConfigLoader.Alarms["cache_path"], "rb") as cache_file:
+				cached = marshal.load(cache_file)
+		except (OSError, EOFError, ValueError, TypeError):
+			return None
+		if not isinstance(cached, dict) or cached.get("fingerprint") != fingerprint:
+			return None
+		ConfigLoader.Alarms["config"] = cached["config"]
+		return cached["config"]
+
+	@staticmethod
+	def cache_alarms(alarms):
+		"""Persist a validated alarms configuration, keyed by the
+		fingerprint of the configuration file. Best effort: a config
+		that can't be cached is simply parsed again next time.
+
+		Args:
+			alarms (dict): The validated configuration
+		"""
+		fingerprint = ConfigLoader.alarms_fingerprint()
+		if fingerprint is None:
+			return
+		temp_path = ConfigLoader.Alarms["cache_path"] + ".tmp"
+		try:
+			cache_dir = os.path.dirname(ConfigLoader.Alarms["cache_path"])
+			if len(cache_dir) > 0 and not os.path.isdir(cache_dir):
+				os.makedirs(cache_dir)
+			with open(temp_path, "wb") as cache_file:
+				marshal.dump({"fingerprint": fingerprint, "config": alarms}, cache_file)
+			os.replace(temp_path, ConfigLoader.Alarms["cache_path"])
+		except (OSError, ValueError):
+			# eg. yaml timestamps can't be marshalled
+			if os.path.exists(temp_path):
+				os.remove(temp_path)
+
 	@staticmethod
 	def load_telemetry():
-		"""Helper to load telemetry stats. No validation is done.
+		"""Helper to load telemetry stats from the legacy JSON store.
+		No validation is done.
 
 		Returns:
 			dict: KV dict derived from the JSON storage for this structure
@@ -71,15 +201,15 @@ class ConfigLoader:
 		telemetry_data = {}
 		contents = ""
 
-		if not os.path.exists(ConfigLoader.Telemetry["base_path"]) or\
-			not os.path.isfile(ConfigLoader.Telemetry["base_path"]):
+		if not os.path.exists(ConfigLoader.Telemetry["legacy_path"]) or\
+			not os.path.isfile(ConfigLoader.Telemetry["legacy_path"]):
 			Errors.throw(
 				category=Errors.Categories.ILLEGAL,
 				error_type=Errors.Types.RESOURCE_MISSING,
-				msg="Missing telemetry data at path " + ConfigLoader.Telemetry["base_path"]
+				msg="Missing telemetry data at path " + ConfigLoader.Telemetry["legacy_path"]
 			)
 		
-		with open(ConfigLoader.Telemetry["base_path"]) as f:
+		with open(ConfigLoader.Telemetry["legacy_path"]) as f:
 			contents = f.read()
 		telemetry_data = json.loads(contents)
 		ConfigLoader.Telemetry["config"] = telemetry_data
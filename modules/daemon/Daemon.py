@@ -0,0 +1,196 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from modules.scheduler.Scheduler import Scheduler
+from modules.config.ConfigLoader import ConfigLoader
+from modules.comms.TelegramRelay import PiMonBot
+from modules.comms.Outbox import Outbox
+from modules.metrics.Collectors import Collectors, SelfCollector
+from modules.metrics.Instrument import Instrument
+from modules.exporter.Exporter import Exporter
+from modules.storage.Storage import Storage
+from modules.alarms.Alarms import Alarms
+from modules.logger.Logger import Logger
+import threading
+import signal
+
+class Daemon:
+	"""Resident mode for raspimon. Loads the alarm configuration, the
+	storage and the bot once and keeps them in memory. Every configured
+	metric is sampled on its own `sample_interval` while the storage
+	is only flushed to disk every `flush_interval` seconds.
+	"""
+
+	scheduler = None
+	pusher = None
+
+	KEY_DAEMON = "daemon"
+	KEY_SAMPLE_INTERVAL = "sample_interval"
+	KEY_FLUSH_INTERVAL = "flush_interval"
+	KEY_EXPORTER = "exporter"
+
+	@staticmethod
+	def setting(key):
+		"""Daemon setting from the `daemon` section of the alarm
+		configuration, falling back to the loader defaults.
+
+		Args:
+			key (str): The setting being looked up
+
+		Returns:
+			number: The configured value
+		"""
+		overrides = Alarms.config.get(Daemon.KEY_DAEMON) or {}
+		if key in overrides and Alarms.positive(overrides[key]):
+			return overrides[key]
+		return ConfigLoader.Daemon[key]
+
+	@staticmethod
+	def sample_groups():
+		"""Group the configured host metrics, processes and units by their
+		sampling interval, so that metrics sharing an interval are
+		collected together (one `ps` sweep for all processes).
+
+		Returns:
+			dict: interval -> (list of host metrics, list of processes, list of units)
+		"""
+		default_interval = Daemon.setting(Daemon.KEY_SAMPLE_INTERVAL)
+		groups = {}
+
+		host_alarms = Alarms.config.get(Alarms.KEY_HOST) or {}
+		for alarm_name in host_alarms.keys():
+			# The alarm's interval, else the one its collector prefers
+			collector = Collectors.find(alarm_name)
+			if isinstance(collector, SelfCollector):
+				# Reported by every cycle, never sampled on their own
+				continue
+			interval = host_alarms[alarm_name].get(
+				Alarms.KEY_SAMPLE_INTERVAL,
+				collector.interval if collector is not None and collector.interval else default_interval
+			)
+			groups.setdefault(interval, ([], [], []))[0].append(alarm_name)
+
+		process_alarms = Alarms.config.get(Alarms.KEY_PROCESSESES) or {}
+		for alarm_name in process_alarms.keys():
+			each_alarm = process_alarms[alarm_name]
+			interval = each_alarm.get(Alarms.KEY_SAMPLE_INTERVAL, default_interval)
+			# Units are read from their cgroup, processes from the process table
+			if Alarms.KEY_UNIT in each_alarm:
+				watched, i_group = each_alarm[Alarms.KEY_UNIT], 2
+			else:
+				watched, i_group = each_alarm[Alarms.KEY_PROCESS], 1
+			if watched not in groups.setdefault(interval, ([], [], []))[i_group]:
+				groups[interval][i_group].append(watched)
+
+		return groups
+
+	@staticmethod
+	def sample(metrics, processes, units):
+		"""Collect one sample of the passed metrics, evaluate only their
+		alarms and relay a summary if any of them went off. The cycle's
+		own `raspimon.*` metrics are stored and evaluated after it.
+
+		Args:
+			metrics (list): Host metrics to sample
+			processes (list): Processes to look up
+			units (list): Systemd units to look up
+		"""
+		with Exporter.lock:
+			Instrument.start()
+			Alarms.collect(metrics=metrics, processes=processes, units=units)
+			Alarms.notify(Alarms.evaluate(Storage.drain_touched()))
+			Alarms.notify(Alarms.check_self())
+			Exporter.invalidate()
+
+	@staticmethod
+	def push(settings):
+		"""Push the spooled samples from a thread, one push at a time"""
+		if Daemon.pusher is not None and Daemon.pusher.is_alive():
+			return
+		from modules.comms.Pusher import Pusher
+		Daemon.pusher = threading.Thread(target=Pusher.push, args=(settings,), name="push", daemon=True)
+		Daemon.pusher.start()
+
+	@staticmethod
+	def stop(signum=None, frame=None):
+		"""Signal handler to leave the run loop gracefully"""
+		if Daemon.scheduler is not None:
+			Daemon.scheduler.stop()
+
+	@staticmethod
+	def run(exporter=None):
+		"""Run raspimon in the foreground until SIGTERM/SIGINT. Storage
+		is flushed one last time on the way out.
+
+		Args:
+			exporter (str, optional): host:port to serve the OpenMetrics
+			endpoint on. Defaults to None - the `daemon` section's
+			`exporter`, if any.
+		"""
+		Logger.execution_log()
+		Storage.refresh()
+		Alarms.init()
+		Storage.autoflush = False
+
+		Daemon.scheduler = Scheduler()
+		groups = Daemon.sample_groups()
+		for interval in sorted(groups.keys()):
+			metrics, processes, units = groups[interval]
+			Daemon.scheduler.every(
+				interval,
+				lambda metrics=metrics, processes=processes, units=units: Daemon.sample(metrics, processes, units),
+				name="sample/" + str(interval)
+			)
+		Daemon.scheduler.every(
+			Daemon.setting(Daemon.KEY_FLUSH_INTERVAL),
+			Storage.commit,
+			name="flush",
+			run_now=False
+		)
+
+		# Push to the collector on a schedule rather than per sample
+		push = Alarms.config.get(Alarms.KEY_PUSH)
+		if push:
+			from modules.comms.Pusher import Pusher
+			Pusher.autopush = False
+			Daemon.scheduler.every(
+				Pusher.setting(push, Pusher.KEY_MAX_AGE),
+				lambda: Daemon.push(push),
+				name="push",
+				run_now=False
+			)
+
+		exporter = exporter or (Alarms.config.get(Daemon.KEY_DAEMON) or {}).get(Daemon.KEY_EXPORTER) or \
+			ConfigLoader.Daemon[Daemon.KEY_EXPORTER]
+		if exporter:
+			Exporter.serve(exporter)
+
+		signal.signal(signal.SIGTERM, Daemon.stop)
+		signal.signal(signal.SIGINT, Daemon.stop)
+
+		# Notifications are delivered from a thread, sampling never waits
+		# on the network
+		Outbox.start_worker()
+		Outbox.kick()
+
+		try:
+			Daemon.scheduler.run()
+		finally:
+			Exporter.stop()
+			Outbox.stop_worker(timeout=PiMonBot.TIMEOUT)
+			Storage.commit()
+			Logger.execution_log(False)
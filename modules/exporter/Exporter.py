@@ -0,0 +1,178 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from modules.alarms.AlertState import AlertState
+from modules.storage.Storage import Storage
+from modules.alarms.Alarms import Alarms
+import threading
+import math
+
+class Exporter:
+	"""OpenMetrics endpoint of the daemon (`GET /metrics`) for Prometheus
+	to scrape. It exposes the latest sample of every stored host metric
+	and process state, and the alert state of every configured rule:
+
+		raspimon_telemetry{metric="cpu"} 12.5
+		raspimon_process_up{process="nginx"} 1
+		raspimon_last_sample_seconds{kind="telemetry",metric="cpu"} 1634567890
+		raspimon_alert{rule="host/cpu/0",name="CPU alarm",raspimon_alert="firing"} 1
+
+	The body is rendered from the in-memory store on the first scrape
+	after a sampling cycle and served as is until the next cycle, so a
+	scrape never collects anything nor reads the disk. A cycle holds
+	`lock` while it touches the store; rendering waits for it.
+	"""
+
+	CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+	# A resolved alert is back to ok, only its notification was pending
+	ALERT_STATES = ["ok", AlertState.PENDING, AlertState.FIRING]
+
+	lock = threading.Lock()
+	# The rendered body, None once stale
+	body = None
+	server = None
+
+	@staticmethod
+	def invalidate():
+		"""Drop the rendered body, new samples arrived"""
+		Exporter.body = None
+
+	@staticmethod
+	def label(value):
+		"""Escape a label value"""
+		return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+	@staticmethod
+	def number(value):
+		if math.isnan(value):
+			return "NaN"
+		if math.isinf(value):
+			return "+Inf" if value > 0 else "-Inf"
+		return repr(float(value))
+
+	@staticmethod
+	def render():
+		"""Render the store in the OpenMetrics text format
+
+		Returns:
+			bytes: The response body
+		"""
+		telemetry = Storage.live.get(Storage.KEY_TELEMETRY) or {}
+		processes = Storage.live.get(Storage.KEY_PROCESSESES) or {}
+		lines = [
+			"# TYPE raspimon_telemetry gauge",
+			"# HELP raspimon_telemetry Latest sample of a host metric."
+		]
+		stamps = []
+		for name in sorted(telemetry.keys()):
+			buffer = telemetry[name]
+			if len(buffer) == 0:
+				continue
+			lines.append("raspimon_telemetry{metric=\"" + Exporter.label(name) + "\"} " + Exporter.number(buffer.last()))
+			stamps.append((Storage.KEY_TELEMETRY, name, buffer.last_ts()))
+
+		lines += [
+			"# TYPE raspimon_process_up gauge",
+			"# HELP raspimon_process_up Whether a watched process was running at the latest sample."
+		]
+		for name in sorted(processes.keys()):
+			buffer = processes[name]
+			if len(buffer) == 0:
+				continue
+			lines.append("raspimon_process_up{process=\"" + Exporter.label(name) + "\"} " + Exporter.number(buffer.last()))
+			stamps.append((Storage.KEY_PROCESSESES, name, buffer.last_ts()))
+
+		lines += [
+			"# TYPE raspimon_last_sample_seconds gauge",
+			"# UNIT raspimon_last_sample_seconds seconds",
+			"# HELP raspimon_last_sample_seconds Epoch time of the latest sample of a series."
+		]
+		for kind, name, ts in stamps:
+			lines.append(
+				"raspimon_last_sample_seconds{kind=\"" + kind + "\",metric=\"" + Exporter.label(name) + "\"} " + str(ts)
+			)
+
+		lines += [
+			"# TYPE raspimon_alert stateset",
+			"# HELP raspimon_alert Alert state of a configured alarm threshold."
+		]
+		# Never load the state from disk here, the daemon already did
+		index = AlertState.index or {}
+		rules = Alarms.rules.index.values() if Alarms.rules is not None else []
+		for each_rule in sorted((rule for group in rules for rule in group), key=lambda rule: rule.key):
+			entry = index.get(AlertState.key(each_rule))
+			state = entry["state"] if entry is not None and entry["state"] in Exporter.ALERT_STATES else "ok"
+			labels = "rule=\"" + Exporter.label(each_rule.key) + "\",name=\"" + Exporter.label(each_rule.name) + "\""
+			for each_state in Exporter.ALERT_STATES:
+				lines.append(
+					"raspimon_alert{" + labels + ",raspimon_alert=\"" + each_state + "\"} " +
+					("1" if each_state == state else "0")
+				)
+
+		lines.append("# EOF")
+		return ("\n".join(lines) + "\n").encode("utf-8")
+
+	@staticmethod
+	def rendered():
+		"""The current body, rendered if stale"""
+		body = Exporter.body
+		if body is None:
+			with Exporter.lock:
+				if Exporter.body is None:
+					Exporter.body = Exporter.render()
+				body = Exporter.body
+		return body
+
+	@staticmethod
+	def serve(listen):
+		"""Serve the endpoint from a thread
+
+		Args:
+			listen (str): host:port to listen on
+		"""
+		address, port = listen.rsplit(":", 1)
+		Exporter.server = ThreadingHTTPServer((address, int(port)), MetricsHandler)
+		Exporter.server.daemon_threads = True
+		threading.Thread(target=Exporter.server.serve_forever, name="exporter", daemon=True).start()
+
+	@staticmethod
+	def stop():
+		if Exporter.server is not None:
+			Exporter.server.shutdown()
+			Exporter.server.server_close()
+			Exporter.server = None
+
+class MetricsHandler(BaseHTTPRequestHandler):
+	"""GET /metrics"""
+
+	def do_GET(self):
+		if self.path.split("?", 1)[0] != "/metrics":
+			self.send_response(404)
+			self.send_header("Content-Length", "0")
+			self.end_headers()
+			return
+		body = Exporter.rendered()
+		self.send_response(200)
+		self.send_header("Content-Type", Exporter.CONTENT_TYPE)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		# Scraped every few seconds, keep stderr for errors
+		pass
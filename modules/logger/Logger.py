@@ -25,16 +25,39 @@ class Logger:
 	"""
 	
 	@staticmethod
-	def execution_log(started = True):
+	def execution_log(started = True, stats = None):
 		"""Log that a program execution has started/stopped to `raspimon` logs
 
 		Args:
 			started (bool, optional): Set `True` on start, `False` on terminate. Defaults to True.
+			stats (dict, optional): `raspimon.*` metrics of the run (see
+			`Instrument`) to note along. Defaults to None.
 		"""
+		msg = "Execution " + ("started" if started else "finished")
+		if stats:
+			msg += " (" + ", ".join(
+				name.split(".", 1)[1] + "=" + str(stats[name]) for name in sorted(stats.keys())
+			) + ")"
+		Logger.write(msg)
+
+	@staticmethod
+	def error(context, error):
+		"""Log an error a long running loop survived (eg. a failed daemon
+		job) to `raspimon` logs
+
+		Args:
+			context (str): What failed, eg. `job sample/60`
+			error (Exception): The error caught
+		"""
+		Logger.write("Error in " + context + ": " + type(error).__name__ + ": " + str(error))
+
+	@staticmethod
+	def write(msg):
+		"""Append a timestamped line to the execution log"""
 		dateTimeObj = datetime.now()
 		timestampStr = dateTimeObj.strftime("%d-%b-%Y (%H:%M:%S.%f)")
-		msg = " - " + timestampStr + " -- " + "Execution " + ("started" if started else "finished")
-		
+		msg = " - " + timestampStr + " -- " + msg
+
 		if not os.path.exists(ConfigLoader.Logging["base_dir"]):
 			os.mkdir(ConfigLoader.Logging["base_dir"])
 		elif os.path.isfile(ConfigLoader.Logging["base_dir"]):
@@ -0,0 +1,566 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from modules.config.ConfigLoader import ConfigLoader
+from modules.metrics.Instrument import Instrument
+from modules.metrics.ProcessTracker import ProcessTracker
+from modules.metrics.UnitTracker import UnitTracker
+from modules.utils.WorkerPool import WorkerPool
+from modules.storage.Storage import Storage
+import importlib
+import time
+import glob
+import os
+
+class MetricCollector:
+	"""Base of a host metric collector plugin. A collector owns a metric
+	family: the metric named after it and/or `<name>.<item>` metrics,
+	eg. `load.1` or `disk_usage./mnt/nas`.
+
+	Attributes:
+		name (str): Family name, the prefix of its metrics
+		cost (int): Relative cost of a collection. Collectors not costlier
+		than `inline_cost` run in the calling thread, the rest in the pool.
+		interval (int|None): Preferred daemon sampling interval in seconds,
+		None for the daemon default
+		timeout (float): Seconds a cycle waits for this collector
+	"""
+
+	name = None
+	cost = 1
+	interval = None
+	timeout = 2
+
+	PROC = "/proc"
+	SYS = "/sys"
+
+	def provides(self, metric):
+		"""Whether a metric belongs to this collector's family"""
+		return metric == self.name or metric.startswith(self.name + ".")
+
+	def collect(self, metrics):
+		"""Read the metrics
+
+		Args:
+			metrics (list): The requested metrics of this family
+
+		Returns:
+			dict: metric -> value. May hold more than requested, and leave
+			out what can't be read (yet).
+		"""
+		raise NotImplementedError
+
+	@staticmethod
+	def item(metric):
+		"""The `<item>` part of a `<name>.<item>` metric"""
+		return metric.split(".", 1)[1] if "." in metric else None
+
+class CounterCollector(MetricCollector):
+	"""A collector of monotonic counters, reported as what changed since
+	the previous reading of each counter (per second rates by default).
+	The previous readings are saved to the telemetry store between runs
+	(see `Collectors`), so a cron run diffs against the one before it
+	without sampling twice. A counter seen for the first time, or one
+	that went backwards (eg. after a reboot), only starts a new baseline.
+	"""
+
+	def __init__(self):
+		# counter -> (epoch time it was read, value), None until restored
+		self.previous = None
+
+	def counters(self):
+		"""Read the raw counters
+
+		Returns:
+			dict: counter -> value
+		"""
+		raise NotImplementedError
+
+	def needs(self, metrics):
+		"""The counters backing the requested metrics"""
+		return set(metrics)
+
+	def derive(self, deltas):
+		"""Turn counter changes into metric values
+
+		Args:
+			deltas (dict): counter -> (change, seconds elapsed)
+
+		Returns:
+			dict: metric -> value
+		"""
+		return {
+			key: change / elapsed
+			for key, (change, elapsed) in deltas.items() if change >= 0
+		}
+
+	def collect(self, metrics):
+		now = time.time()
+		needed = self.needs(metrics)
+		counters = self.counters()
+		previous = self.previous or {}
+		deltas = {}
+		current = dict(previous)
+		for key in counters.keys():
+			if key not in needed:
+				continue
+			if key in previous and now > previous[key][0]:
+				deltas[key] = (counters[key] - previous[key][1], now - previous[key][0])
+			current[key] = (now, counters[key])
+		self.previous = current
+		return self.derive(deltas)
+
+class CpuCollector(CounterCollector):
+	"""`cpu`: overall utilization, `cpu.iowait` and `cpu.steal`: time
+	spent waiting on I/O and stolen by the hypervisor, all in percent
+	since the previous sample. Computed from the `/proc/stat` jiffy
+	counters, so a run never has to sleep for a measurement. I/O wait
+	counts as idle, the way `top` and psutil count it.
+	"""
+
+	name = "cpu"
+
+	# Read the `cpu<n>` lines of /proc/stat instead of the `cpu` total
+	per_core = False
+
+	# Counted jiffies per state, `guest` time is already part of `user`
+	FIELDS = ["user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal"]
+
+	def counters(self):
+		counters = {}
+		with open(self.PROC + "/stat") as stat_file:
+			for line in stat_file:
+				if not line.startswith("cpu"):
+					break
+				fields = line.split()
+				if (fields[0] == "cpu") == self.per_core:
+					continue
+				prefix = self.name if fields[0] == "cpu" else self.name + "." + fields[0][3:]
+				jiffies = dict(zip(CpuCollector.FIELDS, [int(each) for each in fields[1:9]]))
+				total = sum(jiffies.values())
+				counters[prefix + ".total"] = total
+				counters[prefix + ".busy"] = total - jiffies["idle"] - jiffies.get("iowait", 0)
+				counters[prefix + ".iowait"] = jiffies.get("iowait", 0)
+				counters[prefix + ".steal"] = jiffies.get("steal", 0)
+		return counters
+
+	def base(self, metric):
+		"""The CPU line a metric reports on, eg. `cpu` or `cpu_core.1`"""
+		for suffix in [".iowait", ".steal"]:
+			if metric.endswith(suffix):
+				return metric[:-len(suffix)]
+		return metric
+
+	def needs(self, metrics):
+		needed = set()
+		for each_metric in metrics:
+			base = self.base(each_metric)
+			needed.update([base + ".total", base + ".busy", base + ".iowait", base + ".steal"])
+		return needed
+
+	def derive(self, deltas):
+		values = {}
+		for key, (total, _) in deltas.items():
+			if not key.endswith(".total") or total <= 0:
+				continue
+			base = key[:-len(".total")]
+			for state in ["busy", "iowait", "steal"]:
+				if base + "." + state not in deltas:
+					continue
+				# Per cpu iowait may even go backwards, keep it in range
+				change = min(max(deltas[base + "." + state][0], 0), total)
+				metric = base if state == "busy" else base + "." + state
+				values[metric] = round(change * 100.0 / total, 1)
+		return values
+
+class MemCollector(MetricCollector):
+	"""`mem`: used memory in percent"""
+
+	name = "mem"
+
+	def collect(self, metrics):
+		import psutil
+		return {"mem": psutil.virtual_memory().percent}
+
+class CpuCoreCollector(CpuCollector):
+	"""`cpu_core.<n>`: utilization of each core in percent, with
+	`cpu_core.<n>.iowait` and `cpu_core.<n>.steal`, see `CpuCollector`
+	"""
+
+	name = "cpu_core"
+	per_core = True
+
+class LoadCollector(MetricCollector):
+	"""`load.1`, `load.5`, `load.15`: load averages"""
+
+	name = "load"
+	cost = 0
+
+	def collect(self, metrics):
+		load = os.getloadavg()
+		return {"load.1": load[0], "load.5": load[1], "load.15": load[2]}
+
+class SwapCollector(MetricCollector):
+	"""`swap`: used swap in percent, 0 without swap"""
+
+	name = "swap"
+	cost = 0
+
+	def collect(self, metrics):
+		meminfo = {}
+		with open(self.PROC + "/meminfo") as meminfo_file:
+			for line in meminfo_file:
+				key, _, value = line.partition(":")
+				meminfo[key] = int(value.split()[0])
+		total = meminfo.get("SwapTotal", 0)
+		if total == 0:
+			return {"swap": 0.0}
+		return {"swap": round((total - meminfo.get("SwapFree", 0)) * 100.0 / total, 1)}
+
+class DiskUsageCollector(MetricCollector):
+	"""`disk_usage.<mount>`: used space of a mount point in percent, the
+	way `df` reports it (space reserved for root counts as used). Only
+	the requested mounts are looked at, a hung network mount only
+	stalls its own collector.
+	"""
+
+	name = "disk_usage"
+	cost = 5
+	interval = 300
+	timeout = 5
+
+	def collect(self, metrics):
+		usage = {}
+		for each_metric in metrics:
+			mount = MetricCollector.item(each_metric)
+			if mount is None:
+				continue
+			try:
+				stat = os.statvfs(mount)
+			except OSError:
+				# Not mounted (right now), the other mounts still count
+				continue
+			used = stat.f_blocks - stat.f_bfree
+			if used + stat.f_bavail > 0:
+				usage[each_metric] = round(used * 100.0 / (used + stat.f_bavail), 1)
+		return usage
+
+class DiskIOCollector(CounterCollector):
+	"""`disk_io.read_bps`, `disk_io.write_bps`, `disk_io.read_iops`,
+	`disk_io.write_iops`: over all disks, or `disk_io.<device>.<rate>`
+	for a single one. Partitions, loop and ram devices are left out of
+	the totals.
+	"""
+
+	name = "disk_io"
+	cost = 2
+
+	SECTOR = 512
+
+	def counters(self):
+		counters = {}
+		totals = {"read_bps": 0, "write_bps": 0, "read_iops": 0, "write_iops": 0}
+		with open(self.PROC + "/diskstats") as diskstats_file:
+			for line in diskstats_file:
+				fields = line.split()
+				if len(fields) < 10:
+					continue
+				device = fields[2]
+				device_counters = {
+					"read_iops": int(fields[3]),
+					"read_bps": int(fields[5]) * DiskIOCollector.SECTOR,
+					"write_iops": int(fields[7]),
+					"write_bps": int(fields[9]) * DiskIOCollector.SECTOR
+				}
+				for key in device_counters.keys():
+					counters["disk_io." + device + "." + key] = device_counters[key]
+				if DiskIOCollector.disk(self.SYS, device):
+					for key in device_counters.keys():
+						totals[key] += device_counters[key]
+		for key in totals.keys():
+			counters["disk_io." + key] = totals[key]
+		return counters
+
+	@staticmethod
+	def disk(sys_path, device):
+		"""Whether a block device is a whole, physical disk"""
+		if device.startswith(("loop", "ram", "zram")):
+			return False
+		return os.path.isdir(sys_path + "/block/" + device)
+
+class NetIOCollector(CounterCollector):
+	"""`net_io.rx_bps`, `net_io.tx_bps`, `net_io.rx_errors`,
+	`net_io.tx_errors`, `net_io.rx_drops`, `net_io.tx_drops`: per
+	second over all interfaces but loopback, or `net_io.<iface>.<rate>`
+	for a single one.
+	"""
+
+	name = "net_io"
+	cost = 2
+
+	# /proc/net/dev column of each counter
+	COLUMNS = {"rx_bps": 0, "rx_errors": 2, "rx_drops": 3, "tx_bps": 8, "tx_errors": 10, "tx_drops": 11}
+
+	def counters(self):
+		counters = {}
+		totals = dict.fromkeys(NetIOCollector.COLUMNS.keys(), 0)
+		with open(self.PROC + "/net/dev") as dev_file:
+			# Two header lines
+			for line in dev_file.readlines()[2:]:
+				iface, _, values = line.partition(":")
+				iface = iface.strip()
+				values = values.split()
+				if len(values) < 16:
+					continue
+				for key in NetIOCollector.COLUMNS.keys():
+					value = int(values[NetIOCollector.COLUMNS[key]])
+					counters["net_io." + iface + "." + key] = value
+					if iface != "lo":
+						totals[key] += value
+		for key in totals.keys():
+			counters["net_io." + key] = totals[key]
+		return counters
+
+class ThermalCollector(MetricCollector):
+	"""`thermal`: hottest zone in degrees Celsius, `thermal.<type>` or
+	`thermal.<zone>` (eg. `thermal.cpu-thermal`, `thermal.thermal_zone0`)
+	for a single zone of `/sys/class/thermal`.
+	"""
+
+	name = "thermal"
+	cost = 2
+
+	def collect(self, metrics):
+		temperatures = {}
+		for zone_path in sorted(glob.glob(self.SYS + "/class/thermal/thermal_zone*")):
+			try:
+				with open(zone_path + "/temp") as temp_file:
+					celsius = int(temp_file.read().strip()) / 1000.0
+			except (OSError, ValueError):
+				# Some zones refuse reads while their sensor is off
+				continue
+			temperatures["thermal." + os.path.basename(zone_path)] = celsius
+			try:
+				with open(zone_path + "/type") as type_file:
+					zone_type = type_file.read().strip()
+				temperatures.setdefault("thermal." + zone_type, celsius)
+			except OSError:
+				pass
+		if len(temperatures) > 0:
+			temperatures["thermal"] = max(temperatures.values())
+		return temperatures
+
+class SelfCollector(MetricCollector):
+	"""`raspimon.*`: the monitor's own phase timings and resource usage.
+	These are measured by `Instrument` and stored at the end of every
+	cycle, this collector only claims the family so that they can be
+	alarmed on like any host metric.
+	"""
+
+	name = Instrument.PREFIX
+	cost = 0
+
+	def collect(self, metrics):
+		return {}
+
+class ProcessCollector(MetricCollector):
+	"""`process.<name>.<stat>`: resource usage of a watched process, eg.
+	`process.omv-engined.rss_kb`. These are read along with the process
+	states (see `ProcessTracker`), this collector only claims the family.
+	"""
+
+	name = ProcessTracker.PREFIX
+	cost = 0
+
+	def provides(self, metric):
+		return ProcessTracker.parse(metric) is not None
+
+	def collect(self, metrics):
+		return {}
+
+class UnitCollector(MetricCollector):
+	"""`unit.<unit>.<stat>`: resource usage of a watched systemd unit, eg.
+	`unit.nginx.service.memory_kb`. These are read from the unit's cgroup
+	along with its state (see `UnitTracker`), this collector only claims
+	the family.
+	"""
+
+	name = UnitTracker.PREFIX
+	cost = 0
+
+	def provides(self, metric):
+		return UnitTracker.parse(metric) is not None
+
+	def collect(self, metrics):
+		return {}
+
+class Collectors:
+	"""Registry of the host metric collectors. The built-in ones are
+	registered up front; plugins are modules named in the `collectors`
+	section of the alarm configuration which call `Collectors.register`
+	on import:
+
+		collectors:
+		  plugins: ["my_plugins.gpu"]
+
+	A cycle runs every collector owning a requested metric once: cheap
+	ones inline, the others concurrently in a small pool, each bounded
+	by its own `timeout`. A collector which misses its timeout is left
+	running and skipped until it returns, so a hung one holds at most
+	one worker.
+	"""
+
+	registry = {}
+	pool = None
+
+	# name -> Job of a collector which overran its timeout
+	in_flight = {}
+	# name -> reason of the collectors which failed their last cycle
+	failures = {}
+
+	KEY_COLLECTORS = "collectors"
+	KEY_PLUGINS = "plugins"
+
+	@staticmethod
+	def register(collector):
+		"""Add (or replace) a collector
+
+		Args:
+			collector (MetricCollector): The collector instance
+		"""
+		Collectors.registry[collector.name] = collector
+
+	@staticmethod
+	def load_plugins(config):
+		"""Import the plugin modules named in the alarm configuration
+
+		Args:
+			config (dict): The alarm configuration
+		"""
+		section = (config or {}).get(Collectors.KEY_COLLECTORS) or {}
+		for each_module in section.get(Collectors.KEY_PLUGINS) or []:
+			importlib.import_module(each_module)
+
+	@staticmethod
+	def find(metric):
+		"""The collector owning a metric, None if unsupported"""
+		collector = Collectors.registry.get(metric.split(".", 1)[0])
+		if collector is not None and collector.provides(metric):
+			return collector
+		return None
+
+	@staticmethod
+	def run(collector, metrics):
+		"""Collect without touching any shared state, so that it can run
+		on a pool thread. See `record`.
+
+		Returns:
+			(dict, str|None, float): metric -> value, the error if it
+			failed and the seconds it took
+		"""
+		started = time.perf_counter()
+		try:
+			values, error = collector.collect(metrics), None
+		except Exception as collect_error:
+			values, error = {}, type(collect_error).__name__ + ": " + str(collect_error)
+		return values, error, time.perf_counter() - started
+
+	@staticmethod
+	def record(collector, outcome):
+		"""Account the outcome of `run` to the cycle, on its thread. A
+		collection which timed out is never recorded, its time doesn't
+		leak into a later cycle.
+
+		Returns:
+			dict: metric -> value
+		"""
+		values, error, seconds = outcome
+		Instrument.add("collect." + collector.name, seconds)
+		if error is not None:
+			Collectors.failures[collector.name] = error
+		return values
+
+	@staticmethod
+	def collect(metrics):
+		"""Collect the requested metrics in one cycle
+
+		Args:
+			metrics (list): Metric names. Unsupported ones are skipped.
+
+		Returns:
+			dict: metric -> value for what could be read in time
+		"""
+		by_collector = {}
+		for each_metric in metrics:
+			collector = Collectors.find(each_metric)
+			# Self metrics are stored by the cycle itself (see `Instrument`),
+			# process usage along with the process states
+			if collector is not None and not isinstance(collector, (SelfCollector, ProcessCollector, UnitCollector)):
+				by_collector.setdefault(collector.name, []).append(each_metric)
+
+		inline = []
+		pooled = []
+		for name in by_collector.keys():
+			collector = Collectors.registry[name]
+			if name in Collectors.in_flight and not Collectors.in_flight[name].done.is_set():
+				Collectors.failures[name] = "Still running since an earlier cycle"
+				continue
+			Collectors.in_flight.pop(name, None)
+			Collectors.failures.pop(name, None)
+			if isinstance(collector, CounterCollector) and collector.previous is None:
+				collector.previous = Storage.load_counters(name)
+			if collector.cost <= ConfigLoader.Metrics["inline_cost"]:
+				inline.append(collector)
+			else:
+				pooled.append(collector)
+
+		# Costliest first so that they start early
+		jobs = []
+		if len(pooled) > 0:
+			if Collectors.pool is None:
+				Collectors.pool = WorkerPool(ConfigLoader.Metrics["workers"])
+			started = time.monotonic()
+			for collector in sorted(pooled, key=lambda each: each.cost, reverse=True):
+				jobs.append((collector, Collectors.pool.submit(Collectors.run, collector, by_collector[collector.name])))
+
+		results = {}
+		for collector in inline:
+			results[collector.name] = Collectors.record(collector, Collectors.run(collector, by_collector[collector.name]))
+		for collector, job in jobs:
+			if job.wait(max(0.0, started + collector.timeout - time.monotonic())):
+				results[collector.name] = Collectors.record(collector, job.result)
+			else:
+				Collectors.in_flight[collector.name] = job
+				Collectors.failures[collector.name] = "Timed out after " + str(collector.timeout) + "s"
+
+		# Keep the counters for the next run to diff against
+		for name in results.keys():
+			if isinstance(Collectors.registry[name], CounterCollector):
+				Storage.save_counters(Collectors.registry[name].previous)
+
+		stats = {}
+		for name in by_collector.keys():
+			values = results.get(name) or {}
+			for each_metric in by_collector[name]:
+				if each_metric in values:
+					stats[each_metric] = values[each_metric]
+		return stats
+
+for each_collector in [CpuCollector(), MemCollector(), CpuCoreCollector(), LoadCollector(), SwapCollector(),
+					   DiskUsageCollector(), DiskIOCollector(), NetIOCollector(), ThermalCollector(), SelfCollector(),
+					   ProcessCollector(), UnitCollector()]:
+	Collectors.register(each_collector)
@@ -0,0 +1,122 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from contextlib import contextmanager
+import threading
+import functools
+import resource
+import time
+
+class Instrument:
+	"""Self instrumentation of the check cycle. The phases of a cycle
+	(config load, validation, storage refresh, each collector, the
+	process scan, rule evaluation, summarize, send and flush) are timed
+	on the monotonic clock; at the end of the cycle they are reported
+	as `raspimon.*` metrics along with the process' own CPU time and
+	peak RSS:
+
+		raspimon.<phase>_ms    eg. raspimon.refresh_ms, raspimon.collect.disk_usage_ms
+		raspimon.cycle_ms      wall time from `start` to `finish`
+		raspimon.cpu_ms        CPU time since the previous cycle ended (since
+		                       startup, imports included, for the first one)
+		raspimon.rss_kb        peak resident set size of the process
+
+	Time spent in a phase outside of a cycle (eg. a daemon flush between
+	two samples) is reported with the next cycle. Phases are meant to be
+	timed on the thread running the cycle; pooled work (eg. collectors)
+	is timed by whoever waits on it, see `add`.
+	"""
+
+	PREFIX = "raspimon"
+	CYCLE = "cycle"
+	CPU = "cpu"
+	RSS = "rss"
+
+	# phase -> seconds spent in it since the last report
+	phases = {}
+	lock = threading.Lock()
+	# Monotonic start of the running cycle, None outside of one
+	started = None
+	# Process CPU time when the previous cycle ended
+	cpu_mark = 0.0
+	# metric -> value of the last finished cycle
+	last = {}
+
+	@staticmethod
+	def start():
+		"""Start a cycle"""
+		Instrument.started = time.monotonic()
+
+	@staticmethod
+	@contextmanager
+	def phase(name):
+		"""Time the block as (part of) a phase
+
+		Usage:
+			with Instrument.phase("evaluate"):
+				...
+		"""
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			Instrument.add(name, time.perf_counter() - started)
+
+	@staticmethod
+	def add(name, seconds):
+		"""Account time measured elsewhere to a phase"""
+		with Instrument.lock:
+			Instrument.phases[name] = Instrument.phases.get(name, 0.0) + seconds
+
+	@staticmethod
+	def timed(name):
+		"""Decorator timing every call of a function as a phase"""
+		def decorator(func):
+			@functools.wraps(func)
+			def wrapper(*args, **kwargs):
+				with Instrument.phase(name):
+					return func(*args, **kwargs)
+			return wrapper
+		return decorator
+
+	@staticmethod
+	def metric(name, unit):
+		return Instrument.PREFIX + "." + name + "_" + unit
+
+	@staticmethod
+	def finish():
+		"""End the cycle and report on it
+
+		Returns:
+			dict: `raspimon.*` metric -> value
+		"""
+		cpu = time.process_time()
+		with Instrument.lock:
+			phases, Instrument.phases = Instrument.phases, {}
+		metrics = {}
+		for name, seconds in phases.items():
+			metrics[Instrument.metric(name, "ms")] = round(seconds * 1000.0, 3)
+		if Instrument.started is not None:
+			metrics[Instrument.metric(Instrument.CYCLE, "ms")] = round((time.monotonic() - Instrument.started) * 1000.0, 3)
+		metrics[Instrument.metric(Instrument.CPU, "ms")] = round((cpu - Instrument.cpu_mark) * 1000.0, 3)
+		# Kilobytes on Linux
+		metrics[Instrument.metric(Instrument.RSS, "kb")] = float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+		Instrument.started = None
+		Instrument.cpu_mark = cpu
+		Instrument.last = metrics
+		return metrics
@@ -0,0 +1,224 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from modules.config.ConfigLoader import ConfigLoader
+from modules.utils.ProcessMatcher import ProcessMatcher
+from modules.utils.ProcScanner import ProcScanner
+from modules.storage.Storage import Storage
+import hashlib
+import zlib
+import time
+import os
+
+class ProcessTracker:
+	"""Resource usage of the watched processes, from `/proc`. The (pid,
+	start time) handles of the processes matching a watched name are
+	kept across samples: while they are all alive, a sample only reads
+	their `/proc/<pid>/stat` and `/proc/<pid>/fd` instead of sweeping
+	every process. The processes are swept again when a handle died,
+	when a watched name has no running process, and every `process_rescan`
+	seconds to pick up new instances (eg. extra workers).
+
+	Reported as telemetry, over every instance of a watched process:
+
+		process.<name>.cpu        CPU used since the previous sample, in % of one core
+		process.<name>.rss_kb     resident memory
+		process.<name>.threads    threads
+		process.<name>.fds        open file descriptors, if readable
+		process.<name>.instances  matching processes
+		process.<name>.restarts   1 if the oldest instance (pid or start time)
+		                          changed since the previous sample, else 0
+
+	CPU time and the oldest instance are kept as counters in the store,
+	so a cron run compares with the run before it. A metric whose name
+	would not fit the store is kept as `process.#<digest of name>.<stat>`.
+	"""
+
+	PREFIX = "process"
+
+	CPU = "cpu"
+	RSS = "rss_kb"
+	THREADS = "threads"
+	FDS = "fds"
+	INSTANCES = "instances"
+	RESTARTS = "restarts"
+	STATS = [CPU, RSS, THREADS, FDS, INSTANCES, RESTARTS]
+
+	# Counters kept per watched process
+	TICKS = "ticks"
+	MEMBERS = "members"
+	PID = "pid"
+	START = "start"
+
+	CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+	PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+	# (name, match mode) -> [(pid, start time)] of the matching processes
+	handles = {}
+	# (name, match mode) -> monotonic time the handles were swept for
+	resolved = {}
+	# counter -> (epoch time it was read, value), None until restored
+	previous = None
+
+	@staticmethod
+	def metric(name, stat):
+		metric = ProcessTracker.PREFIX + "." + name + "." + stat
+		if Storage.fits(metric):
+			return metric
+		return ProcessTracker.PREFIX + ".#" + hashlib.sha1(name.encode("utf-8")).hexdigest()[:16] + "." + stat
+
+	@staticmethod
+	def parse(metric):
+		"""Split a `process.<name>.<stat>` metric
+
+		Returns:
+			(str, str)|None: Process name and stat, None for another metric
+		"""
+		if not metric.startswith(ProcessTracker.PREFIX + "."):
+			return None
+		name, _, stat = metric[len(ProcessTracker.PREFIX) + 1:].rpartition(".")
+		if len(name) == 0 or stat not in ProcessTracker.STATS:
+			return None
+		return name, stat
+
+	@staticmethod
+	def named(metrics):
+		"""Processes whose usage one of the metrics watches"""
+		names = []
+		for each_metric in metrics:
+			parsed = ProcessTracker.parse(each_metric)
+			if parsed is not None and parsed[0] not in names:
+				names.append(parsed[0])
+		return names
+
+	@staticmethod
+	def read(handles):
+		"""Read the usage of process handles
+
+		Returns:
+			(list, bool): (pid, start, ticks, threads, resident pages, fds)
+			of the live ones, and whether all of them were alive
+		"""
+		readings = []
+		for pid, start in handles:
+			try:
+				usage = ProcScanner.usage(pid)
+			except (OSError, ValueError, IndexError):
+				continue
+			# A recycled pid is another process
+			if usage[0] == start:
+				readings.append((pid,) + usage)
+		return readings, len(readings) == len(handles)
+
+	@staticmethod
+	def instances(processes, matcher, modes=None):
+		"""Resolve and read every running instance of the watched processes
+
+		Args:
+			processes (list): Service process names
+			matcher (ProcessMatcher): Matcher compiled for them
+			modes (dict, optional): process name -> match mode
+
+		Returns:
+			dict: name -> list of instance readings, see `read`. Empty for
+			a process that is down.
+		"""
+		modes = modes or {}
+		now = time.monotonic()
+		readings = {}
+		stale = []
+		for each_process in processes:
+			key = (each_process, modes.get(each_process, ProcessMatcher.SUBSTRING))
+			handles = ProcessTracker.handles.get(key)
+			if not handles or now - ProcessTracker.resolved.get(key, 0) >= ConfigLoader.Metrics["process_rescan"]:
+				stale.append(each_process)
+				continue
+			readings[each_process], alive = ProcessTracker.read(handles)
+			if not alive:
+				stale.append(each_process)
+		if len(stale) == 0:
+			return readings
+
+		found = {each_process: [] for each_process in stale}
+		for each_running_process in ProcScanner.scan():
+			for each_process in matcher.match(each_running_process["command"]):
+				if each_process in found:
+					found[each_process].append((each_running_process["pid"], each_running_process["start"]))
+		for each_process in stale:
+			key = (each_process, modes.get(each_process, ProcessMatcher.SUBSTRING))
+			ProcessTracker.handles[key] = found[each_process]
+			ProcessTracker.resolved[key] = now
+			readings[each_process] = ProcessTracker.read(found[each_process])[0]
+		return readings
+
+	@staticmethod
+	def usage(readings):
+		"""Turn instance readings into `process.*` metrics. The counters of
+		a process that is down are kept, so that it coming back up counts
+		as a restart.
+
+		Args:
+			readings (dict): name -> instance readings, see `instances`
+
+		Returns:
+			dict: metric -> value for the processes found running
+		"""
+		if ProcessTracker.previous is None:
+			ProcessTracker.previous = Storage.load_counters(ProcessTracker.PREFIX)
+		now = time.time()
+		previous = ProcessTracker.previous
+		current = dict(previous)
+		metrics = {}
+		for name, instances in readings.items():
+			if len(instances) == 0:
+				continue
+			oldest = min(instances, key=lambda each: (each[1], each[0]))
+			ticks = sum(each[2] for each in instances)
+			# Identifies the set of instances, CPU time is only diffed within one
+			members = float(zlib.crc32(",".join(
+				str(pid) + ":" + str(start) for pid, start in sorted((each[0], each[1]) for each in instances)
+			).encode("utf-8")))
+
+			metrics[ProcessTracker.metric(name, ProcessTracker.RSS)] = \
+				sum(each[4] for each in instances) * ProcessTracker.PAGE_SIZE / 1024.0
+			metrics[ProcessTracker.metric(name, ProcessTracker.THREADS)] = float(sum(each[3] for each in instances))
+			if all(each[5] is not None for each in instances):
+				metrics[ProcessTracker.metric(name, ProcessTracker.FDS)] = float(sum(each[5] for each in instances))
+			metrics[ProcessTracker.metric(name, ProcessTracker.INSTANCES)] = float(len(instances))
+
+			last_ticks = previous.get(ProcessTracker.metric(name, ProcessTracker.TICKS))
+			last_members = previous.get(ProcessTracker.metric(name, ProcessTracker.MEMBERS))
+			if last_ticks is not None and last_members is not None and last_members[1] == members and \
+				now > last_ticks[0]:
+				metrics[ProcessTracker.metric(name, ProcessTracker.CPU)] = \
+					max(ticks - last_ticks[1], 0) / ProcessTracker.CLOCK_TICKS / (now - last_ticks[0]) * 100.0
+
+			last_pid = previous.get(ProcessTracker.metric(name, ProcessTracker.PID))
+			last_start = previous.get(ProcessTracker.metric(name, ProcessTracker.START))
+			restarted = last_pid is not None and last_start is not None and \
+				(last_pid[1], last_start[1]) != (oldest[0], oldest[1])
+			metrics[ProcessTracker.metric(name, ProcessTracker.RESTARTS)] = 1.0 if restarted else 0.0
+
+			for counter, value in [
+				(ProcessTracker.TICKS, ticks), (ProcessTracker.MEMBERS, members),
+				(ProcessTracker.PID, oldest[0]), (ProcessTracker.START, oldest[1])
+			]:
+				current[ProcessTracker.metric(name, counter)] = (now, float(value))
+
+		ProcessTracker.previous = current
+		Storage.save_counters(current)
+		return metrics
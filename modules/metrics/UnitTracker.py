@@ -0,0 +1,194 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from modules.metrics.ProcessTracker import ProcessTracker
+from modules.utils.CgroupScanner import CgroupScanner
+from modules.storage.Storage import Storage
+import hashlib
+import time
+
+class UnitTracker:
+	"""Resource usage of the watched systemd units, from their cgroups
+	(see `CgroupScanner`). The cgroup accounts for every process the unit
+	started, whatever its command line, so nothing is matched and no
+	process is swept.
+
+	Reported as telemetry:
+
+		unit.<unit>.cpu        CPU used since the previous sample, in % of one core
+		unit.<unit>.memory_kb  memory charged to the unit, page cache included
+		unit.<unit>.read_bps   bytes read from block devices per second
+		unit.<unit>.write_bps  bytes written to block devices per second
+		unit.<unit>.instances  processes in the unit's cgroup
+		unit.<unit>.restarts   1 if the unit's main (lowest) pid changed or its
+		                       cgroup was recreated since the previous sample, else 0
+
+	Stats whose controller isn't enabled for the unit are left out. The
+	cumulative counters are kept in the store, so a cron run compares
+	with the run before it. A metric whose name would not fit the store
+	is kept as `unit.#<digest of unit>.<stat>`.
+	"""
+
+	PREFIX = "unit"
+
+	CPU = "cpu"
+	MEMORY = "memory_kb"
+	READ = "read_bps"
+	WRITE = "write_bps"
+	INSTANCES = "instances"
+	RESTARTS = "restarts"
+	STATS = [CPU, MEMORY, READ, WRITE, INSTANCES, RESTARTS]
+
+	# Counters kept per watched unit
+	USAGE = "usage_usec"
+	RBYTES = "rbytes"
+	WBYTES = "wbytes"
+	PID = "pid"
+
+	# Stats the process scan fallback knows, process stat -> unit stat
+	FALLBACK = {
+		ProcessTracker.CPU: CPU,
+		ProcessTracker.RSS: MEMORY,
+		ProcessTracker.INSTANCES: INSTANCES,
+		ProcessTracker.RESTARTS: RESTARTS
+	}
+
+	# counter -> (epoch time it was read, value), None until restored
+	previous = None
+
+	@staticmethod
+	def metric(unit, stat):
+		metric = UnitTracker.PREFIX + "." + unit + "." + stat
+		if Storage.fits(metric):
+			return metric
+		return UnitTracker.PREFIX + ".#" + hashlib.sha1(unit.encode("utf-8")).hexdigest()[:16] + "." + stat
+
+	@staticmethod
+	def parse(metric):
+		"""Split a `unit.<unit>.<stat>` metric
+
+		Returns:
+			(str, str)|None: Unit and stat, None for another metric
+		"""
+		if not metric.startswith(UnitTracker.PREFIX + "."):
+			return None
+		unit, _, stat = metric[len(UnitTracker.PREFIX) + 1:].rpartition(".")
+		if len(unit) == 0 or stat not in UnitTracker.STATS:
+			return None
+		return unit, stat
+
+	@staticmethod
+	def named(metrics):
+		"""Units whose usage one of the metrics watches"""
+		units = []
+		for each_metric in metrics:
+			parsed = UnitTracker.parse(each_metric)
+			if parsed is not None and parsed[0] not in units:
+				units.append(parsed[0])
+		return units
+
+	@staticmethod
+	def stem(unit):
+		"""The process a unit most likely runs, eg. `nginx` for `nginx.service`"""
+		name, dot, _ = unit.rpartition(".")
+		return name if len(dot) > 0 and len(name) > 0 else unit
+
+	@staticmethod
+	def read(units, slices=None):
+		"""Read the cgroups of the watched units
+
+		Args:
+			units (list): Unit names
+			slices (dict, optional): unit -> slice. Defaults to `CgroupScanner.SLICE`.
+
+		Returns:
+			dict: unit -> reading, see `CgroupScanner.read`
+		"""
+		slices = slices or {}
+		return {each_unit: CgroupScanner.read(each_unit, slices.get(each_unit)) for each_unit in units}
+
+	@staticmethod
+	def usage(readings):
+		"""Turn cgroup readings into `unit.*` metrics. The counters of a
+		unit that is down are kept, so that it coming back up counts as
+		a restart.
+
+		Args:
+			readings (dict): unit -> reading, see `read`
+
+		Returns:
+			dict: metric -> value for the units found running
+		"""
+		if UnitTracker.previous is None:
+			UnitTracker.previous = Storage.load_counters(UnitTracker.PREFIX)
+		now = time.time()
+		previous = UnitTracker.previous
+		current = dict(previous)
+		metrics = {}
+		for unit, reading in readings.items():
+			if reading is None or not reading["populated"]:
+				continue
+			metrics[UnitTracker.metric(unit, UnitTracker.INSTANCES)] = float(len(reading["pids"]))
+			if "memory" in reading:
+				metrics[UnitTracker.metric(unit, UnitTracker.MEMORY)] = reading["memory"] / 1024.0
+
+			# Cumulative counters only go back when the cgroup was recreated
+			recreated = False
+			for counter, stat, scale in [
+				(UnitTracker.USAGE, UnitTracker.CPU, 1e-4),
+				(UnitTracker.RBYTES, UnitTracker.READ, 1.0),
+				(UnitTracker.WBYTES, UnitTracker.WRITE, 1.0)
+			]:
+				if counter not in reading:
+					continue
+				value = float(reading[counter])
+				last = previous.get(UnitTracker.metric(unit, counter))
+				if last is not None and value < last[1]:
+					recreated = True
+				elif last is not None and now > last[0]:
+					metrics[UnitTracker.metric(unit, stat)] = (value - last[1]) * scale / (now - last[0])
+				current[UnitTracker.metric(unit, counter)] = (now, value)
+
+			if len(reading["pids"]) > 0:
+				main_pid = min(reading["pids"])
+				last_pid = previous.get(UnitTracker.metric(unit, UnitTracker.PID))
+				recreated = recreated or (last_pid is not None and last_pid[1] not in reading["pids"])
+				current[UnitTracker.metric(unit, UnitTracker.PID)] = (now, float(main_pid))
+			metrics[UnitTracker.metric(unit, UnitTracker.RESTARTS)] = 1.0 if recreated else 0.0
+
+		UnitTracker.previous = current
+		Storage.save_counters(current)
+		return metrics
+
+	@staticmethod
+	def from_processes(usage, processes):
+		"""Report the `process.*` usage the fallback scan found as `unit.*`
+
+		Args:
+			usage (dict): metric -> value, see `ProcessTracker.usage`
+			processes (dict): unit -> the process it was looked up by
+
+		Returns:
+			dict: metric -> value
+		"""
+		metrics = {}
+		for unit, process in processes.items():
+			for process_stat, unit_stat in UnitTracker.FALLBACK.items():
+				metric = ProcessTracker.metric(process, process_stat)
+				if metric in usage:
+					metrics[UnitTracker.metric(unit, unit_stat)] = usage[metric]
+		return metrics
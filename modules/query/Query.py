@@ -0,0 +1,318 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from modules.config.ConfigLoader import ConfigLoader
+from modules.storage.RingFile import RingFile, RollupBuffer
+from modules.storage.Storage import Storage
+from contextlib import contextmanager
+from datetime import datetime
+import math
+import os
+import re
+
+class Query:
+	"""Reads telemetry history back out of the store: the samples of a
+	metric over a time range, or aggregates of them. Ranges are located
+	with a binary search over the time ordered stamps of the raw buffer
+	or of a rollup tier, so a query only walks the samples it returns.
+
+	History older than the raw samples is served from the finest rollup
+	tier reaching back far enough; rows are then buckets (their mean,
+	min, max and count) and percentiles are estimated from the bucket
+	means weighted by their counts.
+	"""
+
+	RAW = "raw"
+	AGGREGATES = ["avg", "min", "max", "sum", "count", "last"]
+	PERCENTILE = re.compile(r"^p(100|\d{1,2}(\.\d+)?)$")
+
+	UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+	RELATIVE = re.compile(r"^-?(\d+)([smhdw])$")
+
+	@staticmethod
+	def parse_time(text, now):
+		"""Parse a point in time
+
+		Args:
+			text (str): `now`, epoch seconds, a duration ago (`90m`, `-2h`,
+			`7d`) or an ISO 8601 date/time in local time
+			now (int): Current epoch time
+
+		Returns:
+			int: Epoch seconds
+
+		Raises:
+			ValueError: If the text is none of these
+		"""
+		text = str(text).strip()
+		if text == "now":
+			return now
+		if text.isdigit():
+			return int(text)
+		relative = Query.RELATIVE.match(text)
+		if relative is not None:
+			return now - int(relative.group(1)) * Query.UNITS[relative.group(2)]
+		return int(datetime.fromisoformat(text).timestamp())
+
+	@staticmethod
+	def supported(function):
+		"""Whether an aggregate function (eg. `avg`, `p95`) is known"""
+		return function in Query.AGGREGATES or Query.PERCENTILE.match(function) is not None
+
+	@staticmethod
+	def source(buffer, start, resolution=None):
+		"""Pick what to read a range from
+
+		Args:
+			buffer (RingBuffer): The raw buffer of the metric
+			start (int): Epoch start of the range
+			resolution (str|int, optional): `raw` or a tier's bucket width.
+			Defaults to None - the raw samples if they reach back to
+			`start`, else the finest tier which does (or reaches furthest).
+
+		Returns:
+			RingBuffer: The raw buffer or a `RollupBuffer`
+
+		Raises:
+			ValueError: If there is no tier of the asked width
+		"""
+		rollups = getattr(buffer, "rollups", None) or []
+		if resolution == Query.RAW:
+			return buffer
+		if resolution is not None:
+			for each_rollup in rollups:
+				if each_rollup.width == int(resolution):
+					return each_rollup
+			raise ValueError("No rollup tier of " + str(resolution) + "s")
+		if len(rollups) == 0 or (len(buffer) > 0 and buffer.ts(0) <= start):
+			return buffer
+		for each_rollup in rollups:
+			if len(each_rollup) > 0 and each_rollup.ts(0) <= start:
+				return each_rollup
+		return min(
+			[each for each in rollups if len(each) > 0] or [buffer],
+			key=lambda each: each.ts(0) if len(each) > 0 else math.inf
+		)
+
+	@staticmethod
+	def span(source, start, end):
+		"""Logical indices [first, last) of the samples in [start, end]"""
+		return source.bisect(start), source.bisect(end + 1)
+
+	@staticmethod
+	def rows(source, start, end):
+		"""The samples (or buckets) of a range, oldest first
+
+		Returns:
+			list: {"ts", "value"} dicts, buckets also carry "min", "max" and
+			"count" and their value is the bucket mean
+		"""
+		first, last = Query.span(source, start, end)
+		rows = []
+		for i_s in range(first, last):
+			if hasattr(source, "bucket"):
+				ts, low, high, total, count, _ = source.bucket(i_s)
+				rows.append({
+					"ts": ts, "value": total / count if count > 0 else None,
+					"min": low, "max": high, "count": count
+				})
+			else:
+				rows.append({"ts": source.ts(i_s), "value": source.value(i_s)})
+		return rows
+
+	@staticmethod
+	def percentile(weighted, q):
+		"""Linearly interpolated percentile of weighted values
+
+		Args:
+			weighted (list): (value, weight) pairs sorted by value
+			q (float): The percentile, 0 to 100
+
+		Returns:
+			float: The percentile
+		"""
+		position = q / 100.0 * (sum(weight for _, weight in weighted) - 1)
+
+		def value_at(rank):
+			seen = 0
+			for value, weight in weighted:
+				seen += weight
+				if rank < seen:
+					return value
+			return weighted[-1][0]
+
+		low = value_at(math.floor(position))
+		high = value_at(math.ceil(position))
+		return low + (high - low) * (position - math.floor(position))
+
+	@staticmethod
+	def aggregate(source, start, end, functions):
+		"""Aggregate a range
+
+		Args:
+			source (RingBuffer): See `source`
+			start (int): Epoch start, inclusive
+			end (int): Epoch end, inclusive
+			functions (list): Aggregates, see `supported`
+
+		Returns:
+			dict: function -> value, None for all but `count` on an empty range
+		"""
+		first, last = Query.span(source, start, end)
+		count = 0
+		total = 0.0
+		low = math.inf
+		high = -math.inf
+		latest = None
+		weighted = []
+		for i_s in range(first, last):
+			if hasattr(source, "bucket"):
+				_, bucket_low, bucket_high, bucket_total, bucket_count, latest = source.bucket(i_s)
+				if bucket_count == 0:
+					continue
+				weighted.append((bucket_total / bucket_count, bucket_count))
+			else:
+				latest = source.value(i_s)
+				bucket_low, bucket_high, bucket_total, bucket_count = latest, latest, latest, 1
+				weighted.append((latest, 1))
+			count += bucket_count
+			total += bucket_total
+			low = min(low, bucket_low)
+			high = max(high, bucket_high)
+		weighted.sort()
+
+		results = {}
+		for each_function in functions:
+			if each_function == "count":
+				results[each_function] = count
+			elif count == 0:
+				results[each_function] = None
+			elif each_function == "avg":
+				results[each_function] = total / count
+			elif each_function == "min":
+				results[each_function] = low
+			elif each_function == "max":
+				results[each_function] = high
+			elif each_function == "sum":
+				results[each_function] = total
+			elif each_function == "last":
+				results[each_function] = latest
+			else:
+				results[each_function] = Query.percentile(weighted, float(each_function[1:]))
+		return results
+
+	@staticmethod
+	@contextmanager
+	def lookup(kind, name, host=None):
+		"""The raw buffer of a metric, with its rollup tiers bound, from
+		the local store or from an agent host's ring file on the collector.
+		The ring files are mapped read-only and closed again when the block
+		exits: a query never creates, seeds or resizes anything under the
+		process writing to them.
+
+		Usage:
+			with Query.lookup(kind, name) as buffer:
+				...
+
+		Raises:
+			ValueError: If the metric (or host) has no samples stored
+		"""
+		tiers = []
+		if host is not None:
+			if os.path.basename(host) != host or host.startswith("."):
+				raise ValueError("Illegal host name " + host)
+			ring = RingFile.open_readonly(os.path.join(ConfigLoader.Collector["hosts_dir"], host + ".bin"))
+			if ring is None:
+				raise ValueError("No telemetry stored for host " + host)
+		else:
+			ring = RingFile.open_readonly(ConfigLoader.Telemetry["base_path"])
+			if kind in Storage.ROLLED_UP:
+				for width, _ in ConfigLoader.Telemetry["tiers"]:
+					tiers.append(RingFile.open_readonly(
+						Storage.tier_path(width), columns=RollupBuffer.COLUMNS,
+						factory=lambda ring, index, width=width: RollupBuffer(ring, index, width)
+					))
+		try:
+			buffer = ring.get(kind, name) if ring is not None else None
+			if buffer is None:
+				raise ValueError("No " + kind + " stored for " + name)
+			buffer.rollups = [
+				each_tier.get(kind, name) for each_tier in tiers
+				if each_tier is not None and each_tier.get(kind, name) is not None
+			]
+			yield buffer
+		finally:
+			for each_ring in [ring] + tiers:
+				if each_ring is not None:
+					each_ring.close()
+
+	@staticmethod
+	def run(name, kind=Storage.KEY_TELEMETRY, start=None, end=None, functions=None, resolution=None, host=None):
+		"""Query a metric
+
+		Args:
+			name (str): The metric, eg. `cpu`, or a process name
+			kind (str, optional): Storage family. Defaults to telemetry.
+			start (int, optional): Epoch start. Defaults to an hour ago.
+			end (int, optional): Epoch end. Defaults to now.
+			functions (list, optional): Aggregates to compute. Defaults to
+			None - return the samples.
+			resolution (str|int, optional): See `source`
+			host (str, optional): Agent host, when run on a collector
+
+		Returns:
+			dict: The query, what it was served from and its "rows" or
+			"aggregates"
+		"""
+		end = end if end is not None else int(datetime.now().timestamp())
+		start = start if start is not None else end - 3600
+		if start > end:
+			raise ValueError("The range starts after it ends")
+		for each_function in functions or []:
+			if not Query.supported(each_function):
+				raise ValueError("Unsupported aggregate " + each_function)
+
+		with Query.lookup(kind, name, host) as buffer:
+			source = Query.source(buffer, start, resolution)
+			result = {
+				"metric": name,
+				"kind": kind,
+				"from": start,
+				"to": end,
+				"resolution": source.width if hasattr(source, "width") else Query.RAW
+			}
+			if functions:
+				result["aggregates"] = Query.aggregate(source, start, end, functions)
+			else:
+				result["rows"] = Query.rows(source, start, end)
+		return result
+
+	@staticmethod
+	def render(result):
+		"""Plain text rendering of a `run` result"""
+		lines = []
+		if "aggregates" in result:
+			for each_function, value in result["aggregates"].items():
+				lines.append(each_function.ljust(8) + ("-" if value is None else str(round(value, 3))))
+			return "\n".join(lines)
+		for each_row in result["rows"]:
+			line = datetime.fromtimestamp(each_row["ts"]).isoformat() + "  " + str(round(each_row["value"], 3))
+			if "count" in each_row:
+				line += "  (min " + str(round(each_row["min"], 3)) + ", max " + str(round(each_row["max"], 3)) + \
+					", n " + str(each_row["count"]) + ")"
+			lines.append(line)
+		return "\n".join(lines) if len(lines) > 0 else "No samples in range"
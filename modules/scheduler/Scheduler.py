@@ -0,0 +1,98 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from modules.logger.Logger import Logger
+import threading
+import heapq
+import time
+
+class Scheduler:
+	"""Simple in-process job scheduler driven by the monotonic clock.
+	Each job runs on its own interval. Jobs which fall behind (eg. the
+	host was suspended) are rescheduled from now instead of being
+	replayed in a burst. A job which raises is logged and stays
+	scheduled, it never takes the loop down.
+	"""
+
+	def __init__(self, clock=time.monotonic):
+		self.clock = clock
+		self.jobs = []
+		self.running = False
+		self.wakeup = threading.Event()
+		self._seq = 0
+
+	def every(self, interval, job, name=None, run_now=True):
+		"""Register a job to be run periodically
+
+		Args:
+			interval (float): Seconds between two runs of the job
+			job (func): Callable taking no arguments
+			name (str, optional): Label for the job. Defaults to None.
+			run_now (bool, optional): Set False to wait one interval before
+			the first run. Defaults to True.
+		"""
+		due = self.clock() + (0 if run_now else float(interval))
+		heapq.heappush(self.jobs, [due, self._seq, float(interval), job, name])
+		self._seq += 1
+
+	def run_pending(self):
+		"""Run every job which is due as of now
+
+		Returns:
+			int: Number of jobs that were run
+		"""
+		ran = 0
+		now = self.clock()
+		while len(self.jobs) > 0 and self.jobs[0][0] <= now:
+			entry = heapq.heappop(self.jobs)
+			try:
+				entry[3]()
+			except Exception as job_error:
+				try:
+					Logger.error("job " + str(entry[4]), job_error)
+				except OSError:
+					pass
+			ran += 1
+
+			# Keep the cadence, but never try to catch up on missed runs
+			entry[0] += entry[2]
+			if entry[0] <= self.clock():
+				entry[0] = self.clock() + entry[2]
+			heapq.heappush(self.jobs, entry)
+		return ran
+
+	def next_due(self):
+		"""Seconds until the next job is due, None if nothing is scheduled"""
+		if len(self.jobs) == 0:
+			return None
+		return max(0.0, self.jobs[0][0] - self.clock())
+
+	def run(self):
+		"""Block and keep running jobs until `stop` is called"""
+		self.running = True
+		self.wakeup.clear()
+		while self.running:
+			self.run_pending()
+			wait = self.next_due()
+			if not self.running or wait is None:
+				break
+			self.wakeup.wait(wait)
+
+	def stop(self):
+		"""Stop the run loop. Safe to call from a signal handler"""
+		self.running = False
+		self.wakeup.set()
@@ -0,0 +1,145 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from array import array
+
+class RingBuffer:
+	"""Fixed capacity sample buffer for a single metric. Values and
+	timestamps live in two flat typed columns, appends and evictions
+	are O(1) and a running sum / sum of squares is maintained so that
+	the mean and variance of the window come for free.
+
+	Samples are indexed oldest first: `0` is the oldest retained sample
+	and `-1` the most recent one.
+	"""
+
+	def __init__(self, capacity, values=None, stamps=None):
+		"""
+		Args:
+			capacity (int): Maximum number of samples retained
+			values (sequence, optional): Float column to write into, eg. a
+			memoryview over a mapped file. Defaults to a new `array('d')`.
+			stamps (sequence, optional): Int column to write into. Defaults
+			to a new `array('q')`.
+		"""
+		self.capacity = int(capacity)
+		self.values = values if values is not None else array('d', bytes(8 * self.capacity))
+		self.stamps = stamps if stamps is not None else array('q', bytes(8 * self.capacity))
+		self.head = 0
+		self.count = 0
+		self.sum = 0.0
+		self.sumsq = 0.0
+
+	def __len__(self):
+		return self.count
+
+	def __iter__(self):
+		for i in range(self.count):
+			yield self.ts(i), self.value(i)
+
+	def slot(self, i):
+		"""Physical column index of the `i`th retained sample
+
+		Args:
+			i (int): Logical index, negative values count from the newest
+
+		Returns:
+			int: Index into `values` and `stamps`
+		"""
+		if i < 0:
+			i += self.count
+		if i < 0 or i >= self.count:
+			raise IndexError("sample index out of range")
+		return (self.head - self.count + i) % self.capacity
+
+	def value(self, i):
+		return self.values[self.slot(i)]
+
+	def ts(self, i):
+		return self.stamps[self.slot(i)]
+
+	def last(self):
+		"""The most recent value, None if empty"""
+		return self.values[self.slot(-1)] if self.count > 0 else None
+
+	def last_ts(self):
+		"""Timestamp of the most recent value, 0 if empty"""
+		return self.stamps[self.slot(-1)] if self.count > 0 else 0
+
+	def bisect(self, ts):
+		"""Binary search the (time ordered) samples
+
+		Args:
+			ts (int): Epoch timestamp
+
+		Returns:
+			int: Logical index of the first sample at or after `ts`,
+			`len(self)` if there is none
+		"""
+		low, high = 0, self.count
+		while low < high:
+			middle = (low + high) // 2
+			if self.stamps[(self.head - self.count + middle) % self.capacity] < ts:
+				low = middle + 1
+			else:
+				high = middle
+		return low
+
+	def append(self, value, ts):
+		"""Add a sample, evicting the oldest one if full
+
+		Args:
+			value (float): The sample value
+			ts (int): Epoch timestamp of the sample
+		"""
+		value = float(value)
+		if self.count == self.capacity:
+			evicted = self.values[self.head]
+			self.sum -= evicted
+			self.sumsq -= evicted * evicted
+		else:
+			self.count += 1
+
+		self.values[self.head] = value
+		self.stamps[self.head] = int(ts)
+		self.sum += value
+		self.sumsq += value * value
+		self.head = (self.head + 1) % self.capacity
+
+		# Re-base the running sums once per lap so that float error from
+		# the add/subtract pairs can't accumulate. Amortized O(1).
+		if self.head == 0:
+			self.rebase()
+
+	def rebase(self):
+		"""Recompute the running aggregates from the retained samples"""
+		self.sum = 0.0
+		self.sumsq = 0.0
+		for i in range(self.count):
+			each_value = self.values[self.slot(i)]
+			self.sum += each_value
+			self.sumsq += each_value * each_value
+
+	def mean(self):
+		return self.sum / self.count if self.count > 0 else 0.0
+
+	def variance(self):
+		"""Population variance of the retained samples"""
+		if self.count == 0:
+			return 0.0
+		mean = self.sum / self.count
+		return max(0.0, self.sumsq / self.count - mean * mean)
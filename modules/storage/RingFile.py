@@ -0,0 +1,698 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+from modules.storage.RingBuffer import RingBuffer
+import bisect
+import struct
+import math
+import mmap
+import os
+
+class MappedRingBuffer(RingBuffer):
+	"""A `RingBuffer` whose columns live inside a `RingFile` slot. Every
+	append writes the sample in place and then the slot's small header
+	(head, count, running sums). Appends are passed on to the `rollups`,
+	the `anomaly` statistics, the quantile `sketch` and the running sums
+	of the `derivative` bound to it, if any.
+	"""
+
+	def __init__(self, ring, index):
+		self.ring = ring
+		self.index = index
+		self.rollups = []
+		self.anomaly = None
+		self.sketch = None
+		self.derivative = None
+		values, stamps, self.extras = ring.columns(index)
+		RingBuffer.__init__(self, ring.capacity, values, stamps)
+		self.head, self.count, self.sum, self.sumsq = struct.unpack_from(
+			RingFile.STATE_FORMAT, ring.map, ring.slot_offset(index) + RingFile.STATE_OFFSET
+		)
+		if self.head >= self.capacity or self.count > self.capacity:
+			# Torn slot header, start over rather than read garbage
+			self.head, self.count = 0, 0
+			self.rebase()
+
+	def rebind(self):
+		"""Point the columns at the current mapping (after a remap)"""
+		self.values, self.stamps, self.extras = self.ring.columns(self.index)
+
+	def append(self, value, ts):
+		RingBuffer.append(self, value, ts)
+		self.sync()
+		for each_rollup in self.rollups:
+			each_rollup.append(value, ts)
+		if self.anomaly is not None:
+			self.anomaly.append(value, ts)
+		if self.sketch is not None:
+			self.sketch.append(value, ts)
+		if self.derivative is not None:
+			self.derivative.append(value, ts)
+
+	def row(self, i):
+		"""Every column of the `i`th retained sample, the value first"""
+		slot = self.slot(i)
+		return (self.values[slot],) + tuple(each[slot] for each in self.extras)
+
+	def append_row(self, ts, row):
+		"""Append a sample with every column given, see `row`"""
+		RingBuffer.append(self, row[0], ts)
+		slot = self.slot(-1)
+		for i_c, each_column in enumerate(self.extras):
+			each_column[slot] = row[i_c + 1]
+		self.sync()
+
+	def sync(self):
+		"""Write the in-memory ring state to the slot header"""
+		struct.pack_into(
+			RingFile.STATE_FORMAT, self.ring.map,
+			self.ring.slot_offset(self.index) + RingFile.STATE_OFFSET,
+			self.head, self.count, self.sum, self.sumsq
+		)
+
+class RollupBuffer(MappedRingBuffer):
+	"""Fixed width time buckets of a metric, each holding the min, max,
+	sum, count and last value of the samples that fell in it. Buckets
+	are indexed like samples: `ts(i)` is the bucket start and `value(i)`
+	its last value. A sample older than the newest bucket is dropped.
+	"""
+
+	COLUMNS = 5
+	MIN, MAX, SUM, COUNT = 0, 1, 2, 3
+
+	def __init__(self, ring, index, width):
+		MappedRingBuffer.__init__(self, ring, index)
+		self.width = int(width)
+
+	def append(self, value, ts):
+		value = float(value)
+		bucket = int(ts) - int(ts) % self.width
+		if self.count > 0 and bucket == self.last_ts():
+			slot = self.slot(-1)
+			previous = self.values[slot]
+			self.values[slot] = value
+			self.sum += value - previous
+			self.sumsq += value * value - previous * previous
+			self.extras[RollupBuffer.MIN][slot] = min(self.extras[RollupBuffer.MIN][slot], value)
+			self.extras[RollupBuffer.MAX][slot] = max(self.extras[RollupBuffer.MAX][slot], value)
+			self.extras[RollupBuffer.SUM][slot] += value
+			self.extras[RollupBuffer.COUNT][slot] += 1
+		elif self.count == 0 or bucket > self.last_ts():
+			self.append_row(bucket, (value, value, value, value, 1.0))
+			return
+		else:
+			return
+		self.sync()
+
+	def bucket(self, i):
+		"""The `i`th retained bucket
+
+		Returns:
+			(int, float, float, float, int, float): start, min, max, sum,
+			count, last
+		"""
+		slot = self.slot(i)
+		return (
+			self.stamps[slot],
+			self.extras[RollupBuffer.MIN][slot],
+			self.extras[RollupBuffer.MAX][slot],
+			self.extras[RollupBuffer.SUM][slot],
+			int(self.extras[RollupBuffer.COUNT][slot]),
+			self.values[slot]
+		)
+
+class AnomalyBuffer(MappedRingBuffer):
+	"""Exponentially weighted mean and variance of a metric, updated in
+	O(1) on every sample. Rows parallel the metric's samples: `value(i)`
+	is how many standard deviations the `i`th sample was away from the
+	mean of the samples before it (0 while warming up), and its other
+	columns hold the statistics once it was folded in.
+	"""
+
+	COLUMNS = 4
+	MEAN, VARIANCE, SEEN = 0, 1, 2
+
+	# Deviations are measured against at least this fraction of the mean,
+	# so that a flat metric (eg. no swap) doesn't alarm on its first blip
+	MIN_RELATIVE_STD = 0.01
+
+	def __init__(self, ring, index, alpha, warmup):
+		"""
+		Args:
+			alpha (float): Weight of a new sample, 0 to 1
+			warmup (int): Samples seen before deviations are reported
+		"""
+		MappedRingBuffer.__init__(self, ring, index)
+		self.alpha = float(alpha)
+		self.warmup = int(warmup)
+
+	@staticmethod
+	def deviation(value, mean, variance):
+		std = max(math.sqrt(max(variance, 0.0)), abs(mean) * AnomalyBuffer.MIN_RELATIVE_STD, 1e-9)
+		return (value - mean) / std
+
+	def append(self, value, ts):
+		value = float(value)
+		if self.count > 0:
+			if int(ts) < self.last_ts():
+				return
+			slot = self.slot(-1)
+			mean = self.extras[AnomalyBuffer.MEAN][slot]
+			variance = self.extras[AnomalyBuffer.VARIANCE][slot]
+			seen = self.extras[AnomalyBuffer.SEEN][slot]
+		else:
+			mean, variance, seen = value, 0.0, 0.0
+		score = AnomalyBuffer.deviation(value, mean, variance) if seen >= self.warmup else 0.0
+
+		# West's incremental form of the weighted mean and variance
+		difference = value - mean
+		increment = self.alpha * difference
+		mean += increment
+		variance = (1.0 - self.alpha) * (variance + difference * increment)
+		self.append_row(ts, (score, mean, variance, seen + 1))
+
+	def baseline(self):
+		"""Mean and standard deviation the newest sample was judged on
+
+		Returns:
+			(float, float)|None: None before two samples were seen
+		"""
+		if self.count < 2:
+			return None
+		_, mean, variance, _ = self.row(-2)
+		return mean, math.sqrt(max(variance, 0.0))
+
+class SketchBuffer(MappedRingBuffer):
+	"""Fixed width time buckets of a metric, each holding a bounded
+	quantile sketch of the samples that fell in it: up to `centroids`
+	(mean, weight) pairs kept sorted, plus the count, min and max. When
+	a bucket overflows, the two neighbouring centroids closest in value
+	are merged (the streaming histogram of Ben-Haim & Tom-Tov, which
+	t-digest refines). Sketches merge by pooling their centroids, so a
+	window's quantiles come from at most `centroids` points per bucket,
+	never from sorting the raw samples. `value(i)` is the bucket's last
+	sample, like in `RollupBuffer`.
+	"""
+
+	COUNT, MIN, MAX, CENTROIDS = 0, 1, 2, 3
+
+	def __init__(self, ring, index, width):
+		MappedRingBuffer.__init__(self, ring, index)
+		self.width = int(width)
+		self.centroids = (len(self.extras) - SketchBuffer.CENTROIDS) // 2
+
+	@staticmethod
+	def columns_for(centroids):
+		"""Float64 columns of a sketch with `centroids` centroids"""
+		return 1 + SketchBuffer.CENTROIDS + 2 * centroids
+
+	def points(self, i):
+		"""(mean, weight) centroids of the `i`th retained bucket"""
+		means, weights = self.centroids_of(self.slot(i))
+		return list(zip(means, weights))
+
+	def centroids_of(self, slot):
+		means, weights = [], []
+		for i_c in range(SketchBuffer.CENTROIDS, SketchBuffer.CENTROIDS + 2 * self.centroids, 2):
+			weight = self.extras[i_c + 1][slot]
+			if weight <= 0:
+				break
+			means.append(self.extras[i_c][slot])
+			weights.append(weight)
+		return means, weights
+
+	def append(self, value, ts):
+		value = float(value)
+		bucket = int(ts) - int(ts) % self.width
+		if self.count > 0 and bucket == self.last_ts():
+			slot = self.slot(-1)
+			means, weights = self.centroids_of(slot)
+			previous = self.values[slot]
+			self.values[slot] = value
+			self.sum += value - previous
+			self.sumsq += value * value - previous * previous
+			self.extras[SketchBuffer.COUNT][slot] += 1
+			self.extras[SketchBuffer.MIN][slot] = min(self.extras[SketchBuffer.MIN][slot], value)
+			self.extras[SketchBuffer.MAX][slot] = max(self.extras[SketchBuffer.MAX][slot], value)
+		elif self.count == 0 or bucket > self.last_ts():
+			self.append_row(bucket, (value, 1.0, value, value) + (0.0,) * (2 * self.centroids))
+			slot = self.slot(-1)
+			means, weights = [], []
+		else:
+			return
+
+		# Insert in value order, then merge the closest pair if over budget.
+		# Only the centroids from the first changed one on are written back.
+		changed = bisect.bisect_left(means, value)
+		if changed < len(means) and means[changed] == value:
+			weights[changed] += 1
+		else:
+			means.insert(changed, value)
+			weights.insert(changed, 1.0)
+		if len(means) > self.centroids:
+			gaps = [means[i_c + 1] - means[i_c] for i_c in range(len(means) - 1)]
+			closest = gaps.index(min(gaps))
+			weight = weights[closest] + weights[closest + 1]
+			means[closest:closest + 2] = [(means[closest] * weights[closest] + means[closest + 1] * weights[closest + 1]) / weight]
+			weights[closest:closest + 2] = [weight]
+			changed = min(changed, closest)
+		for i_c in range(changed, len(means)):
+			self.extras[SketchBuffer.CENTROIDS + 2 * i_c][slot] = means[i_c]
+			self.extras[SketchBuffer.CENTROIDS + 2 * i_c + 1][slot] = weights[i_c]
+		self.sync()
+
+	def quantile(self, q, since):
+		"""Estimate a quantile of the samples since a point in time, at
+		bucket granularity (the bucket `since` falls in is included)
+
+		Args:
+			q (float): The quantile, 0 to 1
+			since (int): Epoch start of the window
+
+		Returns:
+			(float|None): The estimate, None without samples in the window
+		"""
+		first = self.bisect(since - since % self.width)
+		if first >= len(self):
+			return None
+		points = []
+		low = math.inf
+		high = -math.inf
+		for i_b in range(first, len(self)):
+			points += self.points(i_b)
+			slot = self.slot(i_b)
+			low = min(low, self.extras[SketchBuffer.MIN][slot])
+			high = max(high, self.extras[SketchBuffer.MAX][slot])
+		points.sort()
+		total = sum(weight for _, weight in points)
+
+		# Each centroid's weight is centered on its mean, interpolate in
+		# between; the tails run out to the min and max
+		target = q * total
+		cumulative = 0.0
+		previous_center, previous_mean = 0.0, low
+		for mean, weight in points:
+			center = cumulative + weight / 2.0
+			if target <= center:
+				if center == previous_center:
+					return mean
+				return previous_mean + (mean - previous_mean) * (target - previous_center) / (center - previous_center)
+			previous_center, previous_mean = center, mean
+			cumulative += weight
+		if total == previous_center:
+			return high
+		return previous_mean + (high - previous_mean) * (target - previous_center) / (total - previous_center)
+
+class DerivativeBuffer(MappedRingBuffer):
+	"""Running sums of a metric, from which the rate of a counter and the
+	least squares slope of a gauge over any window of its retained
+	samples come in O(1). Rows parallel the samples: `value(i)` is the
+	sample, its other columns are sums since the start of a segment -
+	the samples, the counter increase (a drop is taken as a reset to 0),
+	t, v, t², t·v with t in seconds since the segment's anchor.
+
+	A segment starts over (new anchor, sums back to 0) every `capacity`
+	samples, which keeps the sums small enough to difference precisely,
+	so a window of retained samples spans two segments at most.
+	"""
+
+	COLUMNS = 8
+	ANCHOR, COUNT, INCREASE, SUM_T, SUM_V, SUM_TT, SUM_TV = 0, 1, 2, 3, 4, 5, 6
+
+	def append(self, value, ts):
+		value = float(value)
+		ts = int(ts)
+		if self.count > 0:
+			if ts < self.last_ts():
+				return
+			slot = self.slot(-1)
+			previous = self.values[slot]
+			increase = value - previous if value >= previous else value
+			anchor, count, total, st, sv, stt, stv = (each[slot] for each in self.extras)
+			if count >= self.capacity:
+				anchor, count, total, st, sv, stt, stv = ts, 0, 0.0, 0.0, 0.0, 0.0, 0.0
+		else:
+			increase = 0.0
+			anchor, count, total, st, sv, stt, stv = ts, 0, 0.0, 0.0, 0.0, 0.0, 0.0
+		t = ts - anchor
+		self.append_row(ts, (
+			value, anchor, count + 1, total + increase, st + t, sv + value, stt + t * t, stv + t * value
+		))
+
+	def sums(self, i):
+		slot = self.slot(i)
+		return [each[slot] for each in self.extras]
+
+	def window(self, since):
+		"""Sums over the samples at or after a point in time. Past the
+		retained samples, the window starts at the oldest one.
+
+		Args:
+			since (int): Epoch start of the window
+
+		Returns:
+			(list|None): [anchor, samples, increase, Σt, Σv, Σt², Σt·v] with
+			t relative to the newest sample's anchor, and the seconds the
+			increase was over; None for less than two samples
+		"""
+		last = len(self) - 1
+		# The increase into the first sample is counted from the one before
+		base = max(self.bisect(since) - 1, 0)
+		if last <= base:
+			return None
+		newest = self.sums(last)
+		oldest = self.sums(base)
+		elapsed = self.ts(last) - self.ts(base)
+		if oldest[DerivativeBuffer.ANCHOR] == newest[DerivativeBuffer.ANCHOR]:
+			return [newest[DerivativeBuffer.ANCHOR]] + \
+				[newest[i_c] - oldest[i_c] for i_c in range(1, DerivativeBuffer.COLUMNS - 1)], elapsed
+
+		# Across a segment start: the tail of the previous segment, shifted
+		# to the newest anchor, plus the current segment
+		boundary = last - int(newest[DerivativeBuffer.COUNT])
+		tail = self.sums(boundary)
+		if tail[DerivativeBuffer.ANCHOR] != oldest[DerivativeBuffer.ANCHOR]:
+			# More than two segments (eg. the capacity grew), keep the newest
+			oldest = [newest[DerivativeBuffer.ANCHOR]] + [0.0] * (DerivativeBuffer.COLUMNS - 2)
+			tail = oldest
+			elapsed = self.ts(last) - self.ts(boundary)
+		_, count, increase, st, sv, stt, stv = [tail[i_c] - oldest[i_c] for i_c in range(DerivativeBuffer.COLUMNS - 1)]
+		shift = oldest[DerivativeBuffer.ANCHOR] - newest[DerivativeBuffer.ANCHOR]
+		stt += 2 * shift * st + count * shift * shift
+		stv += shift * sv
+		st += count * shift
+		return [
+			newest[DerivativeBuffer.ANCHOR],
+			newest[DerivativeBuffer.COUNT] + count,
+			newest[DerivativeBuffer.INCREASE] + increase,
+			newest[DerivativeBuffer.SUM_T] + st,
+			newest[DerivativeBuffer.SUM_V] + sv,
+			newest[DerivativeBuffer.SUM_TT] + stt,
+			newest[DerivativeBuffer.SUM_TV] + stv
+		], elapsed
+
+	def rate(self, since):
+		"""Per second increase of a counter since a point in time, resets
+		included (None for less than two samples)"""
+		window = self.window(since)
+		if window is None or window[1] <= 0:
+			return None
+		return window[0][DerivativeBuffer.INCREASE] / window[1]
+
+	def fit(self, since):
+		"""Least squares line through the samples since a point in time
+
+		Returns:
+			(tuple|None): (slope per second, mean time, mean value, anchor),
+			None for less than two distinct sample times
+		"""
+		window = self.window(since)
+		if window is None:
+			return None
+		anchor, count, _, st, sv, stt, stv = window[0]
+		if count < 2:
+			return None
+		sxx = stt - st * st / count
+		if sxx <= 0:
+			return None
+		return (stv - st * sv / count) / sxx, st / count, sv / count, anchor
+
+	def slope(self, since):
+		"""Least squares slope (per second) since a point in time"""
+		fit = self.fit(since)
+		return fit[0] if fit is not None else None
+
+	def time_to_full(self, since, now, full):
+		"""Seconds until the least squares line since a point in time
+		reaches `full`: 0 if it already did, infinity if it never will
+
+		Returns:
+			(float|None): None for too few samples to fit a line
+		"""
+		fit = self.fit(since)
+		if fit is None:
+			return None
+		slope, mean_t, mean_v, anchor = fit
+		level = mean_v + slope * (now - anchor - mean_t)
+		if level >= full:
+			return 0.0
+		if slope <= 0:
+			return math.inf
+		return (full - level) / slope
+
+class RingFile:
+	"""Fixed layout telemetry file accessed through `mmap`.
+
+	Layout (little endian):
+		header  (64 bytes): magic, version, slot capacity, slots in use,
+			float64 columns per slot (0 in older files, meaning 1)
+		slot[i] (SLOT_HEADER_SIZE + 8 * capacity * (1 + columns) bytes each):
+			kind (16 bytes), name (112 bytes), head, count, sum, sum of squares
+			followed by `capacity` int64 timestamps and `columns` times
+			`capacity` float64 values, the sample value being the first
+
+	Opening the file only reads the slot headers, so startup does not
+	depend on how much history is kept. A new metric appends a slot at
+	the end of the file; a sample is written in place into its slot.
+	Readers which must not write (queries) map it with `open_readonly`.
+	"""
+
+	MAGIC = b"RASPIMON"
+	VERSION = 1
+
+	HEADER_FORMAT = "<8sIIII"
+	HEADER_SIZE = 64
+
+	KIND_SIZE = 16
+	NAME_SIZE = 112
+	NAME_FORMAT = "<16s112s"
+	STATE_FORMAT = "<IIdd"
+	STATE_OFFSET = 128
+	SLOT_HEADER_SIZE = 160
+
+	def __init__(self, path, columns=1, factory=None):
+		"""
+		Args:
+			path (str): Location of the ring file
+			columns (int, optional): Float64 columns per sample. Defaults to 1.
+			factory (func, optional): (ring, index) -> buffer of a slot.
+			Defaults to `MappedRingBuffer`.
+		"""
+		self.path = path
+		self.columns_count = columns
+		self.factory = factory or MappedRingBuffer
+		self.capacity = 0
+		self.slots = 0
+		self.file = None
+		self.map = None
+		self.readonly = False
+		self.views = []
+		self.buffers = {}
+
+	@staticmethod
+	def open(path, capacity, columns=1, factory=None):
+		"""Open (or create) the ring file at `path`. A file holding a
+		different capacity is rewritten with the latest samples kept.
+
+		Args:
+			path (str): Location of the ring file
+			capacity (int): Samples retained per metric
+			columns (int, optional): Float64 columns per sample. Defaults to 1.
+			factory (func, optional): (ring, index) -> buffer of a slot.
+			Defaults to `MappedRingBuffer`.
+
+		Returns:
+			RingFile: The opened ring file
+		"""
+		ring = RingFile(path, columns, factory)
+		ring.load(capacity)
+		if ring.capacity == capacity:
+			return ring
+
+		resized = RingFile(path + ".tmp", columns, factory)
+		resized.create(capacity)
+		resized.load(capacity)
+		for kind, name, buffer in ring.entries():
+			target = resized.get(kind, name, create=True)
+			for i_s in range(max(0, len(buffer) - capacity), len(buffer)):
+				target.append_row(buffer.ts(i_s), buffer.row(i_s))
+		resized.close()
+		ring.close()
+		os.replace(path + ".tmp", path)
+
+		ring = RingFile(path, columns, factory)
+		ring.load(capacity)
+		return ring
+
+	@staticmethod
+	def open_readonly(path, columns=1, factory=None):
+		"""Map an existing ring file for reading only, with whatever
+		capacity it was written with. Nothing is created, resized or
+		written, so it is safe next to the process appending to it.
+
+		Args:
+			path (str): Location of the ring file
+			columns (int, optional): Float64 columns per sample. Defaults to 1.
+			factory (func, optional): (ring, index) -> buffer of a slot.
+			Defaults to `MappedRingBuffer`.
+
+		Returns:
+			(RingFile|None): The ring file, None if it is missing or isn't
+			a ring file of `columns` columns
+		"""
+		if not os.path.isfile(path) or os.path.getsize(path) < RingFile.HEADER_SIZE:
+			return None
+		ring = RingFile(path, columns, factory)
+		ring.readonly = True
+		ring.file = open(path, "rb")
+		ring.map = mmap.mmap(ring.file.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, version, ring.capacity, ring.slots, columns = struct.unpack_from(RingFile.HEADER_FORMAT, ring.map, 0)
+		if magic != RingFile.MAGIC or version != RingFile.VERSION or ring.capacity == 0 or \
+			max(columns, 1) != ring.columns_count:
+			ring.close()
+			return None
+		ring.index_slots()
+		return ring
+
+	def create(self, capacity):
+		"""Write an empty ring file, replacing whatever is at the path"""
+		with open(self.path, "wb") as ring_file:
+			header = struct.pack(
+				RingFile.HEADER_FORMAT, RingFile.MAGIC, RingFile.VERSION, capacity, 0, self.columns_count
+			)
+			ring_file.write(header.ljust(RingFile.HEADER_SIZE, b"\0"))
+			ring_file.flush()
+			os.fsync(ring_file.fileno())
+
+	def load(self, capacity):
+		"""Map the file and index its slots. Missing or unreadable files
+		are (re)created empty with `capacity`.
+		"""
+		if not os.path.isfile(self.path) or os.path.getsize(self.path) < RingFile.HEADER_SIZE:
+			self.create(capacity)
+		self.file = open(self.path, "r+b")
+		self.map = mmap.mmap(self.file.fileno(), 0)
+
+		magic, version, self.capacity, self.slots, columns = struct.unpack_from(RingFile.HEADER_FORMAT, self.map, 0)
+		if magic != RingFile.MAGIC or version != RingFile.VERSION or self.capacity == 0 or \
+			max(columns, 1) != self.columns_count:
+			self.close()
+			self.create(capacity)
+			self.load(capacity)
+			return
+
+		self.index_slots()
+
+	def index_slots(self):
+		"""Make a buffer for every slot of the mapped file"""
+		# Ignore slots cut short by a crash while the file was growing
+		self.slots = min(self.slots, (len(self.map) - RingFile.HEADER_SIZE) // self.slot_size())
+
+		for index in range(self.slots):
+			kind, name = self.slot_name(index)
+			self.buffers[(kind, name)] = self.factory(self, index)
+
+	def slot_size(self):
+		return RingFile.SLOT_HEADER_SIZE + 8 * self.capacity * (1 + self.columns_count)
+
+	def slot_offset(self, index):
+		return RingFile.HEADER_SIZE + index * self.slot_size()
+
+	def slot_name(self, index):
+		kind, name = struct.unpack_from(RingFile.NAME_FORMAT, self.map, self.slot_offset(index))
+		return kind.rstrip(b"\0").decode("utf-8"), name.rstrip(b"\0").decode("utf-8")
+
+	def columns(self, index):
+		"""Zero-copy views over a slot's columns
+
+		Returns:
+			(memoryview, memoryview, list): values, timestamps and the
+			other float64 columns
+		"""
+		if len(self.views) == 0:
+			self.views.append(memoryview(self.map))
+		stamps_at = self.slot_offset(index) + RingFile.SLOT_HEADER_SIZE
+		column_size = 8 * self.capacity
+		raw = [self.views[0][stamps_at:stamps_at + column_size]]
+		for i_c in range(self.columns_count):
+			column_at = stamps_at + column_size * (i_c + 1)
+			raw.append(self.views[0][column_at:column_at + column_size])
+		self.views.extend(raw)
+		cast = [raw[0].cast("q")] + [each.cast("d") for each in raw[1:]]
+		self.views.extend(cast)
+		return cast[1], cast[0], cast[2:]
+
+	def release(self):
+		"""Drop every view into the mapping so that it can be closed"""
+		for each_view in reversed(self.views):
+			each_view.release()
+		self.views = []
+
+	def entries(self):
+		"""Iterate over (kind, name, buffer) of every slot"""
+		for key in list(self.buffers.keys()):
+			yield key[0], key[1], self.buffers[key]
+
+	def get(self, kind, name, create=False):
+		"""Get the buffer of a metric, optionally appending a new slot
+
+		Args:
+			kind (str): The metric family eg. `telemetry`
+			name (str): The metric name
+			create (bool, optional): Allocate a slot if missing. Defaults to False.
+
+		Returns:
+			(MappedRingBuffer|None): The metric's buffer
+		"""
+		if (kind, name) in self.buffers or not create or self.readonly:
+			return self.buffers.get((kind, name))
+
+		kind_bytes, name_bytes = kind.encode("utf-8"), name.encode("utf-8")
+		if len(kind_bytes) > RingFile.KIND_SIZE or len(name_bytes) > RingFile.NAME_SIZE:
+			raise ValueError("Metric name too long for the telemetry store: " + name)
+
+		# Grow the file by one zeroed slot and remap it
+		index = self.slots
+		self.release()
+		self.map.close()
+		self.file.truncate(self.slot_offset(index + 1))
+		self.map = mmap.mmap(self.file.fileno(), 0)
+		for each_buffer in self.buffers.values():
+			each_buffer.rebind()
+
+		struct.pack_into(RingFile.NAME_FORMAT, self.map, self.slot_offset(index), kind_bytes, name_bytes)
+		self.slots += 1
+		struct.pack_into("<I", self.map, 16, self.slots)
+
+		self.buffers[(kind, name)] = self.factory(self, index)
+		return self.buffers[(kind, name)]
+
+	def flush(self):
+		"""Ask the kernel to write the dirty pages back to disk"""
+		if self.map is not None and not self.readonly:
+			self.map.flush()
+
+	def close(self):
+		if self.map is not None:
+			self.release()
+			self.flush()
+			self.map.close()
+			self.map = None
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+		self.buffers = {}
@@ -16,20 +16,60 @@ limitations under the License.
 """
 
 from modules.config.ConfigLoader import ConfigLoader
-import json
+from modules.metrics.Instrument import Instrument
+from modules.storage.RingFile import RingFile, RollupBuffer, AnomalyBuffer, SketchBuffer, DerivativeBuffer
+from contextlib import contextmanager
 import time
 import os
 
 class Storage:
 	"""A storage class to maintain in-memory copy of the telemetry
 	data on runtime. Occasionally sync back to the disk.
+
+	Every metric is held as a `RingBuffer` mapped from the `RingFile`
+	on disk, under `live[KEY_TELEMETRY]` or `live[KEY_PROCESSESES]`.
+	Process states are encoded as numbers, see `encode_state`. Raw
+	counters which collectors diff against on their next run are kept
+	under `live[KEY_COUNTERS]`.
+
+	Telemetry and process states are also rolled up into coarser tiers
+	(eg. 1 minute, 5 minute and 1 hour buckets), each in its own ring
+	file with a fixed number of buckets, see `RollupBuffer`. The tiers
+	of a metric are bound to its raw buffer and updated on every append.
+	So are a telemetry's anomaly statistics (`AnomalyBuffer`) and, for
+	the metrics listed in `kept`, its quantile sketches (`SketchBuffer`)
+	and running sums for rates and slopes (`DerivativeBuffer`).
 	"""
 
-	base_path = "monitoring_telemetry.json"
 	live = {}
+	ring = None
+	# (bucket width, RingFile) of every rollup tier, finest first
+	tiers = []
+	# RingFile of the telemetry's anomaly statistics
+	anomalies = None
+	# RingFile of the telemetry's quantile sketches
+	sketches = None
+	# RingFile of the telemetry's running sums for rates and slopes
+	derivatives = None
+	# Buffer attribute (`sketch`, `derivative`) -> telemetry names bound
+	# to it, see `keep`
+	kept = {}
+
+	SKETCH = "sketch"
+	DERIVATIVE = "derivative"
+
+	# Long running callers (the daemon) turn this off and flush periodically
+	autoflush = True
+	# Unflushed changes present in memory
+	dirty = False
+	# Nesting depth of open sessions
+	depth = 0
+	# (kind, name) of the series which received samples since the last drain
+	touched = {}
 
 	KEY_TELEMETRY = "telemetry"
 	KEY_PROCESSESES = "processes"
+	KEY_COUNTERS = "counters"
 	KEY_VALUES = "values"
 	KEY_VALUE = "value"
 	KEY_MOVING_AVG = "mavg"
@@ -37,10 +77,169 @@ class Storage:
 	KEY_TS = "ts"
 
 	CONST_VALUE_MAXVALUES = 20
-	
+
+	# Kinds rolled up into the tiers
+	ROLLED_UP = [KEY_TELEMETRY, KEY_PROCESSESES]
+
+	STATES = {
+		"down": 0.0,
+		"up": 1.0
+	}
+
+	@staticmethod
+	def fits(name):
+		"""Whether a metric or process name fits a slot of the store"""
+		return len(str(name).encode("utf-8")) <= RingFile.NAME_SIZE
+
+	@staticmethod
+	def encode_state(state):
+		"""Process state string to its numeric form held in the buffers"""
+		return Storage.STATES.get(str(state), Storage.STATES["down"])
+
+	@staticmethod
+	def decode_state(value):
+		"""Numeric process state back to its string form"""
+		for each_state in Storage.STATES.keys():
+			if Storage.STATES[each_state] == value:
+				return each_state
+		return "down"
+
+	@staticmethod
+	def migrate_legacy():
+		"""Import the samples of a JSON store written by older versions
+		into the (freshly created) ring file. The JSON file is left as is.
+		"""
+		contents = ConfigLoader.load_telemetry()
+		for each_kind in [Storage.KEY_TELEMETRY, Storage.KEY_PROCESSESES]:
+			for each_type in (contents.get(each_kind) or {}).keys():
+				buffer = Storage.series(each_kind, each_type, create=True)
+				for each_val in contents[each_kind][each_type].get(Storage.KEY_VALUES, []):
+					value = each_val[Storage.KEY_VALUE]
+					if each_kind == Storage.KEY_PROCESSESES:
+						value = Storage.encode_state(value)
+					buffer.append(value, each_val[Storage.KEY_TS])
+		Storage.dirty = True
+
+	@staticmethod
+	def series(kind, telemetry_type, create=False):
+		"""Get the buffer holding a metric's samples
+
+		Args:
+			kind (str): `KEY_TELEMETRY` or `KEY_PROCESSESES`
+			telemetry_type (str): The metric / process name
+			create (bool, optional): Create an empty buffer if missing.
+			Defaults to False.
+
+		Returns:
+			(RingBuffer|None): The buffer, None if missing and not created
+		"""
+		if Storage.ring is None:
+			Storage.refresh()
+		if kind not in Storage.live:
+			if not create:
+				return None
+			Storage.live[kind] = {}
+		if telemetry_type not in Storage.live[kind]:
+			if not create:
+				return None
+			Storage.live[kind][telemetry_type] = Storage.ring.get(kind, telemetry_type, create=True)
+			Storage.bind_rollups(kind, telemetry_type, Storage.live[kind][telemetry_type])
+		return Storage.live[kind][telemetry_type]
+
+	@staticmethod
+	def tier_path(width):
+		"""Ring file of a rollup tier, eg. `monitoring_telemetry.300s.bin`"""
+		base_path, extension = os.path.splitext(ConfigLoader.Telemetry["base_path"])
+		return base_path + "." + str(width) + "s" + extension
+
+	@staticmethod
+	def anomaly_path():
+		"""Ring file of the anomaly statistics, `monitoring_telemetry.anomaly.bin`"""
+		base_path, extension = os.path.splitext(ConfigLoader.Telemetry["base_path"])
+		return base_path + ".anomaly" + extension
+
+	@staticmethod
+	def sketch_path():
+		"""Ring file of the quantile sketches, `monitoring_telemetry.sketch.bin`"""
+		base_path, extension = os.path.splitext(ConfigLoader.Telemetry["base_path"])
+		return base_path + ".sketch" + extension
+
+	@staticmethod
+	def derivative_path():
+		"""Ring file of the running sums, `monitoring_telemetry.derivative.bin`"""
+		base_path, extension = os.path.splitext(ConfigLoader.Telemetry["base_path"])
+		return base_path + ".derivative" + extension
+
+	@staticmethod
+	def bind_rollups(kind, telemetry_type, buffer):
+		"""Attach the rollup tiers of a metric (and for telemetry, its
+		anomaly statistics and those of `bind_kept`) to its raw buffer. A
+		tier new to a metric which already has samples is seeded from them."""
+		if kind not in Storage.ROLLED_UP:
+			return
+		buffer.rollups = []
+		for _, tier in Storage.tiers:
+			rollup = tier.get(kind, telemetry_type, create=True)
+			if len(rollup) == 0:
+				for ts, value in buffer:
+					rollup.append(value, ts)
+			buffer.rollups.append(rollup)
+		if kind == Storage.KEY_TELEMETRY and Storage.anomalies is not None:
+			buffer.anomaly = Storage.anomalies.get(kind, telemetry_type, create=True)
+			if len(buffer.anomaly) == 0:
+				for ts, value in buffer:
+					buffer.anomaly.append(value, ts)
+		if kind == Storage.KEY_TELEMETRY:
+			Storage.bind_kept(telemetry_type, buffer)
+
+	@staticmethod
+	def bind_kept(telemetry_type, buffer):
+		"""Attach the quantile sketch and the running sums of a metric to
+		its raw buffer if it is `kept` for them, else detach them. New ones
+		are seeded from the raw samples."""
+		for attribute, ring in [(Storage.SKETCH, Storage.sketches), (Storage.DERIVATIVE, Storage.derivatives)]:
+			if ring is None or telemetry_type not in Storage.kept.get(attribute, ()):
+				setattr(buffer, attribute, None)
+				continue
+			if getattr(buffer, attribute) is None:
+				derived = ring.get(Storage.KEY_TELEMETRY, telemetry_type, create=True)
+				if len(derived) == 0:
+					for ts, value in buffer:
+						derived.append(value, ts)
+				setattr(buffer, attribute, derived)
+
+	@staticmethod
+	def keep(attribute, names):
+		"""Keep quantile sketches (`SKETCH`) or running sums (`DERIVATIVE`)
+		of these telemetry metrics from now on. Each costs some microseconds
+		per sample and its own slot on disk, so only the metrics a threshold
+		needs them for get one.
+
+		Args:
+			attribute (str): `SKETCH` or `DERIVATIVE`
+			names (iterable): Telemetry names
+		"""
+		Storage.kept[attribute] = set(names)
+		for telemetry_type, buffer in Storage.live.get(Storage.KEY_TELEMETRY, {}).items():
+			Storage.bind_kept(telemetry_type, buffer)
+
 	@staticmethod
+	def drain_touched():
+		"""Hand over the series which received samples since the last
+		call, in the order they were first touched.
+
+		Returns:
+			list: (kind, name) keys
+		"""
+		touched = list(Storage.touched.keys())
+		Storage.touched = {}
+		return touched
+
+	@staticmethod
+	@Instrument.timed("refresh")
 	def refresh():
-		"""Refresh the storage contents back from the disk to memory"""
+		"""Refresh the storage contents back from the disk to memory. Only
+		the slot headers of the ring file are read, samples stay mapped."""
 		# Create database if not exists
 		if  not os.path.exists(ConfigLoader.Telemetry["base_dir"]):
 			os.mkdir(ConfigLoader.Telemetry["base_dir"])
@@ -48,84 +247,174 @@ class Storage:
 			os.remove(ConfigLoader.Telemetry["base_dir"])
 			os.mkdir(ConfigLoader.Telemetry["base_dir"])
 
-		if  not os.path.exists(ConfigLoader.Telemetry["base_path"]) or \
-			not os.path.isfile(ConfigLoader.Telemetry["base_path"]):
-			with open(ConfigLoader.Telemetry["base_path"], "w+") as storage_file:
-				storage_file.write("{}")
-		
-		# Read database and retain instance
-		Storage.live = ConfigLoader.load_telemetry()
+		Storage.close()
+		fresh = not os.path.isfile(ConfigLoader.Telemetry["base_path"])
+
+		# Map database and retain instance
+		Storage.ring = RingFile.open(ConfigLoader.Telemetry["base_path"], Storage.CONST_VALUE_MAXVALUES)
+		Storage.tiers = [
+			(width, RingFile.open(
+				Storage.tier_path(width), buckets, columns=RollupBuffer.COLUMNS,
+				factory=lambda ring, index, width=width: RollupBuffer(ring, index, width)
+			))
+			for width, buckets in ConfigLoader.Telemetry["tiers"]
+		]
+		Storage.anomalies = RingFile.open(
+			Storage.anomaly_path(), Storage.CONST_VALUE_MAXVALUES, columns=AnomalyBuffer.COLUMNS,
+			factory=lambda ring, index: AnomalyBuffer(
+				ring, index, ConfigLoader.Telemetry["anomaly_alpha"], ConfigLoader.Telemetry["anomaly_warmup"]
+			)
+		)
+		width, buckets = ConfigLoader.Telemetry["sketch"]
+		Storage.sketches = RingFile.open(
+			Storage.sketch_path(), buckets,
+			columns=SketchBuffer.columns_for(ConfigLoader.Telemetry["sketch_centroids"]),
+			factory=lambda ring, index: SketchBuffer(ring, index, width)
+		)
+		Storage.derivatives = RingFile.open(
+			Storage.derivative_path(), ConfigLoader.Telemetry["derivative_history"],
+			columns=DerivativeBuffer.COLUMNS, factory=DerivativeBuffer
+		)
+		Storage.live = {}
+		for kind, telemetry_type, buffer in Storage.ring.entries():
+			Storage.live.setdefault(kind, {})[telemetry_type] = buffer
+			Storage.bind_rollups(kind, telemetry_type, buffer)
+		Storage.dirty = False
+
+		if fresh and os.path.isfile(ConfigLoader.Telemetry["legacy_path"]):
+			Storage.migrate_legacy()
 
 	@staticmethod
+	def close():
+		"""Unmap every ring file, flushing them"""
+		if Storage.ring is not None:
+			Storage.live = {}
+			Storage.ring.close()
+			Storage.ring = None
+		for _, tier in Storage.tiers:
+			tier.close()
+		Storage.tiers = []
+		if Storage.anomalies is not None:
+			Storage.anomalies.close()
+			Storage.anomalies = None
+		if Storage.sketches is not None:
+			Storage.sketches.close()
+			Storage.sketches = None
+		if Storage.derivatives is not None:
+			Storage.derivatives.close()
+			Storage.derivatives = None
+
+	@staticmethod
+	@Instrument.timed("flush")
 	def flush():
-		"""Flush the in-memory storage contents back to disk - full overwrite"""
-		with open(ConfigLoader.Telemetry["base_path"], "w+") as storage_file:
-			storage_file.write(json.dumps(Storage.live))
-		Storage.live = ConfigLoader.load_telemetry()
+		"""Flush the in-memory storage contents back to disk. Samples are
+		already written in place into the mapping, so this only syncs the
+		dirty pages - a power cut can lose recent samples but never leaves
+		a half written document behind.
+		"""
+		if Storage.ring is not None:
+			Storage.ring.flush()
+		for _, tier in Storage.tiers:
+			tier.flush()
+		if Storage.anomalies is not None:
+			Storage.anomalies.flush()
+		if Storage.sketches is not None:
+			Storage.sketches.flush()
+		if Storage.derivatives is not None:
+			Storage.derivatives.flush()
+		Storage.dirty = False
+
+	@staticmethod
+	def commit():
+		"""Flush to disk only if something changed since the last flush"""
+		if Storage.dirty:
+			Storage.flush()
+
+	@staticmethod
+	@contextmanager
+	def session():
+		"""Batch every telemetry write made inside the block into a single
+		flush when the outermost session closes. Nothing is written if
+		`autoflush` is off, the owner is then expected to `commit` itself.
+
+		Usage:
+			with Storage.session():
+				Storage.add_telemetry("cpu", 12.5)
+				Storage.add_telemetry("mem", 40.1)
+		"""
+		Storage.depth += 1
+		try:
+			yield
+		finally:
+			Storage.depth -= 1
+		if Storage.depth == 0 and Storage.autoflush:
+			Storage.commit()
+
+	@staticmethod
+	def changed():
+		"""Mark the in-memory storage as changed. Flushes right away when
+		called outside of a session with `autoflush` on."""
+		Storage.dirty = True
+		if Storage.depth == 0 and Storage.autoflush:
+			Storage.flush()
 	
 	@staticmethod
-	def add_telemetry(telemetry_type, value):
-		"""Add a telemetry metric to the storage. Additionally maintain moving
-		average, timestamps and last N values with overflow purging"""
-		if Storage.live is None or len(Storage.live.keys()) == 0:
+	def load_counters(family):
+		"""Read back the counters a collector saved on an earlier run
+
+		Args:
+			family (str): The collector's metric family, its counters are
+			named `<family>.<...>`
+
+		Returns:
+			dict: counter -> (epoch time it was read, value)
+		"""
+		if Storage.ring is None:
 			Storage.refresh()
-		if Storage.KEY_TELEMETRY not in Storage.live:
-			Storage.live[Storage.KEY_TELEMETRY] = {}
-		if telemetry_type not in Storage.live[Storage.KEY_TELEMETRY]:
-			Storage.live[Storage.KEY_TELEMETRY][telemetry_type] = {
-				Storage.KEY_VALUES: [],
-				Storage.KEY_MOVING_AVG: 0.0,
-				Storage.KEY_LAST_UPD: 0
-			}
-
-		# Add the value with ts to the buffer
-		Storage.live[Storage.KEY_TELEMETRY][telemetry_type][Storage.KEY_VALUES].append({
-			Storage.KEY_VALUE: value,
-			Storage.KEY_TS: int(time.time())
-		})
-
-		# Prune if overflow
-		while len(Storage.live[Storage.KEY_TELEMETRY][telemetry_type][Storage.KEY_VALUES]) > Storage.CONST_VALUE_MAXVALUES:
-			Storage.live[Storage.KEY_TELEMETRY][telemetry_type][Storage.KEY_VALUES].pop(0)
-
-		# Re-calc moving avg
-		_avg = 0.0
-		for each_val in Storage.live[Storage.KEY_TELEMETRY][telemetry_type][Storage.KEY_VALUES]:
-			_avg += (1.0* each_val[Storage.KEY_VALUE])
-		Storage.live[Storage.KEY_TELEMETRY][telemetry_type][Storage.KEY_MOVING_AVG] = _avg / len(Storage.live[Storage.KEY_TELEMETRY][telemetry_type][Storage.KEY_VALUES])
-
-		# Last TS update
-		Storage.live[Storage.KEY_TELEMETRY][telemetry_type][Storage.KEY_LAST_UPD] = int(time.time())
+		counters = {}
+		for name, buffer in (Storage.live.get(Storage.KEY_COUNTERS) or {}).items():
+			if name.startswith(family + ".") and len(buffer) > 0:
+				counters[name] = (float(buffer.last_ts()), buffer.last())
+		return counters
+
+	@staticmethod
+	def save_counters(counters):
+		"""Keep the latest reading of collector counters. Only the last
+		sample of a counter is ever read back.
+
+		Args:
+			counters (dict): counter -> (epoch time it was read, value)
+		"""
+		appended = False
+		for name, (stamp, value) in counters.items():
+			buffer = Storage.series(Storage.KEY_COUNTERS, name, create=True)
+			if len(buffer) > 0 and buffer.last_ts() == int(stamp) and buffer.last() == value:
+				continue
+			buffer.append(value, int(stamp))
+			appended = True
+		if appended:
+			Storage.changed()
+
+	@staticmethod
+	def add_telemetry(telemetry_type, value):
+		"""Add a telemetry metric to the storage. The buffer keeps the last
+		N values with timestamps and a running moving average"""
+		Storage.series(Storage.KEY_TELEMETRY, telemetry_type, create=True).append(
+			value, int(time.time())
+		)
+		Storage.touched[(Storage.KEY_TELEMETRY, telemetry_type)] = True
 
 		# Sync
-		Storage.flush()
+		Storage.changed()
 
 	@staticmethod
 	def add_process_telemetry(telemetry_type, value):
-		"""Add a process telemetry metric to the storage. Additionally maintain
-		timestamps with overflow purging"""
-		if Storage.live is None or len(Storage.live.keys()) == 0:
-			Storage.refresh()
-		if Storage.KEY_PROCESSESES not in Storage.live:
-			Storage.live[Storage.KEY_PROCESSESES] = {}
-		if telemetry_type not in Storage.live[Storage.KEY_PROCESSESES]:
-			Storage.live[Storage.KEY_PROCESSESES][telemetry_type] = {
-				Storage.KEY_VALUES: [],
-				Storage.KEY_LAST_UPD: 0
-			}
-
-		# Add the value with ts to the buffer
-		Storage.live[Storage.KEY_PROCESSESES][telemetry_type][Storage.KEY_VALUES].append({
-			Storage.KEY_VALUE: value,
-			Storage.KEY_TS: int(time.time())
-		})
-
-		# Prune if overflow
-		while len(Storage.live[Storage.KEY_PROCESSESES][telemetry_type][Storage.KEY_VALUES]) > Storage.CONST_VALUE_MAXVALUES:
-			Storage.live[Storage.KEY_PROCESSESES][telemetry_type][Storage.KEY_VALUES].pop(0)
-
-		# Last TS update
-		Storage.live[Storage.KEY_PROCESSESES][telemetry_type][Storage.KEY_LAST_UPD] = int(time.time())
+		"""Add a process telemetry metric (its state) to the storage.
+		The buffer keeps the last N states with timestamps"""
+		Storage.series(Storage.KEY_PROCESSESES, telemetry_type, create=True).append(
+			Storage.encode_state(value), int(time.time())
+		)
+		Storage.touched[(Storage.KEY_PROCESSESES, telemetry_type)] = True
 
 		# Sync
-		Storage.flush()
+		Storage.changed()
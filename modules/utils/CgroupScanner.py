@@ -0,0 +1,101 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import os
+
+class CgroupScanner:
+	"""Reads the state and resource usage of a systemd unit straight from
+	its cgroup (v2) at `<ROOT>/<slice>/<unit>`: a handful of small file
+	reads per unit, no matter how many processes run on the host. A unit
+	which isn't running has no cgroup. Point `ROOT` at a fake tree of the
+	same layout to try it out without systemd.
+	"""
+
+	ROOT = "/sys/fs/cgroup"
+	SLICE = "system.slice"
+
+	@staticmethod
+	def available():
+		"""Whether the unified (v2) cgroup hierarchy is mounted"""
+		return os.path.isfile(CgroupScanner.ROOT + "/cgroup.controllers")
+
+	@staticmethod
+	def path(unit, cgroup_slice=None):
+		return CgroupScanner.ROOT + "/" + (cgroup_slice or CgroupScanner.SLICE) + "/" + unit
+
+	@staticmethod
+	def keyed(path):
+		"""Parse a flat keyed file (eg. `cpu.stat`) into key -> int"""
+		values = {}
+		with open(path, "r") as keyed_file:
+			for each_line in keyed_file:
+				parts = each_line.split()
+				if len(parts) == 2 and parts[1].lstrip("-").isdigit():
+					values[parts[0]] = int(parts[1])
+		return values
+
+	@staticmethod
+	def read(unit, cgroup_slice=None):
+		"""Read a unit's cgroup. Files of controllers not enabled for it
+		are left out.
+
+		Args:
+			unit (str): The unit, eg. `nginx.service`
+			cgroup_slice (str, optional): Its slice. Defaults to `SLICE`.
+
+		Returns:
+			(dict|None): None if the unit has no cgroup, else "populated"
+			(whether any process runs in it or below), "pids" (of the
+			processes directly in it), "usage_usec", "memory" (bytes),
+			"rbytes" and "wbytes" (summed over the devices)
+		"""
+		path = CgroupScanner.path(unit, cgroup_slice)
+		try:
+			with open(path + "/cgroup.procs", "r") as procs_file:
+				pids = [int(each) for each in procs_file.read().split()]
+		except (FileNotFoundError, NotADirectoryError):
+			return None
+
+		reading = {"pids": pids, "populated": len(pids) > 0}
+		try:
+			reading["populated"] = CgroupScanner.keyed(path + "/cgroup.events").get("populated", 0) == 1
+		except OSError:
+			pass
+		try:
+			reading["usage_usec"] = CgroupScanner.keyed(path + "/cpu.stat")["usage_usec"]
+		except (OSError, KeyError):
+			pass
+		try:
+			with open(path + "/memory.current", "r") as memory_file:
+				reading["memory"] = int(memory_file.read().strip())
+		except (OSError, ValueError):
+			pass
+		try:
+			rbytes, wbytes = 0, 0
+			with open(path + "/io.stat", "r") as io_file:
+				# eg. `179:0 rbytes=1024 wbytes=4096 rios=1 wios=2 dbytes=0 dios=0`
+				for each_line in io_file:
+					for each_field in each_line.split()[1:]:
+						key, _, value = each_field.partition("=")
+						if key == "rbytes":
+							rbytes += int(value)
+						elif key == "wbytes":
+							wbytes += int(value)
+			reading["rbytes"], reading["wbytes"] = rbytes, wbytes
+		except (OSError, ValueError):
+			pass
+		return reading
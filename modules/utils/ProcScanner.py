@@ -0,0 +1,136 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import os
+
+class ProcScanner:
+	"""Lists running processes straight from `/proc` instead of forking
+	`ps aux`. Only the pid, start time and command line are read. Command
+	lines are cached by (pid, start time) so a sweep only reads the
+	`cmdline` of processes it has not seen before. Raspimon itself is
+	left out of the sweep. The resource usage of a single process can be
+	read too, see `usage`.
+	"""
+
+	PROC = "/proc"
+
+	# pid -> (start time, command)
+	cache = {}
+
+	@staticmethod
+	def available():
+		"""Whether a Linux style /proc is mounted on this host"""
+		return os.path.isdir(ProcScanner.PROC + "/self")
+
+	@staticmethod
+	def fields(pid):
+		"""Read `/proc/<pid>/stat`
+
+		Returns:
+			(str, list): Command name and the fields after it, the first
+			being the state (field 3 of proc(5))
+		"""
+		with open(ProcScanner.PROC + "/" + str(pid) + "/stat", "rb") as stat_file:
+			stat = stat_file.read()
+		# The command name is parenthesized and may itself contain spaces
+		name_end = stat.rindex(b")")
+		name = stat[stat.index(b"(") + 1:name_end].decode("utf-8", "replace")
+		return name, stat[name_end + 2:].split()
+
+	@staticmethod
+	def stat(pid):
+		"""Read the command name and start time (in clock ticks since boot)
+		of a process from `/proc/<pid>/stat`
+
+		Args:
+			pid (int): The process id
+
+		Returns:
+			(str, int): Command name and start time
+		"""
+		name, fields = ProcScanner.fields(pid)
+		return name, int(fields[19])
+
+	@staticmethod
+	def usage(pid):
+		"""Read the resource usage of a process
+
+		Args:
+			pid (int): The process id
+
+		Returns:
+			(int, int, int, int, int|None): Start time and CPU time (user
+			and system) in clock ticks, threads, resident pages and open file
+			descriptors (None if the fd directory isn't readable)
+
+		Raises:
+			OSError: If the process is gone
+		"""
+		_, fields = ProcScanner.fields(pid)
+		try:
+			fds = len(os.listdir(ProcScanner.PROC + "/" + str(pid) + "/fd"))
+		except PermissionError:
+			fds = None
+		return int(fields[19]), int(fields[11]) + int(fields[12]), int(fields[17]), int(fields[21]), fds
+
+	@staticmethod
+	def cmdline(pid, name):
+		"""Read the full command line of a process. Kernel threads have
+		none and are reported as `[name]` the way `ps` does.
+		"""
+		with open(ProcScanner.PROC + "/" + str(pid) + "/cmdline", "rb") as cmdline_file:
+			cmdline = cmdline_file.read()
+		cmdline = cmdline.replace(b"\0", b" ").strip().decode("utf-8", "replace")
+		return cmdline if len(cmdline) > 0 else "[" + name + "]"
+
+	@staticmethod
+	def scan():
+		"""Sweep `/proc` for the running processes
+
+		Returns:
+			list: A list of {"pid", "start", "command"} dicts
+		"""
+		seen = {}
+		processes = []
+		own_pid = os.getpid()
+		for entry in os.listdir(ProcScanner.PROC):
+			if not entry.isdigit():
+				continue
+			pid = int(entry)
+			# Our own command line should never count as a watched service
+			if pid == own_pid:
+				continue
+			try:
+				name, start = ProcScanner.stat(pid)
+				cached = ProcScanner.cache.get(pid)
+				if cached is not None and cached[0] == start:
+					command = cached[1]
+				else:
+					command = ProcScanner.cmdline(pid, name)
+			except (OSError, ValueError, IndexError):
+				# Exited mid-sweep or not readable
+				continue
+			seen[pid] = (start, command)
+			processes.append({
+				"pid": pid,
+				"start": start,
+				"command": command
+			})
+
+		# Forget processes which are gone
+		ProcScanner.cache = seen
+		return processes
@@ -0,0 +1,123 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import os
+import re
+
+class ProcessMatcher:
+	"""Matches command lines against every watched process at once.
+	Patterns are compiled a single time per mode:
+
+	- `substring` (default): pattern appears anywhere in the command line
+	- `prefix`: command line starts with the pattern
+	- `exact`: command line equals the pattern
+	- `basename`: executable name (basename of argv[0]) equals the pattern
+	- `regex`: pattern is a regular expression searched in the command line
+
+	Substring and prefix patterns are folded into one alternation regex
+	each, so a command line is scanned once no matter how many processes
+	are watched.
+	"""
+
+	SUBSTRING = "substring"
+	PREFIX = "prefix"
+	EXACT = "exact"
+	BASENAME = "basename"
+	REGEX = "regex"
+
+	MODES = [SUBSTRING, PREFIX, EXACT, BASENAME, REGEX]
+
+	def __init__(self, patterns):
+		"""
+		Args:
+			patterns (dict): pattern -> match mode. Unknown modes fall back
+			to `substring`.
+		"""
+		by_mode = {}
+		for each_pattern in patterns.keys():
+			mode = patterns[each_pattern] if patterns[each_pattern] in ProcessMatcher.MODES else ProcessMatcher.SUBSTRING
+			by_mode.setdefault(mode, []).append(each_pattern)
+
+		self.substring, self.substring_implied = ProcessMatcher.alternation(
+			by_mode.get(ProcessMatcher.SUBSTRING, []), anchored=False
+		)
+		self.prefix, self.prefix_implied = ProcessMatcher.alternation(
+			by_mode.get(ProcessMatcher.PREFIX, []), anchored=True
+		)
+		self.exact = set(by_mode.get(ProcessMatcher.EXACT, []))
+		self.basename = set(by_mode.get(ProcessMatcher.BASENAME, []))
+		self.regex = [(p, re.compile(p)) for p in by_mode.get(ProcessMatcher.REGEX, [])]
+
+	@staticmethod
+	def alternation(patterns, anchored):
+		"""Fold literal patterns into one regex. The longest pattern wins at
+		a given position, so every pattern also records which shorter
+		patterns it implies (contains / starts with).
+
+		Returns:
+			(regex|None, dict): Compiled matcher and pattern -> implied patterns
+		"""
+		if len(patterns) == 0:
+			return None, {}
+		ordered = sorted(set(patterns), key=len, reverse=True)
+		body = "|".join(re.escape(p) for p in ordered)
+		matcher = re.compile("^(" + body + ")" if anchored else "(?=(" + body + "))")
+
+		implied = {}
+		for each_pattern in ordered:
+			implied[each_pattern] = [
+				p for p in ordered
+				if p != each_pattern and (each_pattern.startswith(p) if anchored else p in each_pattern)
+			]
+		return matcher, implied
+
+	@staticmethod
+	def executable(command):
+		"""Basename of the executable of a command line"""
+		if command.startswith("["):
+			return command.strip("[]")
+		return os.path.basename(command.split(" ", 1)[0])
+
+	def match(self, command):
+		"""Find every pattern matching a command line
+
+		Args:
+			command (str): The full command line of a process
+
+		Returns:
+			set: The matching patterns
+		"""
+		found = set()
+		if self.substring is not None:
+			for each_match in self.substring.finditer(command):
+				found.add(each_match.group(1))
+				found.update(self.substring_implied[each_match.group(1)])
+		if self.prefix is not None:
+			each_match = self.prefix.match(command)
+			if each_match is not None:
+				found.add(each_match.group(1))
+				found.update(self.prefix_implied[each_match.group(1)])
+		if command in self.exact:
+			found.add(command)
+		if len(self.basename) > 0:
+			executable = ProcessMatcher.executable(command)
+			if executable in self.basename:
+				found.add(executable)
+		for each_pattern, each_regex in self.regex:
+			if each_regex.search(command) is not None:
+				found.add(each_pattern)
+		return found
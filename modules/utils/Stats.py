@@ -15,35 +15,24 @@ limitations under the License.
 
 """
 
+from modules.utils.ProcessMatcher import ProcessMatcher
+from modules.metrics.Collectors import Collectors
+from modules.metrics.ProcessTracker import ProcessTracker
+from modules.metrics.UnitTracker import UnitTracker
+from modules.utils.CgroupScanner import CgroupScanner
+from modules.utils.ProcScanner import ProcScanner
 from modules.utils.Exec import Exec
-import psutil
 import platform
 
 class HostStats:
 	"""Utility class to get collect host stat metrics
 	"""
 
-	@staticmethod
-	def cpu():
-		return psutil.cpu_percent()
-	
-	@staticmethod
-	def mem():
-		return psutil.virtual_memory().percent
-
-	@staticmethod
-	def __get_map():
-		return {
-			"cpu": HostStats.cpu,
-			"mem": HostStats.mem
-		}
-
 	@staticmethod
 	def get(metrics):
-		"""Return host stats and metrics. Can be extended
-		to return extra and more complicated information which
-		can be tuned with your alarm configuration to generate
-		crisp alerts.
+		"""Return host stats and metrics. Metrics are read by the
+		collector plugins registered with `Collectors`, concurrently
+		and each within its own timeout.
 
 		Args:
 			metrics (list): A list of metrics to fetch. Unsupported metrics will 
@@ -53,13 +42,7 @@ class HostStats:
 			dict: A KV pair dict containing the supported metrics as configured.
 		"""        
 
-		supported_map = HostStats.__get_map()
-		stats = {}
-		for each_metric in metrics:
-			if each_metric in supported_map:
-				stats[each_metric] = supported_map[each_metric]()
-		
-		return stats
+		return Collectors.collect(metrics)
 	
 	@staticmethod
 	def supported(code):
@@ -71,7 +54,7 @@ class HostStats:
 		Returns:
 			bool: True if supported | False otherwise
 		"""
-		return str(code) in HostStats.__get_map()
+		return Collectors.find(str(code)) is not None
 	
 	@staticmethod
 	def platform():
@@ -86,58 +69,157 @@ class ServiceStats:
 	"""Utility class to get collect service stat metrics
 	"""
 
+	# (patterns, ProcessMatcher) of the last lookup
+	compiled = None
+
 	@staticmethod
 	def psaux():
+		"""Fallback process listing for hosts without a /proc, parses
+		the output of `ps aux`
+
+		Returns:
+			list: A list of process description dicts
+		"""
 		process_desc = []
 		running_processes_str, _, __ = Exec.shell("ps aux", True)
-		running_processes = str(running_processes_str).split("\n")
-		# Filter empty lines
-		running_processes = list(filter(None, running_processes))
+		running_processes = running_processes_str.decode("utf-8", "replace").split("\n")
+		# Filter empty lines and the header
+		running_processes = list(filter(None, running_processes))[1:]
 		# For every process, trim extra spaces in between
 		for i in range(0, len(running_processes)):
 			rpi = list(filter(None, running_processes[i].split(" ")))
+			if len(rpi) < 11:
+				continue
 			owner = rpi[0]
 			pid = rpi[1]
 			cpu = rpi[2]
 			mem = rpi[3]
+			rss = rpi[5]
 			uptime = rpi[9]
 			command = " ".join(rpi[10:])
-			base_command = rpi[10]
 			process_desc.append({
 				"command": command,
 				"owner": owner,
 				"pid": pid,
 				"cpu": cpu,
 				"mem": mem,
+				"rss": rss,
 				"uptime": uptime
 			})
 		return process_desc
 
 	@staticmethod
-	def process_get(processes):
+	def matcher(processes, modes=None):
+		"""Compiled matcher for a set of watched processes. The last one
+		is kept around so that the daemon compiles it only once.
+
+		Args:
+			processes (list): Service process names
+			modes (dict, optional): process name -> match mode. Defaults to
+			substring matching for all.
+
+		Returns:
+			ProcessMatcher: The matcher
+		"""
+		modes = modes or {}
+		patterns = {}
+		for each_process in processes:
+			patterns[each_process] = modes.get(each_process, ProcessMatcher.SUBSTRING)
+		if ServiceStats.compiled is None or ServiceStats.compiled[0] != patterns:
+			ServiceStats.compiled = (patterns, ProcessMatcher(patterns))
+		return ServiceStats.compiled[1]
+
+	@staticmethod
+	def process_get(processes, modes=None, usage=None):
 		"""Return host stats and metrics. Can be extended
 		to return extra and more complicated information which
 		can be tuned with your alarm configuration to generate
 		crisp alerts.
 
 		Args:
-			processes (list): Service process names to be `ps aux`-ed
+			processes (list): Service process names to be looked up
+			modes (dict, optional): process name -> match mode, see
+			`ProcessMatcher`. Defaults to substring matching.
+			usage (dict, optional): Filled with the `process.*` resource
+			usage metrics of the running ones, see `ProcessTracker`. Without
+			a /proc only `cpu` (as `ps` reports it, averaged over the
+			process' lifetime), `rss_kb` and `instances` are known.
 
 		Returns:
 			dict: A KV pair dict containing the supported metrics
 			as configured by you.
-		"""        
+		"""
+
+		matcher = ServiceStats.matcher(processes, modes)
+		if ProcScanner.available():
+			readings = ProcessTracker.instances(processes, matcher, modes)
+			if usage is not None:
+				usage.update(ProcessTracker.usage(readings))
+			return {each_process: "up" if len(readings[each_process]) > 0 else "down" for each_process in processes}
 
-		running_processes = ServiceStats.psaux()
 		stats = {}
 		for each_process in processes:
 			stats[each_process] = "down"
-			for each_running_process in running_processes:
-				if each_process in each_running_process["command"]:
+
+		remaining = len(stats)
+		for each_running_process in ServiceStats.psaux():
+			for each_process in matcher.match(each_running_process["command"]):
+				if stats[each_process] == "down":
 					stats[each_process] = "up"
-					break
+					remaining -= 1
+				if usage is not None:
+					for stat, value in [
+						(ProcessTracker.CPU, float(each_running_process["cpu"])),
+						(ProcessTracker.RSS, float(each_running_process["rss"])),
+						(ProcessTracker.INSTANCES, 1.0)
+					]:
+						metric = ProcessTracker.metric(each_process, stat)
+						usage[metric] = usage.get(metric, 0.0) + value
+			# Every instance counts towards the usage
+			if remaining == 0 and usage is None:
+				break
 		return stats
-	
+
+	@staticmethod
+	def unit_get(units, slices=None, fallbacks=None, usage=None):
+		"""Return the state of systemd units, read from their cgroups: a
+		unit is up while any process runs in its cgroup. Without cgroup v2
+		each unit is looked up by a process instead.
+
+		Args:
+			units (list): Unit names, eg. `nginx.service`
+			slices (dict, optional): unit -> slice, see `CgroupScanner`
+			fallbacks (dict, optional): unit -> (process, match mode) to
+			look up without cgroups. Defaults to the unit name without its
+			suffix, matched by basename.
+			usage (dict, optional): Filled with the `unit.*` resource usage
+			metrics of the running ones, see `UnitTracker`
+
+		Returns:
+			dict: unit -> "up" | "down"
+		"""
+
+		if CgroupScanner.available():
+			readings = UnitTracker.read(units, slices)
+			if usage is not None:
+				usage.update(UnitTracker.usage(readings))
+			return {
+				each_unit: "up" if readings[each_unit] is not None and readings[each_unit]["populated"] else "down"
+				for each_unit in units
+			}
+
+		fallbacks = fallbacks or {}
+		processes, modes = {}, {}
+		for each_unit in units:
+			process, mode = fallbacks.get(each_unit) or (None, None)
+			processes[each_unit] = process or UnitTracker.stem(each_unit)
+			modes[processes[each_unit]] = mode or ProcessMatcher.BASENAME
+		process_usage = {} if usage is not None else None
+		states = ServiceStats.process_get(list(modes.keys()), modes, usage=process_usage)
+		if usage is not None:
+			usage.update(UnitTracker.from_processes(process_usage, processes))
+		return {each_unit: states[processes[each_unit]] for each_unit in units}
+
 	@staticmethod
 	def supported(code):
 		"""Whether a stat code is supported by this module
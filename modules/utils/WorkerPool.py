@@ -0,0 +1,74 @@
+"""
+jaiwardhan/Raspimon
+
+@author: Jaiwardhan Swarnakar, 2021
+Copyright 2021-present
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import threading
+import queue
+
+class Job:
+	"""A submitted call and, once done, its result or error"""
+
+	def __init__(self, func, args):
+		self.func = func
+		self.args = args
+		self.result = None
+		self.error = None
+		self.done = threading.Event()
+
+	def run(self):
+		try:
+			self.result = self.func(*self.args)
+		except Exception as job_error:
+			self.error = job_error
+		finally:
+			self.done.set()
+
+	def wait(self, timeout=None):
+		"""Wait for the job to finish
+
+		Returns:
+			bool: True if it finished in time
+		"""
+		return self.done.wait(timeout)
+
+class WorkerPool:
+	"""A small pool of daemon threads. Unlike `ThreadPoolExecutor`, a job
+	which never returns (eg. stuck on a hung NFS mount) does not hold up
+	the interpreter on exit; the caller just stops waiting for it.
+	"""
+
+	def __init__(self, size):
+		self.size = size
+		self.jobs = queue.Queue()
+		self.workers = []
+
+	def submit(self, func, *args):
+		"""Queue a call, starting a worker if the pool isn't full yet
+
+		Returns:
+			Job: The queued job
+		"""
+		job = Job(func, args)
+		if len(self.workers) < self.size:
+			worker = threading.Thread(target=self.work, name="pool-" + str(len(self.workers)), daemon=True)
+			self.workers.append(worker)
+			worker.start()
+		self.jobs.put(job)
+		return job
+
+	def work(self):
+		while True:
+			self.jobs.get().run()
@@ -26,22 +26,92 @@ limitations under the License.
 
 """
 
-from modules.comms.TelegramRelay import PiMonBot
+from modules.metrics.Instrument import Instrument
+from modules.comms.Outbox import Outbox
 from modules.logger.Logger import Logger
 from modules.alarms.Alarms import Alarms
-from modules.storage.Storage import Storage
+import argparse
 
 # ------------------------------------------------ MAIN exec --
 if __name__ == "__main__":
-	Logger.execution_log()
-	Storage.refresh()
-	Alarms.init()
-
-	alarms = Alarms.check()
-	# print(PiAlarms.summarize( alarms=alarms ))
-	if alarms is not None and len(alarms) > 0:
-		PiMonBot.send(msg=Alarms.summarize( 
-			alarms=alarms
-		))
-
-	Logger.execution_log(False)
+	parser = argparse.ArgumentParser(prog="raspimon")
+	parser.add_argument("--daemon", action="store_true",
+		help="stay resident and sample metrics on their own intervals")
+	parser.add_argument("--outbox", action="store_true",
+		help="deliver the queued notifications which are due and exit")
+	parser.add_argument("--push", action="store_true",
+		help="push the spooled samples to the collector and exit")
+	parser.add_argument("--collector", action="store_true",
+		help="stay resident and ingest the samples pushed by agents")
+	parser.add_argument("--listen", metavar="HOST:PORT",
+		help="collector listen address, defaults to 0.0.0.0:9321")
+	parser.add_argument("--exporter", metavar="HOST:PORT",
+		help="with --daemon, serve OpenMetrics for Prometheus at HOST:PORT/metrics")
+	commands = parser.add_subparsers(dest="command")
+	query = commands.add_parser("query", help="read the stored history of a metric")
+	query.add_argument("metric", help="metric or process name, eg. cpu")
+	query.add_argument("--processes", action="store_true",
+		help="query a process state (1 up, 0 down) instead of a host metric")
+	query.add_argument("--from", dest="start", default="1h", metavar="TIME",
+		help="range start: epoch, ISO 8601 or a duration ago like 90m, 2h, 7d (default 1h)")
+	query.add_argument("--to", dest="end", default="now", metavar="TIME",
+		help="range end, same formats (default now)")
+	query.add_argument("--agg", metavar="FUNCS",
+		help="comma separated aggregates: avg,min,max,sum,count,last,p50,p95,...")
+	query.add_argument("--resolution", metavar="RES",
+		help="raw or a rollup bucket width in seconds (default: finest covering the range)")
+	query.add_argument("--host", help="agent host, when run on a collector")
+	query.add_argument("--json", action="store_true", help="print JSON")
+	args = parser.parse_args()
+
+	if args.command == "query":
+		from modules.query.Query import Query
+		import json
+		import time
+		try:
+			now = int(time.time())
+			result = Query.run(
+				args.metric,
+				kind="processes" if args.processes else "telemetry",
+				start=Query.parse_time(args.start, now),
+				end=Query.parse_time(args.end, now),
+				functions=args.agg.split(",") if args.agg else None,
+				resolution=args.resolution,
+				host=args.host
+			)
+		except ValueError as query_error:
+			parser.exit(2, "raspimon query: " + str(query_error) + "\n")
+		print(json.dumps(result) if args.json else Query.render(result))
+	elif args.outbox:
+		Outbox.drain_due()
+	elif args.push:
+		from modules.comms.Pusher import Pusher
+		try:
+			Alarms.init()
+			Pusher.push(Alarms.config.get(Alarms.KEY_PUSH) or {})
+		finally:
+			Outbox.kick_spooled()
+	elif args.collector:
+		from modules.collector.Collector import Collector
+		Collector.serve(listen=args.listen)
+	elif args.daemon:
+		from modules.daemon.Daemon import Daemon
+		Daemon.run(exporter=args.exporter)
+	else:
+		Logger.execution_log()
+		Instrument.start()
+		try:
+			# Loads the configuration and storage itself
+			alarms = Alarms.check()
+			# print(PiAlarms.summarize( alarms=alarms ))
+			if alarms is not None and len(alarms) > 0:
+				Alarms.notify(alarms)
+
+			# The run's own overhead, stored (and alarmable) as raspimon.* metrics
+			Alarms.notify(Alarms.check_self())
+
+			Logger.execution_log(False, stats=Instrument.last)
+		finally:
+			# One drain process for whatever this run spooled, even if it
+			# died on a bad config, or for a retry of an earlier run's
+			Outbox.kick_spooled()